@@ -2,7 +2,21 @@ from datetime import datetime, timedelta
 from collections import defaultdict
 from statistics import mean
 
-def calculate_analytics(pdf_collection, period="month", user_id=None):
+from metrics import timed
+
+ANALYTICS_FIELDS = ["name", "contractAmount", "issueDate"]
+
+# Records stored without an extraction (bulk_ingest --no-extract) carry this
+# ai_data.extractionMethod; they are neither analysed nor reused
+SKIPPED_EXTRACTION = "skipped"
+EXTRACTED_QUERY = {"ai_data.extractionMethod": {"$ne": SKIPPED_EXTRACTION}}
+
+
+def was_extracted(rec):
+    return (rec.get("ai_data") or {}).get("extractionMethod") != SKIPPED_EXTRACTION
+
+
+def _analytics_query(period, user_id):
     days = {"day": 0, "week": 7, "month": 30, "all": 10000}
     now = datetime.utcnow()
 
@@ -16,17 +30,131 @@ def calculate_analytics(pdf_collection, period="month", user_id=None):
     query = {"timestamp": {"$gte": cutoff}} if period != "all" else {}
     if user_id:
         query["user_id"] = user_id
+    return query
 
-    records = list(pdf_collection.find(query))
 
-    if not records:
-        return {
-            "total_pdfs": 0,
-            "field_confidences": {},
-            "top_review_fields": [],
-            "lowest_accuracy_pdf": None
+def _empty_analytics():
+    return {
+        "total_pdfs": 0,
+        "field_confidences": {},
+        "top_review_fields": [],
+        "lowest_accuracy_pdf": None
+    }
+
+
+# ---------- aggregation expression helpers ----------
+def _value(path):
+    # Missing fields become null so comparisons behave like dict.get()
+    return {"$ifNull": [path, None]}
+
+
+def _truthy(expr):
+    return {"$not": [{"$in": [expr, [None, "", 0, False, [], {}]]}]}
+
+
+def _as_text(expr):
+    # $toString raises on arrays and objects (and would abort the whole
+    # $facet); those are compared as they are instead of as text
+    text = {"$convert": {"input": expr, "to": "string", "onError": None, "onNull": None}}
+    return {"$let": {"vars": {"text": text}, "in": {
+        "$cond": [{"$eq": ["$$text", None]}, expr, {"$trim": {"input": "$$text"}}]
+    }}}
+
+
+def _differs(user_expr, ai_expr):
+    return {"$ne": [_as_text(user_expr), _as_text(ai_expr)]}
+
+
+def _review_flag(field):
+    """1 when the AI had a value for `field` and the user replaced it."""
+    ai_val, user_val = _value(f"$ai.{field}"), _value(f"$ud.{field}")
+    return {"$cond": [
+        {"$and": [_truthy(ai_val), _truthy(user_val), _differs(user_val, ai_val)]}, 1, 0
+    ]}
+
+
+def _correction_flag(field):
+    """1 when the user set `field` to something other than the AI value."""
+    user_val = _value(f"$ud.{field}")
+    ai_val = {"$ifNull": [f"$ai.{field}", ""]}
+    return {"$cond": [{"$and": [_truthy(user_val), _differs(user_val, ai_val)]}, 1, 0]}
+
+
+def analytics_pipeline(query):
+    """Single aggregation producing everything calculate_analytics returns."""
+    group = {"_id": None, "total": {"$sum": 1}}
+    for field in ANALYTICS_FIELDS:
+        group[f"conf_{field}"] = {"$avg": {"$convert": {
+            "input": f"$fc.{field}", "to": "double", "onError": None, "onNull": None
+        }}}
+        group[f"review_{field}"] = {"$sum": _review_flag(field)}
+
+    return [
+        {"$match": {**query, **EXTRACTED_QUERY}},
+        # Only the fields analytics reads ever leave the storage engine
+        {"$project": {
+            "pdfName": 1,
+            "fc": "$ai_data.field_confidences",
+            "ai": {f: f"$ai_data.{f}" for f in ANALYTICS_FIELDS},
+            "ud": {f: f"$user_updated_data.{f}" for f in ANALYTICS_FIELDS}
+        }},
+        {"$facet": {
+            "totals": [{"$group": group}],
+            "lowest": [
+                {"$project": {
+                    "pdfName": 1,
+                    "corrected": {"$add": [_correction_flag(f) for f in ANALYTICS_FIELDS]}
+                }},
+                {"$match": {"corrected": {"$gt": 0}}},
+                {"$sort": {"corrected": -1, "_id": 1}},
+                {"$limit": 1}
+            ]
+        }}
+    ]
+
+
+@timed("analytics_aggregate")
+def calculate_analytics(pdf_collection, period="month", user_id=None):
+    query = _analytics_query(period, user_id)
+    result = next(pdf_collection.aggregate(analytics_pipeline(query)), None)
+
+    totals = result["totals"][0] if result and result["totals"] else None
+    if not totals or not totals["total"]:
+        return _empty_analytics()
+
+    field_avg_conf = {
+        f: round(totals[f"conf_{f}"], 2)
+        for f in ANALYTICS_FIELDS
+        if totals.get(f"conf_{f}") is not None
+    }
+    reviews = {f: totals[f"review_{f}"] for f in ANALYTICS_FIELDS if totals[f"review_{f}"]}
+    top_fields_review = sorted(reviews, key=reviews.get, reverse=True)[:3]
+
+    lowest_accuracy_pdf = {"pdfName": None, "accuracy": 100.0}
+    if result["lowest"]:
+        lowest = result["lowest"][0]
+        lowest_accuracy_pdf = {
+            "pdfName": lowest.get("pdfName"),
+            "accuracy": round(((3 - lowest["corrected"]) / 3) * 100, 2)
         }
 
+    return {
+        "total_pdfs": totals["total"],
+        "field_confidences": field_avg_conf,
+        "top_review_fields": top_fields_review,
+        "lowest_accuracy_pdf": lowest_accuracy_pdf
+    }
+
+
+def calculate_analytics_scan(pdf_collection, period="month", user_id=None):
+    """Original client-side implementation; kept as the benchmark baseline."""
+    query = _analytics_query(period, user_id)
+
+    records = list(pdf_collection.find({**query, **EXTRACTED_QUERY}))
+
+    if not records:
+        return _empty_analytics()
+
     total_pdfs = len(records)
     field_confidence = defaultdict(list)
     manual_reviews = defaultdict(int)
@@ -36,14 +164,16 @@ def calculate_analytics(pdf_collection, period="month", user_id=None):
         ai_data = rec.get("ai_data", {})
         user_data = rec.get("user_updated_data", {})
 
-     
-        for field in ["name", "contractAmount", "issueDate"]:
+
+        for field in ANALYTICS_FIELDS:
             ai_conf = ai_data.get("field_confidences", {}).get(field)
             if ai_conf is not None:
                 try:
-                    field_confidence[field].append(float(ai_conf))
+                    conf = float(ai_conf)
                 except ValueError:
                     pass  # skip non-numeric
+                else:
+                    field_confidence[field].append(conf)
 
             ai_val = ai_data.get(field)
             user_val = user_data.get(field)
@@ -53,7 +183,7 @@ def calculate_analytics(pdf_collection, period="month", user_id=None):
                     manual_reviews[field] += 1
 
         corrected = sum(
-            1 for f in ["name", "contractAmount", "issueDate"]
+            1 for f in ANALYTICS_FIELDS
             if user_data.get(f) and str(user_data[f]).strip() != str(ai_data.get(f, "")).strip()
         )
         accuracy = round(((3 - corrected) / 3) * 100, 2)
@@ -65,7 +195,9 @@ def calculate_analytics(pdf_collection, period="month", user_id=None):
             }
 
     field_avg_conf = {k: round(mean(v), 2) for k, v in field_confidence.items()}
-    top_fields_review = sorted(manual_reviews, key=manual_reviews.get, reverse=True)[:3]
+    # Ties keep ANALYTICS_FIELDS order, as in the aggregation and the rollups
+    reviews = {f: manual_reviews[f] for f in ANALYTICS_FIELDS if manual_reviews[f]}
+    top_fields_review = sorted(reviews, key=reviews.get, reverse=True)[:3]
 
     return {
         "total_pdfs": total_pdfs,
@@ -1,22 +1,43 @@
+import time
+_boot_started = time.perf_counter()
+
 import os
 import json
 import uuid
+import base64
+import re
+import hashlib
+import threading
 import logging
 from datetime import timedelta, datetime
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask import send_from_directory
 from flask_cors import CORS
 from dotenv import load_dotenv
-from pymongo import MongoClient
 from werkzeug.security import generate_password_hash, check_password_hash
-import fitz  # PyMuPDF
+from werkzeug.exceptions import HTTPException, RequestEntityTooLarge
 from dateutil import parser as dateparser
-from openai import AzureOpenAI
-import requests
 from Analytics import (
-    calculate_analytics,
+    calculate_analytics, EXTRACTED_QUERY,
+)
+from chunking import iter_chunks
+from rate_limit import call_with_limit, estimate_tokens, priority, limiter, RATE_LIMIT_COMPLETION_TOKENS
+from field_rules import run_rules, rules_suffice, fill_missing
+from ingest_pdf import push_chunks_to_search, extract_pages, summarize_pages, get_embeddings_cached
+from retrieval import get_backend
+from chat_cache import AnswerCache
+from db_indexes import ensure_indexes
+from rollups import apply_change, rollups_ready, analytics_from_rollups, trends_from_rollups
+from jobs import create_job_queue, QueueFull
+from embedding_cache import cache_stats
+from ocr import needs_ocr, apply_ocr
+from long_doc import is_long_document, run_map_reduce
+from clients import LazyProxy, openai_client, mongo_db, collection_proxy, blob_container, lazy_import, startup_report
+from metrics import span, timed, init_app as init_metrics, EXTRACT_MEMORY_MB
+from pipeline import Pipeline
+from large_files import (
+    MemoryWatch, MemoryLimitExceeded, upload_size, use_large_file_mode, spool_upload, remove_spool
 )
-from ingest_pdf import push_chunks_to_search
 # ------------------ CONFIG ------------------
 load_dotenv()
 
@@ -24,37 +45,53 @@ app = Flask(__name__, static_folder="frontend/build", static_url_path="")
 
 from flask_cors import CORS
 
+CORS_ORIGINS = [
+    "http://localhost:3000",
+    "https://smartdoc.azurewebsites.net"
+]
 CORS(app, supports_credentials=True, resources={
     r"/*": {
-        "origins": [
-            "http://localhost:3000",
-            "https://smartdoc.azurewebsites.net"
-        ]
+        "origins": CORS_ORIGINS
     }
 })
 
-
+# Stage timings: /metrics, Server-Timing headers, X-Debug-Profile (see metrics.py)
+init_metrics(app)
 
 
 logging.basicConfig(level=logging.INFO)
 
-# Azure OpenAI Setup
-client_azure = AzureOpenAI(
-    api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-    api_version=os.getenv("AZURE_API_VERSION")
-)
+# Azure OpenAI Setup (built per worker process on first use, see clients.py)
+client_azure = LazyProxy(openai_client)
 DEPLOYMENT_NAME = os.getenv("AZURE_GPT_DEPLOYMENT")
 # MongoDB Setup
-mongo_client = MongoClient(os.getenv("MONGO_URI"))
-db = mongo_client["pdf_data"]
-pdf_collection = db["extracted_data"]
-users_collection = db["users"]
+db = LazyProxy(mongo_db)
+pdf_collection = collection_proxy("extracted_data")
+users_collection = collection_proxy("users")
+rollup_collection = collection_proxy("analytics_rollups")
+
+# Create missing indexes in the background so a slow Mongo doesn't hold up worker boot
+if os.getenv("MONGO_ENSURE_INDEXES", "true").lower() in ("1", "true", "yes"):
+    threading.Thread(target=ensure_indexes, args=(db,), name="ensure-indexes", daemon=True).start()
 
-# Azure Search Setup
-AZURE_SEARCH_ENDPOINT = os.getenv("AZURE_SEARCH_ENDPOINT")
-AZURE_SEARCH_KEY = os.getenv("AZURE_SEARCH_API_KEY")
-AZURE_SEARCH_INDEX = os.getenv("AZURE_SEARCH_INDEX_NAME")
+# Reject uploads above this size before reading them (413); unset = no limit
+if os.getenv("EXTRACT_MAX_UPLOAD_MB"):
+    app.config["MAX_CONTENT_LENGTH"] = int(float(os.getenv("EXTRACT_MAX_UPLOAD_MB")) * 1024 * 1024)
+
+# Async extraction: default mode for /extract when the request doesn't say
+EXTRACT_ASYNC_DEFAULT = os.getenv("EXTRACT_ASYNC_DEFAULT", "false")
+
+# Index search chunks after the response instead of before it. Chat on a
+# just-extracted PDF then answers from the extraction summary, uncached,
+# until the chunks land; the record's indexStatus goes from "pending" to
+# "done" or "failed" when the deferred stage finishes.
+EXTRACT_DEFER_INDEXING = os.getenv("EXTRACT_DEFER_INDEXING", "false").lower() in ("1", "true", "yes")
+
+# Bump whenever the extraction prompt, output or indexed chunks change, so
+# stored results from an older pipeline are never reused for identical uploads
+#   v2: token-window chunks with overlap, replacing page-sized chunks
+#   v3: field rules run before GPT and may answer without it
+EXTRACTION_VERSION = "extract-v3"
 
 
 # ------------------ SIGNUP ------------------
@@ -120,107 +157,19 @@ def format_ai_data(ai_data):
         logging.warning(f"⚠️ format_ai_data() failed: {e}")
         return ai_data
 
-#-------------------------image to text -------------------------
-def extract_text_with_tesseract(file_path):
-    from pdf2image import convert_from_path
-    import pytesseract
-    from pytesseract import pytesseract as tesseract_cmd
-
-    # ✅ Tell pytesseract where tesseract.exe is
-    tesseract_cmd.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
-
-    try:
-        # ✅ Convert each page of PDF to image
-        images = convert_from_path(file_path, dpi=300, poppler_path=r"C:\poppler-24.08.0\Library\bin")
-        all_text = []
-
-        for img in images:
-            # ✅ OCR each image page
-            text = pytesseract.image_to_string(img)
-            all_text.append(text)
-
-        return "\n".join(all_text)
-    except Exception as e:
-        logging.error(f"❌ Tesseract OCR failed: {e}")
-        return ""
-
-
-
-# ------------------ PDF EXTRACTION ------------------
-# ------------------ PDF EXTRACTION ------------------
-@app.route("/extract", methods=["POST"])
-def extract_data():
-    try:
-        file = request.files.get("pdf")
-        if not file:
-            return jsonify({"error": "No PDF file provided"}), 400
-
-        pdf_id = str(uuid.uuid4())
-        if not file or file.filename == "":
-            logging.error("❌ No PDF file uploaded.")
-            return jsonify({"error": "No PDF file uploaded"}), 400
-
-        filename = (file.filename or f"uploaded_{uuid.uuid4()}.pdf").replace(" ", "_")
-
-
-
-        from azure.storage.blob import BlobServiceClient
-        from io import BytesIO
-
-        BLOB_CONN_STR = os.getenv("AZURE_BLOB_CONNECTION_STRING")
-        BLOB_CONTAINER = os.getenv("AZURE_STORAGE_CONTAINER")
-        blob_service = BlobServiceClient.from_connection_string(BLOB_CONN_STR)
-        container_client = blob_service.get_container_client(BLOB_CONTAINER)
-
-        # Upload to Azure Blob
-        blob_name = f"{uuid.uuid4()}_{filename}"
-        blob_client = container_client.get_blob_client(blob_name)
-        blob_client.upload_blob(file, overwrite=True)
-
-        # Download file into memory
-        file_stream = BytesIO()
-        blob_client.download_blob().readinto(file_stream)
-        file_stream.seek(0)
-
-        text = ""
-        word_count = 0
-        empty_pages = 0
-
-        pdf_file = fitz.open(stream=file_stream.read(), filetype="pdf")
+# ------------------ OPENAI CALLS ------------------
+def create_chat_completion(**kwargs):
+    """client_azure.chat.completions.create, queued behind the shared rate limiter."""
+    tokens = estimate_tokens(
+        kwargs.get("messages"), completion_tokens=kwargs.get("max_tokens") or RATE_LIMIT_COMPLETION_TOKENS
+    )
+    # Only the SDK call is the "openai" stage; the limiter records its own wait.
+    # For streamed calls this covers the wait for the stream to open, not the whole answer
+    return call_with_limit(DEPLOYMENT_NAME, tokens, timed("openai")(client_azure.chat.completions.create), **kwargs)
 
-        # Push chunks to Azure Cognitive Search
-        chunks = [page.get_text().strip() for page in pdf_file if page.get_text().strip()]
-        push_chunks_to_search(chunks, source_name=filename)
 
-        page_count = len(pdf_file)
-
-        # Count words & detect empty pages
-        file_stream.seek(0)
-        pdf_file = fitz.open(stream=file_stream.read(), filetype="pdf")
-        for page in pdf_file:
-            page_text = page.get_text().strip()
-            if not page_text:
-                empty_pages += 1
-            else:
-                text += page_text + "\n"
-                word_count += len(page_text.split())
-
-        empty_ratio = empty_pages / page_count
-
-        # OCR fallback
-        if word_count < 30 or empty_ratio > 0.5:
-            logging.warning(
-                f"⚠️ Detected scanned PDF (word_count={word_count}, empty_pages={empty_pages}/{page_count}) — using Tesseract OCR fallback."
-            )
-            import tempfile
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-                tmp.write(file_stream.getvalue())
-                tmp_path = tmp.name
-            text = extract_text_with_tesseract(tmp_path)
-            word_count = len(text.split())
-
-        # GPT prompt for structured data extraction
-        prompt = f"""
+# ------------------ EXTRACTION PROMPT ------------------
+EXTRACTION_PROMPT = """
 You are a professional document parser AI. Your task is to extract **structured information** from health insurance policy documents, regardless of how messy or inconsistent the text may be.
 
 Use the following schema to return the extracted data as pure JSON only (no extra text):
@@ -275,113 +224,509 @@ Use the following schema to return the extracted data as pure JSON only (no extr
 """
 
 
+def build_extraction_prompt(text):
+    return EXTRACTION_PROMPT.format(text=text)
 
-        response = client_azure.chat.completions.create(
-            model=DEPLOYMENT_NAME,
-            messages=[
-                {"role": "system", "content": "You extract structured data from contracts, even if the format is messy."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.2
-        )
 
-        extracted_data = response.choices[0].message.content.strip()
+def extraction_messages(text):
+    return [
+        {"role": "system", "content": "You extract structured data from contracts, even if the format is messy."},
+        {"role": "user", "content": build_extraction_prompt(text)}
+    ]
+
+
+def parse_extraction_output(extracted_data):
+    """Model output -> (parsed JSON or None, raw model output)."""
+    # Clean JSON
+    cleaned = re.sub(r"^```(?:json)?|```$", "", extracted_data.strip(), flags=re.MULTILINE).strip()
+    match = re.search(r"\{.*\}", cleaned, re.DOTALL)
+    cleaned = match.group(0) if match else extracted_data
+
+    try:
+        return json.loads(cleaned), extracted_data
+    except json.JSONDecodeError:
+        logging.error(f"⚠️ Invalid JSON from model: {cleaned}")
+        return None, extracted_data
+
+
+def request_extraction(text):
+    """One GPT extraction call; returns (parsed JSON or None, raw model output)."""
+    response = create_chat_completion(
+        model=DEPLOYMENT_NAME,
+        messages=extraction_messages(text),
+        temperature=0.2
+    )
+    return parse_extraction_output(response.choices[0].message.content.strip())
+
+
+def flatten_extraction(parsed_data, text, rules=None):
+    """Flatten the model's JSON, fill premium gaps from the field rules and format dates."""
+    parsed_data = fill_missing(dict(parsed_data), rules if rules is not None else run_rules(text))
+    flattened = {
+        "policyholderName": parsed_data.get("policyholderName", {}).get("value"),
+        "policyholderName_confidence": parsed_data.get("policyholderName", {}).get("confidence", 0),
+        "issueDateRaw": parsed_data.get("issueDateRaw"),
+        "issueDate": parsed_data.get("issueDate", {}).get("value"),
+        "issueDate_confidence": parsed_data.get("issueDate", {}).get("confidence", 0),
+        "expirationDateRaw": parsed_data.get("expirationDateRaw"),
+        "expirationDate": parsed_data.get("expirationDate", {}).get("value"),
+        "expirationDate_confidence": parsed_data.get("expirationDate", {}).get("confidence", 0),
+        "providerName": parsed_data.get("providerName", {}).get("value"),
+        "providerName_confidence": parsed_data.get("providerName", {}).get("confidence", 0),
+        "policyholderAddress": parsed_data.get("policyholderAddress", {}).get("value"),
+        "policyholderAddress_confidence": parsed_data.get("policyholderAddress", {}).get("confidence", 0),
+        "policyNumber": parsed_data.get("policyNumber", {}).get("value"),
+        "policyNumber_confidence": parsed_data.get("policyNumber", {}).get("confidence", 0),
+        "premiumAmount": parsed_data.get("premiumAmount", {}).get("value"),
+        "premiumAmount_confidence": parsed_data.get("premiumAmount", {}).get("confidence", 0),
+        "deductibles": parsed_data.get("deductibles", {}).get("value"),
+        "deductibles_confidence": parsed_data.get("deductibles", {}).get("confidence", 0),
+        "termsAndExclusions": parsed_data.get("termsAndExclusions"),
+    }
+    # Format extracted dates to DD-MM-YYYY
+    for field in ["issueDate", "expirationDate"]:
+        if flattened.get(field):
+            try:
+                dt = dateparser.parse(flattened[field], fuzzy=True)
+                flattened[field] = dt.strftime("%d-%m-%Y")
+            except Exception as e:
+                logging.warning(f"⚠️ Could not format {field}: {e}")
+
+    return format_ai_data(flattened)
+
+
+def extract_with_rules(text):
+    """Run the field rules; returns (rules, ai_data), ai_data being None when GPT is still needed."""
+    rules = run_rules(text)
+    if not rules_suffice(rules):
+        return rules, None
+    logging.info(f"⚡ Field rules ({rules['_template'] or 'generic'}) cleared every required field — skipping GPT")
+    parsed_data = flatten_extraction(rules, text, rules)
+    parsed_data["extractionMethod"] = "rules"
+    return rules, parsed_data
+
+
+def finish_extraction(parsed_data, extracted_data, text, rules):
+    """ai_data from the model's parsed output, or the raw output when it wasn't JSON."""
+    if parsed_data is not None:
+        parsed_data = flatten_extraction(parsed_data, text, rules)
+        parsed_data["extractionMethod"] = "llm"
+        return parsed_data
+    return {"raw_output": extracted_data}
+
+
+@timed("llm")
+def extract_fields(pages, text):
+    """Field rules first; GPT (one call, or map-reduce for long documents) when they fall short."""
+    rules, parsed_data = extract_with_rules(text)
+    if parsed_data is not None:
+        return parsed_data
+
+    if is_long_document(pages):
+        logging.info(f"📚 Long document ({len(pages)} pages) — using map-reduce extraction")
+        parsed_data, extracted_data = run_map_reduce(pages, request_extraction)
+    else:
+        parsed_data, extracted_data = request_extraction(text)
+    return finish_extraction(parsed_data, extracted_data, text, rules)
 
-        # Clean JSON
-        import re
-        cleaned = re.sub(r"^```(?:json)?|```$", "", extracted_data.strip(), flags=re.MULTILINE).strip()
-        match = re.search(r"\{.*\}", cleaned, re.DOTALL)
-        cleaned = match.group(0) if match else extracted_data
 
-        # Parse and flatten JSON
+# ------------------ PDF EXTRACTION ------------------
+# The /extract stages, shared by run_extraction and the async pipeline in asgi.py.
+# A `source` is the PDF's bytes, or the path of a copy spooled to disk in
+# large-file mode; from a path nothing loads the whole file.
+def stage_progress(progress, memory=None):
+    """progress(stage, percent) that first checks `memory` (a MemoryWatch) against its ceiling.
+
+    Stages overlap, so only forward movement is reported.
+    """
+    report = progress or (lambda stage, percent: None)
+    reached = [0]
+
+    def checked(stage, percent):
+        if memory is not None:
+            memory.check(stage)
+        if percent is not None and percent > reached[0]:
+            reached[0] = percent
+            report(stage, percent)
+    return checked
+
+
+def upload_to_blob(source, filename):
+    """Store the upload in Azure Blob (streamed from disk for a path); returns the blob client."""
+    blob_client = blob_container().get_blob_client(f"{uuid.uuid4()}_{filename}")
+    with span("blob_upload"):
+        if isinstance(source, str):
+            with open(source, "rb") as f:
+                blob_client.upload_blob(f, overwrite=True)
+        else:
+            blob_client.upload_blob(source, overwrite=True)
+    return blob_client
+
+
+def parse_pdf(source):
+    """Parse once; every later stage reads from the page records. Returns (pages, stats)."""
+    with span("parse"):
+        pages = extract_pages(source)
+        return pages, summarize_pages(pages)
+
+
+def ocr_if_needed(source, pages, stats):
+    """OCR fallback — only the pages the text layer left empty. Returns the updated stats."""
+    if not needs_ocr(stats):
+        return stats
+
+    logging.warning(
+        f"⚠️ Detected scanned PDF (word_count={stats['word_count']}, empty_pages={stats['empty_pages']}/{stats['page_count']}) — using Tesseract OCR fallback."
+    )
+    if isinstance(source, str):
+        with span("ocr"):
+            apply_ocr(pages, source)
+    else:
+        import tempfile
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
+            tmp.write(source)
+            tmp_path = tmp.name
         try:
-            parsed_data = json.loads(cleaned)
-            flattened = {
-                "policyholderName": parsed_data.get("policyholderName", {}).get("value"),
-                "policyholderName_confidence": parsed_data.get("policyholderName", {}).get("confidence", 0),
-                "issueDateRaw": parsed_data.get("issueDateRaw"),
-                "issueDate": parsed_data.get("issueDate", {}).get("value"),
-                "issueDate_confidence": parsed_data.get("issueDate", {}).get("confidence", 0),
-                "expirationDateRaw": parsed_data.get("expirationDateRaw"),
-                "expirationDate": parsed_data.get("expirationDate", {}).get("value"),
-                "expirationDate_confidence": parsed_data.get("expirationDate", {}).get("confidence", 0),
-                "providerName": parsed_data.get("providerName", {}).get("value"),
-                "providerName_confidence": parsed_data.get("providerName", {}).get("confidence", 0),
-                "policyholderAddress": parsed_data.get("policyholderAddress", {}).get("value"),
-                "policyholderAddress_confidence": parsed_data.get("policyholderAddress", {}).get("confidence", 0),
-                "policyNumber": parsed_data.get("policyNumber", {}).get("value"),
-                "policyNumber_confidence": parsed_data.get("policyNumber", {}).get("confidence", 0),
-                "premiumAmount": parsed_data.get("premiumAmount", {}).get("value"),
-                "premiumAmount_confidence": parsed_data.get("premiumAmount", {}).get("confidence", 0),
-                "deductibles": parsed_data.get("deductibles", {}).get("value"),
-                "deductibles_confidence": parsed_data.get("deductibles", {}).get("confidence", 0),
-                "termsAndExclusions": parsed_data.get("termsAndExclusions"),
-            }
-            # Always extract Premium from the Policy Schedule line explicitly
-            import re
-
-# 👇 Fallback logic if GPT misses the values
-
-# Premium Amount (Total Sum Assured or Maturity)
-            if not flattened.get("premiumAmount"):
-                match = re.search(
-                    r"(sum assured|total benefit|maturity amount)[^\n]*?(Rs\.?\s*[\d,]+)",
-                    text,
-                    re.IGNORECASE
-                )
-                if match:
-                    flattened["premiumAmount"] = match.group(2).strip()
-                    flattened["premiumAmount_confidence"] = 75
-
-# Deductibles (Recurring Premiums)
-            if not flattened.get("deductibles"):
-                match = re.search(
-                    r"(premium(?: per| payable)?(?:.*)?)[^\n]*?(Rs\.?\s*[\d,]+\s*(?:monthly|quarterly|annually|yearly)?)",
-                    text,
-                    re.IGNORECASE
-                )
-                if match:
-                    flattened["deductibles"] = match.group(2).strip()
-                    flattened["deductibles_confidence"] = 70
-
-
-
-            # Format extracted dates to DD-MM-YYYY
-            for field in ["issueDate", "expirationDate"]:
-                if flattened.get(field):
-                    try:
-                        dt = dateparser.parse(flattened[field], fuzzy=True)
-                        flattened[field] = dt.strftime("%d-%m-%Y")
-                    except Exception as e:
-                        logging.warning(f"⚠️ Could not format {field}: {e}")
-
-            parsed_data = format_ai_data(flattened)
-
-        except json.JSONDecodeError:
-            logging.error(f"⚠️ Invalid JSON from model: {cleaned}")
-            parsed_data = {"raw_output": extracted_data}
-
-        # Save to MongoDB
-        user_id = request.form.get("user_id")
-        if not user_id:
-            return jsonify({"error": "Missing user_id in form data"}), 400
+            with span("ocr"):
+                apply_ocr(pages, tmp_path)
+        finally:
+            os.remove(tmp_path)
+    return summarize_pages(pages)
 
-        user_id = request.form.get("user_id")
-        pdf_collection.insert_one({
+
+def index_pages(pages, search_source, replace=True):
+    """Push chunks to Azure Cognitive Search under the document's search source."""
+    with span("index"):
+        return push_chunks_to_search(list(iter_chunks(pages)), source_name=search_source, replace=replace)
+
+
+def search_source(fingerprint, pdf_id):
+    """Retrieval key for a document: identical bytes share chunks, different files never do."""
+    return fingerprint or pdf_id
+
+
+def indexed_before(fingerprint, pdf_id):
+    """Whether another record already put chunks under this document's search source.
+
+    When none did, the index stage has no stale chunks to look for.
+    """
+    if not fingerprint:
+        return False  # the source is this upload's fresh pdf_id
+    prior = pdf_collection.find_one(
+        {"fingerprint": fingerprint, "searchSource": fingerprint, "pdf_id": {"$ne": pdf_id}}, {"_id": 1}
+    )
+    return prior is not None
+
+
+def index_fields(status=None, error=None):
+    """Record fields for an index stage's outcome: its per-document upload status, or the error it raised."""
+    failed = [entry.get("error") for entry in (status or {}).values() if not entry["succeeded"]]
+    if error is None and failed:
+        error = f"{len(failed)} of {len(status)} chunks failed: {failed[0]}"
+    if error is not None:
+        return {"indexStatus": "failed", "indexError": str(error)}
+    return {"indexStatus": "done", "indexedAt": datetime.utcnow(), "indexError": None}
+
+
+def record_index_status(fingerprint, pdf_id, fields):
+    """Set a deferred index outcome on every record reading those chunks, linked copies included."""
+    key = search_source(fingerprint, pdf_id)
+    query = {"fingerprint": fingerprint, "searchSource": key} if fingerprint else {"pdf_id": pdf_id}
+    with span("mongo_update"):
+        pdf_collection.update_many(query, {"$set": fields})
+
+
+def index_deferred(pages, fingerprint, pdf_id):
+    """index_pages for the deferred stage, which runs after the record is saved."""
+    try:
+        status = index_pages(pages, search_source(fingerprint, pdf_id), replace=indexed_before(fingerprint, pdf_id))
+    except Exception as e:
+        record_index_status(fingerprint, pdf_id, index_fields(error=e))
+        raise
+    record_index_status(fingerprint, pdf_id, index_fields(status))
+    return status
+
+
+def save_extraction(parsed_data, stats, filename, user_id, pdf_id, fingerprint=None, index=None):
+    """Save to MongoDB and fold the record into the analytics rollups.
+
+    `index` holds index_fields() when the chunks were uploaded first; without
+    it the record is "pending" until the deferred index stage reports back.
+    """
+    record = {
+        "pdf_id": pdf_id,
+        "pdfName": filename,
+        "ai_data": parsed_data,
+        "pageCount": stats["page_count"],
+        "wordCount": stats["word_count"],
+        "timestamp": datetime.utcnow(),
+        "user_id": user_id,
+        "fingerprint": fingerprint,
+        "extractionVersion": EXTRACTION_VERSION,
+        "searchSource": search_source(fingerprint, pdf_id),
+        **(index or {"indexStatus": "pending", "indexedAt": None})
+    }
+    with span("mongo_insert"):
+        pdf_collection.insert_one(record)
+    with span("rollup"):
+        apply_change(pdf_collection, rollup_collection, new=record)
+    return record
+
+
+def run_extraction(source, filename, user_id, pdf_id, progress=None, fingerprint=None, memory=None,
+                   defer_index=EXTRACT_DEFER_INDEXING):
+    """Full /extract pipeline for one PDF; returns the flattened ai_data.
+
+    Runs inline for synchronous requests and inside the job workers for
+    async ones. `progress(stage, percent)` is called as stages start, and
+    `memory` (a large_files.MemoryWatch) is checked against its ceiling there.
+    """
+    pipeline = Pipeline()
+    pipeline.add("blob", lambda: upload_to_blob(source, filename), percent=10)
+    pipeline.add("parse", lambda: parse_pdf(source), percent=20)
+    pipeline.add("ocr", lambda parsed: (parsed[0], ocr_if_needed(source, *parsed)), after=("parse",), percent=30)
+    if defer_index:
+        pipeline.add("index", lambda ocred: index_deferred(ocred[0], fingerprint, pdf_id), after=("ocr",),
+                     percent=50, deferred=True)
+    else:
+        pipeline.add("index", lambda ocred: index_pages(
+            ocred[0], search_source(fingerprint, pdf_id), replace=indexed_before(fingerprint, pdf_id)
+        ), after=("ocr",), percent=50)
+    pipeline.add("llm", lambda ocred: extract_fields(ocred[0], ocred[1]["text"]), after=("ocr",), percent=60)
+    # Waits for the blob (and an inline index) too, so a failed upload still fails the request
+    # before anything is recorded
+    pipeline.add("save", lambda parsed_data, ocred, blob_client, *indexed: save_extraction(
+        parsed_data, ocred[1], filename, user_id, pdf_id, fingerprint,
+        index=index_fields(indexed[0]) if indexed else None
+    ), after=("llm", "ocr", "blob") + (() if defer_index else ("index",)), percent=90)
+
+    return pipeline.run(stage_progress(progress, memory))["llm"]
+
+
+# ------------------ DUPLICATE UPLOADS ------------------
+def fingerprint_upload(file, chunk_size=1024 * 1024):
+    """sha256 of the uploaded bytes, read in chunks; rewinds the stream after."""
+    digest = hashlib.sha256()
+    stream = file.stream
+    for chunk in iter(lambda: stream.read(chunk_size), b""):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+# Stored extractions an identical upload may reuse: neither unparsed model
+# output nor a bulk record saved without extraction
+REUSABLE_EXTRACTION = {"ai_data.raw_output": {"$exists": False}, **EXTRACTED_QUERY}
+
+
+def reuse_prior_extraction(fingerprint, filename, user_id, pdf_id):
+    """Link a new pdf_id to a completed extraction of the same bytes, if any.
+
+    Returns the reused ai_data, or None when the upload must be processed.
+    """
+    prior = pdf_collection.find_one(
+        {"fingerprint": fingerprint, "extractionVersion": EXTRACTION_VERSION, **REUSABLE_EXTRACTION},
+        {"pdf_id": 1, "ai_data": 1, "pageCount": 1, "wordCount": 1, "searchSource": 1,
+         "indexStatus": 1, "indexedAt": 1, "indexError": 1}
+    )
+    if not prior:
+        return None
+
+    record = {
+        "pdf_id": pdf_id,
+        "pdfName": filename,
+        "ai_data": prior["ai_data"],
+        "pageCount": prior.get("pageCount"),
+        "wordCount": prior.get("wordCount"),
+        "timestamp": datetime.utcnow(),
+        "user_id": user_id,
+        "fingerprint": fingerprint,
+        "extractionVersion": EXTRACTION_VERSION,
+        "searchSource": prior.get("searchSource"),
+        # Shares the prior's chunks, so also its index state (still updated while "pending")
+        "indexStatus": prior.get("indexStatus"),
+        "indexedAt": prior.get("indexedAt"),
+        "indexError": prior.get("indexError"),
+        "reusedFrom": prior["pdf_id"]
+    }
+    pdf_collection.insert_one(record)
+    apply_change(pdf_collection, rollup_collection, new=record)
+    logging.info(f"♻️ Reused extraction {prior['pdf_id']} for identical upload {pdf_id}")
+    return prior["ai_data"]
+
+
+def record_memory(memory, filename, spooled):
+    EXTRACT_MEMORY_MB.observe(memory.growth / (1024 * 1024), "spooled" if spooled else "memory")
+    report = memory.report()
+    logging.info(f"🧠 {filename}: peak RSS {report['peak_rss_mb']} MB (+{report['growth_mb']} MB)"
+                 f"{' [large-file mode]' if spooled else ''}")
+
+
+def _run_extraction_job(payload, progress):
+    # The job's upload is already on disk, so jobs always run from the path
+    with MemoryWatch() as memory:
+        parsed_data = run_extraction(
+            payload["path"], payload["filename"], payload["user_id"], payload["pdf_id"],
+            progress, fingerprint=payload.get("fingerprint"), memory=memory
+        )
+    record_memory(memory, payload["filename"], spooled=True)
+    return {"pdf_id": payload["pdf_id"], **parsed_data}
+
+
+extract_jobs = create_job_queue(_run_extraction_job, collection=collection_proxy("extract_jobs"))
+
+# Start this process's job workers at boot rather than on its first upload, so
+# every web worker helps reclaim lapsed jobs. The request hook covers workers
+# forked from a preloaded app (start() is a no-op once running in a process).
+if os.getenv("EXTRACT_WORKERS_AUTOSTART", "true").lower() in ("1", "true", "yes"):
+    extract_jobs.start()
+
+    @app.before_request
+    def _start_extract_workers():
+        extract_jobs.start()
+
+
+# ------------------ /extract STEPS ------------------
+# Shared by this route and asgi.py's, so both frontends validate, reuse,
+# queue and map errors the same way; each only reads the upload its own way.
+def check_extract_form(upload, user_id):
+    """Validate the /extract form; returns (filename, None) or (None, (body, status))."""
+    if not upload:
+        return None, ({"error": "No PDF file provided"}, 400)
+    if not upload.filename:
+        logging.error("❌ No PDF file uploaded.")
+        return None, ({"error": "No PDF file uploaded"}, 400)
+    if not user_id:
+        return None, ({"error": "Missing user_id in form data"}, 400)
+    return upload.filename.replace(" ", "_"), None
+
+
+def reuse_or_queue(upload, fingerprint, filename, user_id, pdf_id, force=False, run_async=False):
+    """Answer an upload without extracting it inline, when possible.
+
+    Returns (body, status, headers) for a reused extraction or a queued job,
+    or None when the caller must run the extraction itself. `upload` is a
+    spooled path (the queue takes it over) or a FileStorage.
+    """
+    if not force:
+        # Identical bytes already extracted with this prompt? Skip the pipeline.
+        reused = reuse_prior_extraction(fingerprint, filename, user_id, pdf_id)
+        if reused is not None:
+            return {"pdf_id": pdf_id, **reused}, 200, {}
+
+    if not run_async:
+        return None
+    try:
+        job_id = extract_jobs.submit_upload(upload, {
             "pdf_id": pdf_id,
-            "pdfName": filename,
-            "ai_data": parsed_data,
-            "pageCount": page_count,
-            "wordCount": word_count,
-            "timestamp": datetime.utcnow(),
-            "user_id": user_id
+            "filename": filename,
+            "user_id": user_id,
+            "fingerprint": fingerprint
         })
+    except QueueFull as e:
+        logging.warning("⚠️ Extraction queue full — shedding upload")
+        return {"error": str(e)}, 503, {"Retry-After": str(e.retry_after)}
+
+    return {
+        "job_id": job_id,
+        "pdf_id": pdf_id,
+        "status": "queued",
+        "status_url": f"/extract/jobs/{job_id}"
+    }, 202, {}
+
+
+def extract_error(e, filename):
+    """(body, status) for an /extract failure past the framework's own HTTP errors."""
+    if isinstance(e, MemoryLimitExceeded):
+        # The upload itself was acceptable; this worker ran out of room for it
+        logging.error(f"❌ {filename}: {e}")
+        return {"error": str(e)}, 503
+    logging.error(f"❌ Error during extraction: {str(e)}")
+    return {"error": str(e)}, 500
+
+
+def _request_flag(name, default="false"):
+    flag = request.form.get(name, request.args.get(name, default))
+    return str(flag).lower() in ("1", "true", "yes")
 
-        return jsonify({"pdf_id": pdf_id, **parsed_data})
+
+@app.route("/extract", methods=["POST"])
+def extract_data():
+    spool_path = None
+    filename = None
+    try:
+        file = request.files.get("pdf")
+        filename, error = check_extract_form(file, request.form.get("user_id"))
+        if error:
+            return jsonify(error[0]), error[1]
+        user_id = request.form.get("user_id")
+        pdf_id = str(uuid.uuid4())
+
+        # Big uploads go to disk once (fingerprinted on the way) and every stage reads that copy
+        if use_large_file_mode(upload_size(file.stream)):
+            with span("spool"):
+                spool_path, fingerprint = spool_upload(file.stream)
+        else:
+            with span("fingerprint"):
+                fingerprint = fingerprint_upload(file)
+
+        reply = reuse_or_queue(spool_path or file, fingerprint, filename, user_id, pdf_id,
+                               force=_request_flag("force"),
+                               run_async=_request_flag("async", EXTRACT_ASYNC_DEFAULT))
+        if reply:
+            body, status, headers = reply
+            return jsonify(body), status, headers
+
+        with MemoryWatch() as memory:
+            parsed_data = run_extraction(
+                spool_path or file.read(), filename, user_id, pdf_id, fingerprint=fingerprint, memory=memory
+            )
+        record_memory(memory, filename, spooled=spool_path is not None)
+        return jsonify({"pdf_id": pdf_id, **parsed_data}), 200, {"X-Peak-RSS-MB": str(memory.report()["peak_rss_mb"])}
+
+    except RequestEntityTooLarge:
+        return jsonify({"error": "Upload too large"}), 413
+
+    except HTTPException as e:
+        # e.g. a malformed multipart body; keep werkzeug's status instead of a 500
+        return jsonify({"error": e.description}), e.code
 
     except Exception as e:
-        logging.error(f"❌ Error during extraction: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+        body, status = extract_error(e, filename)
+        return jsonify(body), status
+
+    finally:
+        # A queued job has already moved its spooled copy away
+        remove_spool(spool_path)
+
+
+@app.route("/extract/jobs/<job_id>", methods=["GET"])
+def extract_job_status(job_id):
+    job = extract_jobs.get(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+
+    return jsonify({
+        "job_id": job_id,
+        "status": job["status"],
+        "stage": job.get("stage"),
+        "progress": job.get("progress", 0),
+        "error": job.get("error"),
+        "result": job.get("result") if job["status"] == "done" else None
+    })
+
+
+@app.route("/extract/jobs/<job_id>/result", methods=["GET"])
+def extract_job_result(job_id):
+    job = extract_jobs.get(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    if job["status"] == "failed":
+        return jsonify({"error": job.get("error")}), 500
+    if job["status"] != "done":
+        return jsonify({"status": job["status"], "progress": job.get("progress", 0)}), 202, {"Retry-After": "5"}
+    return jsonify(job["result"])
+
 
 # ------------------ SAVE EDITED DATA ------------------
 @app.route("/save", methods=["POST"])
@@ -414,50 +759,45 @@ def save():
     if not changes:
         return jsonify({"message": "Data Saved"}), 200
 
+    saved_at = datetime.utcnow()
     result = pdf_collection.update_one(
     {"pdf_id": pdf_id},
     {
         "$set": {
             "user_updated_data": changes,
             "user_id": user_id,  # ensure update preserves user
-            "timestamp": datetime.utcnow()
+            "timestamp": saved_at
         }
     }
 )
+    answer_cache.invalidate(pdf_id)
+    apply_change(
+        pdf_collection, rollup_collection, old=existing,
+        new={**existing, "user_updated_data": changes, "user_id": user_id, "timestamp": saved_at}
+    )
 
 
     return jsonify({"message": "User updated data saved successfully"})
 
 # ------------------ CHATBOT ------------------
-def query_azure_search(question, top_k=5):
-    url = f"{AZURE_SEARCH_ENDPOINT}/indexes/{AZURE_SEARCH_INDEX}/docs/search?api-version=2023-07-01-Preview"
-    headers = {"Content-Type": "application/json", "api-key": AZURE_SEARCH_KEY}
-    body = {"search": question, "top": top_k}
-    try:
-        response = requests.post(url, headers=headers, json=body)
-        response.raise_for_status()
-        results = response.json()
-        return [doc["content"] for doc in results.get("value", [])]
-    except Exception as e:
-        print("❌ Azure Search Query Failed:", e)
-        return []
+CHAT_PROMPT_VERSION = "chat-v1"  # bump when the chat prompt changes; keys the answer cache
+answer_cache = AnswerCache()
 
 
-@app.route("/chat", methods=["POST"])
-def chat():
-    data = request.json
-    pdf_id = data.get("pdf_id")
-    question = data.get("question")
+def query_azure_search(question, top_k=5, source=None, query_vector=None):
+    """Top-k chunks for the question from the configured retrieval backend.
 
-    record = pdf_collection.find_one({"pdf_id": pdf_id})
-    if not record:
-        return jsonify({"error": "PDF data not found"}), 404
+    The question is embedded so both backends can rank by vector similarity;
+    `source` narrows the local backend to one document's rows.
+    """
+    if query_vector is None:
+        with span("embed_question"):
+            query_vector = get_embeddings_cached([question])[0] if question else []
+    with span("search"):
+        return get_backend().search(question, query_vector=query_vector, top_k=top_k, source=source)
 
-    ai_summary = json.dumps(record.get("ai_data", {}), indent=2)
-    search_chunks = query_azure_search(question)
-    full_text = "\n\n---\n\n".join(search_chunks) if search_chunks else ai_summary
 
-    prompt = f"""
+CHAT_PROMPT = """
 You are  —Chatbot a smart, human-like assistant trained to help users understand complex PDFs such as contracts, insurance policies, business reports, or legal documents.
 
 🎯 Your Goal:
@@ -497,24 +837,160 @@ Help the user by answering their question **only using the content of the provid
 💬 Your Answer:
 (Reply naturally like a helpful assistant would. Avoid sounding robotic.)
 """
+CHAT_SYSTEM_MESSAGE = "You are a conversational assistant answering based on PDF content."
+
+
+def prepare_chat(pdf_id, question):
+    """Everything /chat and /chat/stream share up to the model call.
+
+    Returns None when the PDF doesn't exist. Otherwise a dict with the
+    cache `revision`, the question's `query_vector`, a `cached` answer (or
+    None), and the chat `messages` when there was no cache hit. `cacheable`
+    is False when retrieval found no chunks and the answer only saw the
+    extraction summary.
+    """
+    with span("mongo_find"):
+        record = pdf_collection.find_one({"pdf_id": pdf_id})
+    if not record:
+        return None
+
+    # Same question about the same revision of this PDF? Answer from cache.
+    revision = chat_revision(record)
+    with priority("interactive"), span("embed_question"):
+        query_vector = get_embeddings_cached([question])[0] if question else []
+    with span("answer_cache"):
+        cached = answer_cache.get(pdf_id, question, CHAT_PROMPT_VERSION, revision, query_vector)
+    chat = {"revision": revision, "query_vector": query_vector, "cached": cached, "messages": None}
+    if cached is not None:
+        return chat
+
+    search_chunks = query_azure_search(question, source=record.get("searchSource"), query_vector=query_vector)
+    chat["messages"] = chat_messages(record, question, search_chunks)
+    chat["cacheable"] = bool(search_chunks)
+    return chat
+
+
+def chat_revision(record):
+    """What a cached answer depends on: the saved record and, once it lands, its search index."""
+    return f"{record.get('timestamp')}|{record.get('indexedAt')}"
 
 
+def chat_messages(record, question, search_chunks):
+    """The retrieved chunks (or the extraction summary when there are none) plus the question."""
+    ai_summary = json.dumps(record.get("ai_data", {}), indent=2)
+    full_text = "\n\n---\n\n".join(search_chunks) if search_chunks else ai_summary
+    return [
+        {"role": "system", "content": CHAT_SYSTEM_MESSAGE},
+        {"role": "user", "content": CHAT_PROMPT.format(full_text=full_text, question=question)}
+    ]
+
+
+@app.route("/chat", methods=["POST"])
+def chat():
+    data = request.json
+    pdf_id = data.get("pdf_id")
+    question = data.get("question")
+
+    started = time.perf_counter()
+    prepared = prepare_chat(pdf_id, question)
+    if prepared is None:
+        return jsonify({"error": "PDF data not found"}), 404
+    if prepared["cached"] is not None:
+        return jsonify({"answer": prepared["cached"]}), 200, {"X-Cache": "HIT"}
+
     try:
-        response = client_azure.chat.completions.create(
-            model=DEPLOYMENT_NAME,
-            messages=[
-                {"role": "system", "content": "You are a conversational assistant answering based on PDF content."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.5
-        )
+        with priority("interactive"):
+            response = create_chat_completion(
+                model=DEPLOYMENT_NAME,
+                messages=prepared["messages"],
+                temperature=0.5
+            )
         answer = response.choices[0].message.content.strip()
-        return jsonify({"answer": answer})
+        if prepared["cacheable"]:
+            answer_cache.put(
+                pdf_id, question, CHAT_PROMPT_VERSION, prepared["revision"], answer,
+                latency=time.perf_counter() - started, query_vector=prepared["query_vector"]
+            )
+        return jsonify({"answer": answer}), 200, {"X-Cache": "MISS"}
     except Exception as e:
         logging.error(f"❌ Error in chatbot: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
 
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _open_chat_stream(messages):
+    """Streaming completion; asks for usage on the final chunk when the API supports it."""
+    kwargs = {"model": DEPLOYMENT_NAME, "messages": messages, "temperature": 0.5, "stream": True}
+    with priority("interactive"):
+        try:
+            return create_chat_completion(**kwargs, stream_options={"include_usage": True})
+        except lazy_import("openai").BadRequestError:
+            # Older api-versions reject stream_options; stream without usage instead
+            return create_chat_completion(**kwargs)
+
+
+@app.route("/chat/stream", methods=["POST"])
+def chat_stream():
+    """/chat over Server-Sent Events.
+
+    Emits `token` events ({"text": ...}) as the model produces them, then
+    one `done` event with the full answer, usage and timings, or an
+    `error` event.
+    """
+    data = request.json
+    pdf_id = data.get("pdf_id")
+    question = data.get("question")
+
+    started = time.perf_counter()
+    prepared = prepare_chat(pdf_id, question)
+    if prepared is None:
+        return jsonify({"error": "PDF data not found"}), 404
+
+    def generate():
+        if prepared["cached"] is not None:
+            yield _sse("done", {"answer": prepared["cached"], "cached": True, "usage": None})
+            return
+
+        parts, usage, first_token = [], None, None
+        try:
+            for chunk in _open_chat_stream(prepared["messages"]):
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if first_token is None:
+                        first_token = time.perf_counter() - started
+                    parts.append(chunk.choices[0].delta.content)
+                    yield _sse("token", {"text": chunk.choices[0].delta.content})
+                if getattr(chunk, "usage", None):
+                    usage = chunk.usage.model_dump()
+        except Exception as e:
+            logging.error(f"❌ Error in streaming chatbot: {str(e)}")
+            yield _sse("error", {"error": str(e)})
+            return
+
+        answer = "".join(parts).strip()
+        total = time.perf_counter() - started
+        if prepared["cacheable"]:
+            answer_cache.put(
+                pdf_id, question, CHAT_PROMPT_VERSION, prepared["revision"], answer,
+                latency=total, query_vector=prepared["query_vector"]
+            )
+        yield _sse("done", {
+            "answer": answer,
+            "cached": False,
+            "usage": usage,
+            "time_to_first_token": round(first_token, 3) if first_token is not None else None,
+            "total_seconds": round(total, 3)
+        })
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 #-------------------analytics---------------
 @app.route("/analytics", methods=["POST"])
 def get_user_analytics():
@@ -526,8 +1002,11 @@ def get_user_analytics():
         if not user_id:
             return jsonify({"error": "Missing user_id"}), 400
 
-        from Analytics import calculate_analytics
-        analytics_data = calculate_analytics(pdf_collection, period=period, user_id=user_id)
+        if rollups_ready(rollup_collection):
+            with span("analytics_rollups"):
+                analytics_data = analytics_from_rollups(rollup_collection, period=period, user_id=user_id)
+        else:
+            analytics_data = calculate_analytics(pdf_collection, period=period, user_id=user_id)
         return jsonify(analytics_data)
 
     except Exception as e:
@@ -554,11 +1033,15 @@ def analytics_trends():
     else:
         start_time = datetime.min
 
+    if rollups_ready(rollup_collection):
+        return jsonify({"trend": trends_from_rollups(rollup_collection, user_id, start_time)})
+
     pipeline = [
         {
             "$match": {
                 "user_id": user_id,
-                "timestamp": {"$gte": start_time}
+                "timestamp": {"$gte": start_time},
+                **EXTRACTED_QUERY
             }
         },
         {
@@ -586,32 +1069,138 @@ def analytics_trends():
 
     return jsonify({"trend": trend})
 
+# ------------------ PDF DETAILS ------------------
+PDF_DETAILS_PAGE_SIZE = int(os.getenv("PDF_DETAILS_PAGE_SIZE", "50"))
+PDF_DETAILS_MAX_PAGE_SIZE = int(os.getenv("PDF_DETAILS_MAX_PAGE_SIZE", "500"))
+PDF_DETAILS_BATCH_SIZE = int(os.getenv("PDF_DETAILS_BATCH_SIZE", "200"))
+
+# What the analytics table shows; anything else must be asked for via "fields"
+PDF_DETAILS_DEFAULT_FIELDS = [
+    "pdfName", "timestamp", "pageCount", "wordCount", "ai_data.accuracy", "ai_data.field_confidences"
+]
+PDF_DETAILS_OPTIONAL_ROOTS = {
+    "pdf_id", "ai_data", "user_updated_data", "fingerprint", "extractionVersion", "searchSource", "reusedFrom",
+    "indexStatus", "indexedAt", "indexError"
+}
+PDF_DETAILS_SORT = [("timestamp", -1), ("_id", -1)]
+
+
+def _encode_cursor(doc):
+    key = {"t": doc["timestamp"].isoformat(), "id": str(doc["_id"])}
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def _decode_cursor(cursor):
+    key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return datetime.fromisoformat(key["t"]), lazy_import("bson").ObjectId(key["id"])
+
+
+def _pdf_details_projection(fields):
+    """Default table columns plus any whitelisted extras; raises ValueError on others."""
+    if isinstance(fields, str):
+        fields = [f.strip() for f in fields.split(",") if f.strip()]
+    extra = []
+    for field in fields or []:
+        if not isinstance(field, str) or field.split(".")[0] not in PDF_DETAILS_OPTIONAL_ROOTS:
+            raise ValueError(f"Unknown field: {field}")
+        extra.append(field)
+
+    # Mongo rejects a projection holding both "ai_data" and "ai_data.accuracy"
+    paths = PDF_DETAILS_DEFAULT_FIELDS + extra
+    kept = [p for p in paths if not any(p != q and p.startswith(q + ".") for q in paths)]
+    return {p: 1 for p in dict.fromkeys(kept)}, extra
+
+
+def _pdf_details_query(user_id, cursor):
+    query = {"user_id": user_id}
+    if cursor:
+        ts, oid = _decode_cursor(cursor)
+        # Keyset: strictly after the last row of the previous page in (timestamp, _id) desc order
+        query["$or"] = [
+            {"timestamp": {"$lt": ts}},
+            {"timestamp": ts, "_id": {"$lt": oid}}
+        ]
+    return query
+
+
+def _format_pdf_detail(pdf, extra):
+    ai_data = pdf.get("ai_data", {})
+    pdf["accuracy"] = ai_data.get("accuracy")
+    pdf["field_confidences"] = ai_data.get("field_confidences", {})
+    if not any(f.split(".")[0] == "ai_data" for f in extra):
+        pdf.pop("ai_data", None)
+
+    pdf["_id"] = str(pdf["_id"])
+    if "timestamp" in pdf:
+        pdf["timestamp"] = pdf["timestamp"].strftime("%d-%m-%Y %H:%M")
+    return pdf
+
+
 @app.route("/analytics/pdf-details", methods=["POST"])
 def analytics_pdf_details():
+    """One page of a user's PDFs, newest first.
+
+    Body: user_id, optional limit, cursor (next_cursor from the previous
+    page), fields (extra paths such as "ai_data" or "user_updated_data") and
+    stream. With stream (or Accept: application/x-ndjson) the remaining rows
+    are written as NDJSON while the cursor yields them.
+
+    Without limit or cursor every row comes back in one response, as before
+    pagination, so dashboard builds that never ask for more pages still see
+    all of a user's PDFs.
+    """
     data = request.get_json()
     user_id = data.get("user_id")
 
     if not user_id:
         return jsonify({"error": "Missing user ID"}), 400
 
-    pdfs = list(pdf_collection.find(
-    {"user_id": user_id},
-    {"pdfName": 1, "ai_data": 1, "timestamp": 1, "pageCount": 1, "wordCount": 1}
-).sort("timestamp", -1))
+    try:
+        projection, extra = _pdf_details_projection(data.get("fields"))
+        query = _pdf_details_query(user_id, data.get("cursor"))
+        limit = int(data.get("limit") or PDF_DETAILS_PAGE_SIZE)
+    except (ValueError, TypeError, KeyError) as e:
+        return jsonify({"error": f"Invalid request: {e}"}), 400
+    limit = max(1, min(limit, PDF_DETAILS_MAX_PAGE_SIZE))
+
+    cursor = pdf_collection.find(query, projection).sort(PDF_DETAILS_SORT).batch_size(PDF_DETAILS_BATCH_SIZE)
+
+    stream = data.get("stream") or "application/x-ndjson" in request.headers.get("Accept", "")
+    if stream:
+        def generate():
+            for pdf in cursor:
+                yield json.dumps(_format_pdf_detail(pdf, extra), default=str) + "\n"
+
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+    if data.get("limit") is None and not data.get("cursor"):
+        return jsonify({"pdfs": [_format_pdf_detail(pdf, extra) for pdf in cursor], "next_cursor": None})
+
+    # Read one row past the page to know whether there is a next page
+    pdfs = list(cursor.limit(limit + 1))
+    next_cursor = _encode_cursor(pdfs[limit - 1]) if len(pdfs) > limit else None
+    pdfs = [_format_pdf_detail(pdf, extra) for pdf in pdfs[:limit]]
+    return jsonify({"pdfs": pdfs, "next_cursor": next_cursor})
 
 
-    for pdf in pdfs:
-        pdf["_id"] = str(pdf["_id"])
+@app.route("/embedding-cache/stats", methods=["GET"])
+def embedding_cache_stats():
+    return jsonify(cache_stats())
 
-        # Extract from ai_data if not top-level
-        ai_data = pdf.get("ai_data", {})
-        pdf["accuracy"] = ai_data.get("accuracy")
-        pdf["field_confidences"] = ai_data.get("field_confidences", {})
 
-        # Format timestamp for display
-        if "timestamp" in pdf:
-            pdf["timestamp"] = pdf["timestamp"].strftime("%d-%m-%Y %H:%M")
-    return jsonify({"pdfs": pdfs})
+@app.route("/chat-cache/stats", methods=["GET"])
+def chat_cache_stats():
+    return jsonify(answer_cache.stats())
+
+
+@app.route("/rate-limit/stats", methods=["GET"])
+def rate_limit_stats():
+    return jsonify(limiter.stats())
+
+
+@app.route("/clients/stats", methods=["GET"])
+def clients_stats():
+    return jsonify(startup_report(boot_seconds=BOOT_SECONDS))
 
 
 @app.route("/")
@@ -619,6 +1208,9 @@ def index():
     return send_from_directory(app.static_folder, "index.html")
 
 
+BOOT_SECONDS = time.perf_counter() - _boot_started
+logging.info(f"🚀 app ready in {BOOT_SECONDS * 1000:.0f} ms: {startup_report(boot_seconds=BOOT_SECONDS)}")
+
 # ------------------ START SERVER ------------------
 #if __name__ == "__main__": 
  #   app.run(debug=True)
\ No newline at end of file
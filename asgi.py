@@ -0,0 +1,405 @@
+"""ASGI entry point: async /extract, /chat and /chat/stream in front of the Flask app.
+
+    uvicorn asgi:app --workers 4 --host 0.0.0.0 --port 8000
+
+These three routes await Azure OpenAI, embeddings and Azure Search through
+async clients, so one process holds thousands of chats in flight instead of
+one per thread. Work without an async client here (Mongo, Blob, the search
+upload, OCR) runs in threads, and PyMuPDF parsing in a process pool of
+ASGI_CPU_WORKERS, so none of it blocks the event loop.
+
+Request and response shapes match the Flask routes in app.py exactly (same
+JSON provider, status codes and headers). Every other path, and CORS
+preflights, go to the Flask app, which still runs unchanged under gunicorn.
+"""
+import os
+import time
+import uuid
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+from functools import wraps
+from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route, Mount
+from werkzeug.datastructures import FileStorage
+
+import app as wsgi
+from chunking import iter_chunks
+from clients import async_openai_client, lazy_import
+from ingest_pdf import extract_pages, summarize_pages, get_embeddings_cached_async, chunk_documents
+from large_files import MemoryWatch, use_large_file_mode, spool_upload, remove_spool
+from long_doc import is_long_document, run_map_reduce
+from metrics import span, track_request
+from pipeline import Pipeline
+from rate_limit import acall_with_limit, estimate_tokens, priority, RATE_LIMIT_COMPLETION_TOKENS
+from retrieval import get_backend
+
+ASGI_CPU_WORKERS = int(os.getenv("ASGI_CPU_WORKERS", str(os.cpu_count() or 2)))
+ASGI_MP_CONTEXT = os.getenv("ASGI_MP_CONTEXT", "spawn")
+# Threads that serve the mounted Flask routes
+ASGI_WSGI_THREADS = int(os.getenv("ASGI_WSGI_THREADS", "10"))
+
+_cpu_pool = None
+
+
+def cpu_pool():
+    global _cpu_pool
+    if _cpu_pool is None:
+        context = multiprocessing.get_context(ASGI_MP_CONTEXT)
+        _cpu_pool = ProcessPoolExecutor(max_workers=max(1, ASGI_CPU_WORKERS), mp_context=context)
+    return _cpu_pool
+
+
+async def in_process(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(cpu_pool(), fn, *args)
+
+
+class FlaskJSONResponse(JSONResponse):
+    """JSON rendered by the Flask app's provider, so bodies match jsonify byte for byte."""
+
+    def render(self, content):
+        return wsgi.app.json.response(content).get_data()
+
+
+def endpoint(route):
+    """Record the request in the metrics and add its Server-Timing header."""
+    def decorate(handler):
+        @wraps(handler)
+        async def wrapper(request):
+            finish = track_request(route, request.method)
+            response = await handler(request)
+            response.headers["Server-Timing"] = finish(response.status_code)
+            return response
+        return wrapper
+    return decorate
+
+
+# ------------------ OPENAI CALLS ------------------
+async def create_chat_completion(**kwargs):
+    """app.create_chat_completion over the async client."""
+    tokens = estimate_tokens(
+        kwargs.get("messages"), completion_tokens=kwargs.get("max_tokens") or RATE_LIMIT_COMPLETION_TOKENS
+    )
+    return await acall_with_limit(wsgi.DEPLOYMENT_NAME, tokens, _timed_completion, **kwargs)
+
+
+async def _timed_completion(**kwargs):
+    # The "openai" stage covers the SDK call only, not the limiter's wait before it
+    with span("openai"):
+        return await async_openai_client().chat.completions.create(**kwargs)
+
+
+async def extract_fields(pages, text):
+    """app.extract_fields, awaiting the single GPT call."""
+    with span("llm"):
+        rules, parsed_data = await asyncio.to_thread(wsgi.extract_with_rules, text)
+        if parsed_data is not None:
+            return parsed_data
+
+        if is_long_document(pages):
+            logging.info(f"📚 Long document ({len(pages)} pages) — using map-reduce extraction")
+            # Map-reduce fans its calls out over its own thread pool
+            parsed_data, extracted_data = await asyncio.to_thread(run_map_reduce, pages, wsgi.request_extraction)
+        else:
+            response = await create_chat_completion(
+                model=wsgi.DEPLOYMENT_NAME,
+                messages=wsgi.extraction_messages(text),
+                temperature=0.2
+            )
+            parsed_data, extracted_data = wsgi.parse_extraction_output(response.choices[0].message.content.strip())
+        return wsgi.finish_extraction(parsed_data, extracted_data, text, rules)
+
+
+# ------------------ PDF EXTRACTION ------------------
+async def index_pages(pages, search_source, replace=True):
+    with span("index"):
+        chunks = await asyncio.to_thread(lambda: list(iter_chunks(pages)))
+        with span("embed"):
+            vectors = await get_embeddings_cached_async([chunk["text"] for chunk in chunks])
+        documents = chunk_documents(chunks, vectors, search_source)
+        if not documents:
+            return {}
+        with span("search_upload"):
+            return await asyncio.to_thread(get_backend().upload, documents, replace)
+
+
+async def parse_pdf(source):
+    with span("parse"):
+        pages = await in_process(extract_pages, source)
+        return pages, summarize_pages(pages)
+
+
+async def ocr_if_needed(source, pages, stats):
+    return pages, await asyncio.to_thread(wsgi.ocr_if_needed, source, pages, stats)
+
+
+async def index_source(pages, fingerprint, pdf_id):
+    """index_pages under the document's search source, skipping the stale sweep for a new source."""
+    replace = await asyncio.to_thread(wsgi.indexed_before, fingerprint, pdf_id)
+    return await index_pages(pages, wsgi.search_source(fingerprint, pdf_id), replace)
+
+
+async def index_deferred(pages, fingerprint, pdf_id):
+    """app.index_deferred for the awaited index stage."""
+    try:
+        status = await index_source(pages, fingerprint, pdf_id)
+    except Exception as e:
+        await asyncio.to_thread(wsgi.record_index_status, fingerprint, pdf_id, wsgi.index_fields(error=e))
+        raise
+    await asyncio.to_thread(wsgi.record_index_status, fingerprint, pdf_id, wsgi.index_fields(status))
+    return status
+
+
+async def run_extraction(source, filename, user_id, pdf_id, fingerprint=None, memory=None,
+                         defer_index=wsgi.EXTRACT_DEFER_INDEXING):
+    """app.run_extraction's stage graph with each stage awaited instead of holding a thread."""
+    pipeline = Pipeline()
+    pipeline.add("blob", lambda: asyncio.to_thread(wsgi.upload_to_blob, source, filename), percent=10)
+    pipeline.add("parse", lambda: parse_pdf(source), percent=20)
+    pipeline.add("ocr", lambda parsed: ocr_if_needed(source, *parsed), after=("parse",), percent=30)
+    if defer_index:
+        pipeline.add("index", lambda ocred: index_deferred(ocred[0], fingerprint, pdf_id), after=("ocr",),
+                     percent=50, deferred=True)
+    else:
+        pipeline.add("index", lambda ocred: index_source(ocred[0], fingerprint, pdf_id), after=("ocr",), percent=50)
+    pipeline.add("llm", lambda ocred: extract_fields(ocred[0], ocred[1]["text"]), after=("ocr",), percent=60)
+    pipeline.add("save", lambda parsed_data, ocred, blob_client, *indexed: asyncio.to_thread(
+        wsgi.save_extraction, parsed_data, ocred[1], filename, user_id, pdf_id, fingerprint,
+        wsgi.index_fields(indexed[0]) if indexed else None
+    ), after=("llm", "ocr", "blob") + (() if defer_index else ("index",)), percent=90)
+
+    return (await pipeline.run_async(wsgi.stage_progress(None, memory)))["llm"]
+
+
+def _flag(request, form, name, default="false"):
+    flag = form.get(name, request.query_params.get(name, default))
+    return str(flag).lower() in ("1", "true", "yes")
+
+
+def _declared_length(request):
+    try:
+        return int(request.headers.get("content-length") or 0)
+    except ValueError:
+        return 0
+
+
+@endpoint("/extract")
+async def extract_data(request):
+    spool_path = None
+    filename = None
+    try:
+        # Refuse an oversize body before Starlette parses (and spools) it
+        max_upload = wsgi.app.config.get("MAX_CONTENT_LENGTH")
+        if max_upload and _declared_length(request) > max_upload:
+            return FlaskJSONResponse({"error": "Upload too large"}, 413)
+
+        form = await request.form()
+        upload = form.get("pdf")
+        filename, error = wsgi.check_extract_form(None if isinstance(upload, str) else upload, form.get("user_id"))
+        if error:
+            return FlaskJSONResponse(*error)
+        user_id = form.get("user_id")
+        pdf_id = str(uuid.uuid4())
+
+        # A chunked body carries no Content-Length, so check the part itself too
+        if max_upload and (upload.size or 0) > max_upload:
+            return FlaskJSONResponse({"error": "Upload too large"}, 413)
+
+        # Big uploads go to disk once (fingerprinted on the way) and every stage reads that copy
+        pdf_bytes = None
+        if use_large_file_mode(upload.size or 0):
+            with span("spool"):
+                spool_path, fingerprint = await asyncio.to_thread(spool_upload, upload.file)
+        else:
+            pdf_bytes = await upload.read()
+            await upload.seek(0)
+            with span("fingerprint"):
+                fingerprint = hashlib.sha256(pdf_bytes).hexdigest()
+
+        reply = await asyncio.to_thread(
+            wsgi.reuse_or_queue, spool_path or FileStorage(upload.file, upload.filename), fingerprint, filename,
+            user_id, pdf_id, force=_flag(request, form, "force"),
+            run_async=_flag(request, form, "async", wsgi.EXTRACT_ASYNC_DEFAULT)
+        )
+        if reply:
+            body, status, headers = reply
+            return FlaskJSONResponse(body, status, headers=headers)
+
+        with MemoryWatch() as memory:
+            parsed_data = await run_extraction(
+                spool_path or pdf_bytes, filename, user_id, pdf_id, fingerprint=fingerprint, memory=memory
+            )
+        wsgi.record_memory(memory, filename, spooled=spool_path is not None)
+        return FlaskJSONResponse(
+            {"pdf_id": pdf_id, **parsed_data}, headers={"X-Peak-RSS-MB": str(memory.report()["peak_rss_mb"])}
+        )
+
+    except HTTPException as e:
+        # e.g. a malformed multipart body; keep Starlette's status instead of a 500
+        return FlaskJSONResponse({"error": e.detail}, e.status_code)
+
+    except Exception as e:
+        return FlaskJSONResponse(*wsgi.extract_error(e, filename))
+
+    finally:
+        # A queued job has already moved its spooled copy away
+        remove_spool(spool_path)
+
+
+# ------------------ CHATBOT ------------------
+async def prepare_chat(pdf_id, question):
+    """app.prepare_chat with the embedding and search calls awaited."""
+    with span("mongo_find"):
+        record = await asyncio.to_thread(wsgi.pdf_collection.find_one, {"pdf_id": pdf_id})
+    if not record:
+        return None
+
+    # Same question about the same revision of this PDF? Answer from cache.
+    revision = wsgi.chat_revision(record)
+    with priority("interactive"), span("embed_question"):
+        query_vector = (await get_embeddings_cached_async([question]))[0] if question else []
+    with span("answer_cache"):
+        cached = wsgi.answer_cache.get(pdf_id, question, wsgi.CHAT_PROMPT_VERSION, revision, query_vector)
+    chat = {"revision": revision, "query_vector": query_vector, "cached": cached, "messages": None}
+    if cached is not None:
+        return chat
+
+    with span("search"):
+        search_chunks = await get_backend().search_async(
+            question, query_vector=query_vector, source=record.get("searchSource")
+        )
+    chat["messages"] = wsgi.chat_messages(record, question, search_chunks)
+    chat["cacheable"] = bool(search_chunks)
+    return chat
+
+
+@endpoint("/chat")
+async def chat(request):
+    data = await request.json()
+    pdf_id = data.get("pdf_id")
+    question = data.get("question")
+
+    started = time.perf_counter()
+    prepared = await prepare_chat(pdf_id, question)
+    if prepared is None:
+        return FlaskJSONResponse({"error": "PDF data not found"}, 404)
+    if prepared["cached"] is not None:
+        return FlaskJSONResponse({"answer": prepared["cached"]}, headers={"X-Cache": "HIT"})
+
+    try:
+        with priority("interactive"):
+            response = await create_chat_completion(
+                model=wsgi.DEPLOYMENT_NAME,
+                messages=prepared["messages"],
+                temperature=0.5
+            )
+        answer = response.choices[0].message.content.strip()
+        if prepared["cacheable"]:
+            wsgi.answer_cache.put(
+                pdf_id, question, wsgi.CHAT_PROMPT_VERSION, prepared["revision"], answer,
+                latency=time.perf_counter() - started, query_vector=prepared["query_vector"]
+            )
+        return FlaskJSONResponse({"answer": answer}, headers={"X-Cache": "MISS"})
+    except Exception as e:
+        logging.error(f"❌ Error in chatbot: {str(e)}")
+        return FlaskJSONResponse({"error": str(e)}, 500)
+
+
+async def _open_chat_stream(messages):
+    kwargs = {"model": wsgi.DEPLOYMENT_NAME, "messages": messages, "temperature": 0.5, "stream": True}
+    with priority("interactive"):
+        try:
+            return await create_chat_completion(**kwargs, stream_options={"include_usage": True})
+        except lazy_import("openai").BadRequestError:
+            # Older api-versions reject stream_options; stream without usage instead
+            return await create_chat_completion(**kwargs)
+
+
+@endpoint("/chat/stream")
+async def chat_stream(request):
+    """app.chat_stream: `token` events, then `done` (or `error`)."""
+    data = await request.json()
+    pdf_id = data.get("pdf_id")
+    question = data.get("question")
+
+    started = time.perf_counter()
+    prepared = await prepare_chat(pdf_id, question)
+    if prepared is None:
+        return FlaskJSONResponse({"error": "PDF data not found"}, 404)
+
+    async def generate():
+        if prepared["cached"] is not None:
+            yield wsgi._sse("done", {"answer": prepared["cached"], "cached": True, "usage": None})
+            return
+
+        parts, usage, first_token = [], None, None
+        try:
+            async for chunk in await _open_chat_stream(prepared["messages"]):
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if first_token is None:
+                        first_token = time.perf_counter() - started
+                    parts.append(chunk.choices[0].delta.content)
+                    yield wsgi._sse("token", {"text": chunk.choices[0].delta.content})
+                if getattr(chunk, "usage", None):
+                    usage = chunk.usage.model_dump()
+        except Exception as e:
+            logging.error(f"❌ Error in streaming chatbot: {str(e)}")
+            yield wsgi._sse("error", {"error": str(e)})
+            return
+
+        answer = "".join(parts).strip()
+        total = time.perf_counter() - started
+        if prepared["cacheable"]:
+            wsgi.answer_cache.put(
+                pdf_id, question, wsgi.CHAT_PROMPT_VERSION, prepared["revision"], answer,
+                latency=total, query_vector=prepared["query_vector"]
+            )
+        yield wsgi._sse("done", {
+            "answer": answer,
+            "cached": False,
+            "usage": usage,
+            "time_to_first_token": round(first_token, 3) if first_token is not None else None,
+            "total_seconds": round(total, 3)
+        })
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# ------------------ APP ------------------
+@asynccontextmanager
+async def lifespan(app):
+    if os.getenv("EXTRACT_WORKERS_AUTOSTART", "true").lower() in ("1", "true", "yes"):
+        wsgi.extract_jobs.start()
+    yield
+    if _cpu_pool is not None:
+        _cpu_pool.shutdown(cancel_futures=True)
+
+
+# Preflights don't match these POST-only routes and fall through to Flask-CORS
+cors = [Middleware(
+    CORSMiddleware, allow_origins=wsgi.CORS_ORIGINS, allow_credentials=True,
+    allow_methods=["*"], allow_headers=["*"]
+)]
+
+app = Starlette(
+    routes=[
+        Route("/extract", extract_data, methods=["POST"], middleware=cors),
+        Route("/chat", chat, methods=["POST"], middleware=cors),
+        Route("/chat/stream", chat_stream, methods=["POST"], middleware=cors),
+        Mount("/", app=WSGIMiddleware(wsgi.app, workers=ASGI_WSGI_THREADS))
+    ],
+    lifespan=lifespan
+)
@@ -0,0 +1,124 @@
+"""Benchmark calculate_analytics (server-side aggregation) against the
+original client-side scan at increasing collection sizes.
+
+    python benchmarks/bench_analytics.py --sizes 10000,100000,1000000
+
+Seeds a scratch database (default pdf_data_bench) on MONGO_URI with
+realistic extraction records for one user, topping the collection up to
+each size in turn, and checks both implementations return the same result.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+from statistics import median
+
+from pymongo import MongoClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Analytics import calculate_analytics, calculate_analytics_scan  # noqa: E402
+
+USER_ID = "bench-user"
+TERMS = [f"Exclusion clause {i}: claims arising from pre-existing condition {i} are not covered." for i in range(25)]
+
+
+def make_record(i, now):
+    ai_data = {
+        "policyholderName": f"Holder {i}",
+        "policyholderName_confidence": random.randint(40, 100),
+        "issueDate": "01-04-2024",
+        "issueDate_confidence": random.randint(40, 100),
+        "premiumAmount": "Rs. 5,00,000",
+        "premiumAmount_confidence": random.randint(40, 100),
+        "termsAndExclusions": TERMS,
+        "name": f"Holder {i}",
+        "contractAmount": "Rs. 5,00,000",
+    }
+    ai_data["field_confidences"] = {
+        "name": ai_data["policyholderName_confidence"],
+        "contractAmount": ai_data["premiumAmount_confidence"],
+        "issueDate": ai_data["issueDate_confidence"],
+    }
+    record = {
+        "pdf_id": f"bench-{i}",
+        "pdfName": f"policy_{i}.pdf",
+        "ai_data": ai_data,
+        "pageCount": random.randint(1, 400),
+        "wordCount": random.randint(100, 200000),
+        "timestamp": now - timedelta(minutes=random.randint(0, 60 * 24 * 365)),
+        "user_id": USER_ID,
+    }
+    if random.random() < 0.3:
+        record["user_updated_data"] = {"name": f"Corrected {i}", "issueDate": "02-04-2024"}
+    return record
+
+
+def seed(collection, target, batch=10000):
+    have = collection.count_documents({})
+    now = datetime.utcnow()
+    while have < target:
+        n = min(batch, target - have)
+        collection.insert_many([make_record(have + j, now) for j in range(n)], ordered=False)
+        have += n
+        print(f"  seeded {have}/{target}", end="\r", flush=True)
+    print()
+
+
+def timed(fn, *args, repeat=3, **kwargs):
+    samples, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        samples.append(time.perf_counter() - start)
+    return median(samples), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mongo-uri", default=os.getenv("MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--db", default="pdf_data_bench")
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--period", default="all")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="also write results to this file")
+    parser.add_argument("--drop", action="store_true", help="drop the scratch collection when done")
+    args = parser.parse_args()
+
+    random.seed(42)
+    collection = MongoClient(args.mongo_uri)[args.db]["extracted_data"]
+    collection.create_index([("user_id", 1), ("timestamp", 1)])
+
+    rows = []
+    for size in sorted(int(s) for s in args.sizes.split(",")):
+        print(f"📦 {size} records")
+        seed(collection, size)
+        scan_s, scan_result = timed(calculate_analytics_scan, collection, args.period, USER_ID, repeat=args.repeat)
+        agg_s, agg_result = timed(calculate_analytics, collection, args.period, USER_ID, repeat=args.repeat)
+        match = json.dumps(scan_result, sort_keys=True) == json.dumps(agg_result, sort_keys=True)
+        rows.append({
+            "records": size,
+            "scan_seconds": round(scan_s, 4),
+            "aggregate_seconds": round(agg_s, 4),
+            "speedup": round(scan_s / agg_s, 1) if agg_s else None,
+            "results_match": match,
+        })
+        if not match:
+            print(f"⚠️ Results differ:\n  scan:      {scan_result}\n  aggregate: {agg_result}")
+
+    print(f"\n{'records':>10} {'scan (s)':>10} {'aggregate (s)':>14} {'speedup':>8} {'match':>6}")
+    for r in rows:
+        print(f"{r['records']:>10} {r['scan_seconds']:>10} {r['aggregate_seconds']:>14} "
+              f"{r['speedup']:>7}x {str(r['results_match']):>6}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+    if args.drop:
+        collection.drop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+"""Offline end-to-end benchmark for /extract, /chat and the analytics routes.
+
+    pip install -r requirements-dev.txt
+    python benchmarks/bench_pipeline.py
+    python benchmarks/bench_pipeline.py --pages 1,50,500 --clients 1,4,16 --json bench.json
+    python benchmarks/bench_pipeline.py --mongo-uri mongodb://localhost:27017 --openai-latency 1.2
+
+Azure OpenAI, Azure Search, Blob Storage and Tesseract are replaced by the
+fakes in benchmarks/fakes.py, each with a configurable latency, and Mongo by
+mongomock (or a scratch database on --mongo-uri). Synthetic text and scanned
+PDFs are generated with PyMuPDF. Requests go through the Flask test client,
+so routing, form parsing and the whole extraction pipeline run for real.
+
+Reports per-stage latency percentiles, requests/s at each client count and
+peak RSS. --json writes the same numbers (plus the git commit) with sorted
+keys, so runs from two commits can be diffed.
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import subprocess
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+import fakes  # noqa: E402
+
+USER_ID = "bench-user"
+SCAN_DPI = 72
+WORDS = ("policy insured benefit premium claim hospital treatment coverage period renewal sum assured "
+         "nominee exclusion waiting disease condition surgery expenses room rent ambulance daycare "
+         "co-payment deductible schedule endorsement proposer schedule member floater").split()
+
+
+# ------------------ SYNTHETIC PDFS ------------------
+def page_text(n, rng):
+    if n == 0:
+        head = ("POLICY SCHEDULE\n"
+                "Policy No: P/161114/01/2024/001234\n"
+                "Policyholder Name: Ramesh Kumar Sharma\n"
+                "Date of Issue: 15/06/2024\n"
+                "Address: 12 MG Road, Bengaluru 560001\n"
+                "Sum Assured: Rs. 5,00,000\n\n")
+    else:
+        head = f"Section {n}. General Terms\n\n"
+    body = " ".join(rng.choice(WORDS) for _ in range(300))
+    return head + body
+
+
+def make_pdf(pages, scanned=False):
+    import fitz
+
+    rng = random.Random(pages)
+    doc = fitz.open()
+    for n in range(pages):
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(50, 50, 545, 790), page_text(n, rng), fontsize=8)
+    if not scanned:
+        return doc.tobytes(deflate=True)
+
+    # A scanned PDF is the same pages as images with no text layer
+    scan = fitz.open()
+    for page in doc:
+        pix = page.get_pixmap(dpi=SCAN_DPI, colorspace=fitz.csGRAY)
+        scan.new_page(width=page.rect.width, height=page.rect.height).insert_image(page.rect, pixmap=pix)
+    return scan.tobytes(deflate=True)
+
+
+# ------------------ MEASUREMENT ------------------
+def percentiles(samples):
+    if not samples:
+        return {"n": 0}
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {
+        "n": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 1),
+        "p50_ms": round(pick(0.50) * 1000, 1),
+        "p90_ms": round(pick(0.90) * 1000, 1),
+        "p99_ms": round(pick(0.99) * 1000, 1),
+        "max_ms": round(ordered[-1] * 1000, 1)
+    }
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux and bytes on macOS; it only ever grows, so
+    # each scenario reports the peak of everything run before it as well
+    scale = 1 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    return {"self": round(own / 2 ** 20, 1), "children": round(children / 2 ** 20, 1)}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# ------------------ SETUP ------------------
+def configure_env(args, scratch):
+    """Settings that modules read at import time, so this runs before `import app`."""
+    os.environ.setdefault("AZURE_OPENAI_API_KEY", "bench")
+    os.environ.setdefault("AZURE_OPENAI_ENDPOINT", "https://bench.invalid/")
+    os.environ.setdefault("AZURE_API_VERSION", "2024-02-01")
+    os.environ.setdefault("AZURE_GPT_DEPLOYMENT", "bench-gpt")
+    os.environ["MONGO_ENSURE_INDEXES"] = "false"
+    # Mongo is swapped for the fake after `import app`; jobs start their workers on submit
+    os.environ["EXTRACT_WORKERS_AUTOSTART"] = "false"
+    os.environ["RATE_LIMIT_DB"] = os.path.join(scratch, "rate_limit.sqlite")
+    os.environ["EXTRACT_ASYNC_DEFAULT"] = "false"
+    caches = "true" if args.with_caches else "false"
+    os.environ["EMBEDDING_CACHE_ENABLED"] = caches
+    os.environ["CHAT_CACHE_ENABLED"] = caches
+
+
+def mongo_factory(args):
+    if not args.mongo_uri:
+        import mongomock
+        import mongomock.gridfs
+        # Queued /extract jobs keep their uploads in GridFS
+        mongomock.gridfs.enable_gridfs_integration()
+        return mongomock.MongoClient
+
+    from pymongo import MongoClient
+
+    class ScratchClient(MongoClient):
+        # The app always asks for pdf_data; keep the benchmark off the real one
+        def __getitem__(self, name):
+            return super().__getitem__(args.db if name == "pdf_data" else name)
+
+    return lambda: ScratchClient(args.mongo_uri)
+
+
+def install_fakes(args, timer):
+    import app
+    import clients
+    import ingest_pdf
+    import retrieval
+    import rollups
+
+    clients.registry.register("mongo", mongo_factory(args))
+    clients.registry.register("openai", lambda: fakes.FakeOpenAI(
+        timer, latency=args.openai_latency, token_latency=args.token_latency))
+    clients.registry.register("blob", lambda: fakes.FakeContainer(timer, latency=args.blob_latency))
+    ingest_pdf.get_embeddings = fakes.fake_embeddings(
+        timer, retrieval.EMBEDDING_DIMENSIONS, latency=args.embed_latency)
+    retrieval._backend = fakes.FakeSearch(timer, latency=args.search_latency)
+    if not args.real_ocr:
+        app.apply_ocr = fakes.fake_apply_ocr(timer, per_page=args.ocr_latency)
+
+    if args.mongo_uri:
+        clients.mongo_client().drop_database(args.db)
+    # Seed the rollup marker so analytics reads rollups, as a deployed server does
+    rollups.rebuild(app.pdf_collection, app.rollup_collection)
+
+    for name, stage in [("extract_pages", "parse"), ("apply_ocr", "ocr"), ("push_chunks_to_search", "index"),
+                        ("extract_fields", "llm"), ("apply_change", "rollup")]:
+        timer.wrap(app, name, stage)
+    return app
+
+
+# ------------------ SCENARIOS ------------------
+def post_extract(client, pdf, name):
+    response = client.post("/extract", data={
+        "pdf": (io.BytesIO(pdf), name), "user_id": USER_ID, "force": "true", "async": "false"
+    }, content_type="multipart/form-data")
+    if response.status_code != 200:
+        raise RuntimeError(f"/extract returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+    return response.get_json()
+
+
+def post_chat(client, pdf_id, question):
+    response = client.post("/chat", json={"pdf_id": pdf_id, "question": question})
+    if response.status_code != 200:
+        raise RuntimeError(f"/chat returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+    return response.get_json()
+
+
+def run_requests(timer, fn, count):
+    timer.reset()
+    latencies = []
+    for i in range(count):
+        started = time.perf_counter()
+        fn(i)
+        latencies.append(time.perf_counter() - started)
+    return {
+        "latency": percentiles(latencies),
+        "stages": {stage: percentiles(s) for stage, s in sorted(timer.reset().items())},
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+
+def run_concurrent(app, fn, clients, per_client):
+    def worker(c):
+        client, latencies, errors = app.test_client(), [], 0
+        for i in range(per_client):
+            started = time.perf_counter()
+            try:
+                fn(client, c * per_client + i)
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+        return latencies, errors
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        results = list(pool.map(worker, range(clients)))
+    elapsed = time.perf_counter() - started
+    latencies = [x for lat, _ in results for x in lat]
+    return {
+        "clients": clients,
+        "requests": len(latencies),
+        "errors": sum(e for _, e in results),
+        "requests_per_second": round(len(latencies) / elapsed, 2),
+        "latency": percentiles(latencies)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", default="1,10,100", help="synthetic PDF sizes (1-500)")
+    parser.add_argument("--kinds", default="text,scanned")
+    parser.add_argument("--repeat", type=int, default=3, help="/extract requests per PDF")
+    parser.add_argument("--chat-requests", type=int, default=20)
+    parser.add_argument("--analytics-requests", type=int, default=20)
+    parser.add_argument("--clients", default="1,4,16", help="concurrent clients for the throughput runs")
+    parser.add_argument("--per-client", type=int, default=5, help="requests per client in throughput runs")
+    parser.add_argument("--throughput-pages", type=int, default=10)
+    parser.add_argument("--openai-latency", type=float, default=0.4, help="seconds before the first token")
+    parser.add_argument("--token-latency", type=float, default=0.005, help="seconds per generated word")
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="seconds per embedding batch")
+    parser.add_argument("--search-latency", type=float, default=0.03)
+    parser.add_argument("--blob-latency", type=float, default=0.05)
+    parser.add_argument("--ocr-latency", type=float, default=0.1, help="seconds per OCRed page")
+    parser.add_argument("--real-ocr", action="store_true", help="run Tesseract instead of the fake")
+    parser.add_argument("--with-caches", action="store_true", help="leave the embedding and answer caches on")
+    parser.add_argument("--mongo-uri", help="use this server instead of mongomock")
+    parser.add_argument("--db", default="pdf_data_bench", help="scratch database on --mongo-uri")
+    parser.add_argument("--verbose", action="store_true", help="show the app's own output")
+    parser.add_argument("--json", help="also write results to this file")
+    args = parser.parse_args()
+
+    sizes = sorted(int(p) for p in args.pages.split(","))
+    kinds = [k for k in args.kinds.split(",") if k]
+    out = sys.stdout
+    timer = fakes.StageTimer()
+    scratch = tempfile.mkdtemp(prefix="bench_pipeline_")
+    configure_env(args, scratch)
+
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    if not args.verbose:
+        import logging
+        logging.disable(logging.WARNING)
+
+    results = {"commit": git_commit(), "config": vars(args), "extract": {}, "throughput": {}}
+    with quiet:
+        flask_app = install_fakes(args, timer).app
+        client = flask_app.test_client()
+
+        pdfs = {}
+        for kind in kinds:
+            for pages in sizes:
+                started = time.perf_counter()
+                pdfs[kind, pages] = make_pdf(pages, scanned=kind == "scanned")
+                print(f"📄 {kind} {pages}p: {len(pdfs[kind, pages]) / 2 ** 20:.1f} MB "
+                      f"in {time.perf_counter() - started:.1f}s", file=out, flush=True)
+
+        for (kind, pages), pdf in pdfs.items():
+            key = f"{kind}-{pages}p"
+            print(f"⏱️ /extract {key}", file=out, flush=True)
+            results["extract"][key] = run_requests(
+                timer, lambda i: post_extract(client, pdf, f"bench_{key}_{i}.pdf"), args.repeat)
+
+        chat_pdf = post_extract(client, make_pdf(args.throughput_pages), "bench_chat.pdf")["pdf_id"]
+        print("⏱️ /chat", file=out, flush=True)
+        results["chat"] = run_requests(
+            timer, lambda i: post_chat(client, chat_pdf, f"What is covered under clause {i}?"), args.chat_requests)
+
+        print("⏱️ analytics", file=out, flush=True)
+        results["analytics"] = {
+            route: run_requests(timer, lambda i: client.post(route, json=body), args.analytics_requests)
+            for route, body in [
+                ("/analytics", {"user_id": USER_ID, "filter": "all"}),
+                ("/analytics/trends", {"user_id": USER_ID, "filter": "all"}),
+                ("/analytics/pdf-details", {"user_id": USER_ID, "limit": 50})
+            ]
+        }
+
+        throughput_pdf = make_pdf(args.throughput_pages)
+        for n in sorted(int(c) for c in args.clients.split(",")):
+            print(f"⏱️ throughput with {n} clients", file=out, flush=True)
+            results["throughput"][f"extract-{n}"] = run_concurrent(
+                flask_app, lambda c, i: post_extract(c, throughput_pdf, f"bench_tp_{i}.pdf"), n, args.per_client)
+            results["throughput"][f"chat-{n}"] = run_concurrent(
+                flask_app, lambda c, i: post_chat(c, chat_pdf, f"Throughput question {n}-{i}?"), n, args.per_client)
+        results["peak_rss_mb"] = peak_rss_mb()
+
+    print(f"\n{'scenario':<28} {'n':>4} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'rss MB':>8}")
+    rows = [(f"extract {k}", r) for k, r in results["extract"].items()] + [("chat", results["chat"])]
+    rows += [(route, r) for route, r in results["analytics"].items()]
+    for name, r in rows:
+        lat = r["latency"]
+        print(f"{name:<28} {lat['n']:>4} {lat['p50_ms']:>9} {lat['p90_ms']:>9} {lat['p99_ms']:>9} "
+              f"{r['peak_rss_mb']['self']:>8}")
+
+    if results["extract"]:
+        # Stage breakdown for the biggest PDF, where the split matters most
+        largest = max(results["extract"], key=lambda k: int(k.split("-")[1][:-1]))
+        print(f"\n{'stages: extract ' + largest:<28} {'n':>4} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9}")
+        for stage, s in results["extract"][largest]["stages"].items():
+            print(f"  {stage:<26} {s['n']:>4} {s['p50_ms']:>9} {s['p90_ms']:>9} {s['p99_ms']:>9}")
+
+    print(f"\n{'throughput':<28} {'req/s':>8} {'errors':>7} {'p50 ms':>9} {'p99 ms':>9}")
+    for name, r in results["throughput"].items():
+        print(f"{name:<28} {r['requests_per_second']:>8} {r['errors']:>7} "
+              f"{r['latency']['p50_ms']:>9} {r['latency']['p99_ms']:>9}")
+    print(f"\npeak RSS: {results['peak_rss_mb']['self']} MB (children {results['peak_rss_mb']['children']} MB)")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""Local stand-ins for Azure OpenAI, Azure Search, Blob Storage and OCR.
+
+Every fake sleeps for a configurable latency and records its own stage
+timing, so the benchmark sees the pipeline's real control flow with
+network time replaced by something deterministic.
+"""
+import json
+import time
+import hashlib
+import threading
+from types import SimpleNamespace as NS
+
+import numpy as np
+
+import retrieval
+
+
+class StageTimer:
+    """Thread-safe {stage: [seconds, ...]} collector."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+    def wrap(self, module, name, stage):
+        """Replace module.name with a version that records its duration under `stage`."""
+        fn = getattr(module, name)
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - started)
+
+        setattr(module, name, timed)
+
+    def reset(self):
+        with self._lock:
+            taken, self.samples = self.samples, {}
+        return taken
+
+
+EXTRACTION_ANSWER = json.dumps({
+    "policyholderName": {"value": "Ramesh Kumar Sharma", "confidence": 92},
+    "issueDateRaw": "15th June 2024",
+    "issueDate": {"value": "15-06-2024", "confidence": 90},
+    "expirationDateRaw": "14th June 2025",
+    "expirationDate": {"value": "14-06-2025", "confidence": 88},
+    "providerName": {"value": "Example Health", "confidence": 95},
+    "policyholderAddress": {"value": "12 MG Road, Bengaluru", "confidence": 70},
+    "policyNumber": {"value": "P/161114/01/2024/001234", "confidence": 93},
+    "premiumAmount": {"value": "Rs. 5,00,000", "confidence": 85},
+    "deductibles": {"value": "Rs. 2,500 monthly", "confidence": 80},
+    "termsAndExclusions": ["Pre-existing diseases for 48 months", "Cosmetic surgery"]
+})
+
+
+class FakeOpenAI:
+    """Enough of AzureOpenAI for chat.completions.create, streaming included."""
+
+    def __init__(self, timer, latency=0.4, token_latency=0.005, answer_words=80):
+        self.timer = timer
+        self.latency = latency
+        self.token_latency = token_latency
+        self.answer_words = answer_words
+        self.chat = NS(completions=NS(create=self._create))
+
+    def _create(self, model=None, messages=None, stream=False, stream_options=None, **kwargs):
+        extraction = "extract" in (messages[0]["content"] if messages else "").lower()
+        content = EXTRACTION_ANSWER if extraction else " ".join(["Answer"] + ["word"] * (self.answer_words - 1))
+        prompt_tokens = sum(len(m["content"]) for m in messages) // 4
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(content) // 4,
+                 "total_tokens": prompt_tokens + len(content) // 4}
+
+        started = time.perf_counter()
+        time.sleep(self.latency)
+        if not stream:
+            time.sleep(self.token_latency * len(content.split()))
+            self.timer.add("openai", time.perf_counter() - started)
+            return NS(choices=[NS(message=NS(content=content))], usage=NS(model_dump=lambda: usage))
+        return self._stream(content, usage, started)
+
+    def _stream(self, content, usage, started):
+        for word in content.split():
+            time.sleep(self.token_latency)
+            yield NS(choices=[NS(delta=NS(content=word + " "))], usage=None)
+        yield NS(choices=[], usage=NS(model_dump=lambda: usage))
+        self.timer.add("openai", time.perf_counter() - started)
+
+
+def fake_embeddings(timer, dimensions, latency=0.05, batch_size=16):
+    """get_embeddings replacement: deterministic vectors, `latency` per batch of `batch_size`."""
+    def get_embeddings(texts, *args, **kwargs):
+        started = time.perf_counter()
+        time.sleep(latency * (len(texts) + batch_size - 1) // batch_size)
+        vectors = []
+        for text in texts:
+            seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:4], "little")
+            vectors.append(np.random.default_rng(seed).standard_normal(dimensions).astype(np.float32).tolist())
+        timer.add("embed", time.perf_counter() - started)
+        return vectors
+    return get_embeddings
+
+
+class FakeSearch(retrieval.RetrievalBackend):
+    """RetrievalBackend kept in memory; search returns a source's first chunks.
+
+    search_async comes from the base class, so the ASGI routes run against it too.
+    """
+
+    def __init__(self, timer, latency=0.03):
+        self.timer = timer
+        self.latency = latency
+        self._lock = threading.Lock()
+        self._by_source = {}
+
+    def upload(self, documents, replace=True):
+        started = time.perf_counter()
+        time.sleep(self.latency)
+        uploaded = {}
+        for doc in documents:
+            uploaded.setdefault(doc["source"], []).append(doc["content"])
+        with self._lock:
+            # Like the real backends, an upload replaces the source's earlier chunks
+            self._by_source.update(uploaded)
+        self.timer.add("search_upload", time.perf_counter() - started)
+        return {doc["id"]: {"succeeded": True, "status_code": 201, "error": None} for doc in documents}
+
+    def search(self, question, query_vector=None, top_k=5, source=None):
+        started = time.perf_counter()
+        time.sleep(self.latency)
+        with self._lock:
+            hits = list(self._by_source.get(source, []))[:top_k]
+        self.timer.add("search_query", time.perf_counter() - started)
+        return hits
+
+
+class FakeContainer:
+    """Blob container client: uploads cost `latency` plus `per_mb` per megabyte."""
+
+    def __init__(self, timer, latency=0.05, per_mb=0.02):
+        self.timer = timer
+        self.latency = latency
+        self.per_mb = per_mb
+        self.blobs = {}
+
+    def get_blob_client(self, name):
+        container = self
+
+        class Blob:
+            def upload_blob(self, data, overwrite=False):
+                started = time.perf_counter()
+                if isinstance(data, bytes):
+                    size = len(data)
+                else:
+                    # Streamed uploads are consumed in blocks, like the SDK does, and not kept
+                    size = sum(len(block) for block in iter(lambda: data.read(4 * 2 ** 20), b""))
+                    data = None
+                time.sleep(container.latency + container.per_mb * size / 2 ** 20)
+                container.blobs[name] = data
+                container.timer.add("blob_upload", time.perf_counter() - started)
+
+            def download_blob(self):
+                data = container.blobs[name]
+                started = time.perf_counter()
+                time.sleep(container.latency + container.per_mb * len(data) / 2 ** 20)
+                container.timer.add("blob_download", time.perf_counter() - started)
+                return NS(readinto=lambda stream: stream.write(data), readall=lambda: data)
+
+        return Blob()
+
+
+def fake_apply_ocr(timer, per_page=0.15):
+    """apply_ocr replacement: `per_page` seconds for each empty page."""
+    def apply_ocr(pages, pdf_path):
+        started = time.perf_counter()
+        for page in pages:
+            if page["is_empty"]:
+                time.sleep(per_page)
+                page["text"] = f"Scanned page {page['page']} policy schedule text " * 40
+                page["word_count"] = len(page["text"].split())
+                page["is_empty"] = False
+                page["ocr"] = True
+        timer.add("ocr_engine", time.perf_counter() - started)
+        return pages
+    return apply_ocr
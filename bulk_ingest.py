@@ -0,0 +1,348 @@
+"""Back-fill the archive: parse, index and extract many PDFs at once.
+
+    python bulk_ingest.py /data/policies --user-id archive
+    python bulk_ingest.py manifest.jsonl --workers 8 --batch-docs 64
+
+The source is a directory (searched recursively for *.pdf) or a manifest
+with one PDF path per line, or one JSON object per line with "path" and
+optionally "user_id" and "name".
+
+PDFs are parsed in a process pool, one batch ahead of the batch being
+indexed and extracted. Each batch embeds all its chunks together, uploads
+them to the retrieval backend in one call and writes its extraction records
+with a single insert_many. Progress goes into a SQLite checkpoint after
+every batch, so rerunning the same command after a crash resumes with the
+first unfinished PDF.
+
+A file whose bytes were already extracted successfully is handled the way
+/extract handles it: skipped if its owner already has the record, otherwise
+linked to a new record for the new owner without another extraction.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import sqlite3
+import hashlib
+import logging
+import argparse
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+from Analytics import SKIPPED_EXTRACTION
+from chunking import iter_chunks
+from ingest_pdf import extract_pages, summarize_pages, chunk_document
+
+load_dotenv()
+# The CLI imports the app for its helpers; it shouldn't take /extract jobs
+os.environ.setdefault("EXTRACT_WORKERS_AUTOSTART", "false")
+
+BULK_MP_CONTEXT = os.getenv("BULK_MP_CONTEXT", "spawn")
+STAGES = ["parse", "ocr", "embed", "index", "extract", "save"]
+
+
+# ------------------ SOURCES ------------------
+def iter_sources(source, default_user):
+    """Yield {"path", "name", "user_id"} for every PDF in a directory or manifest."""
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for file in sorted(files):
+                if file.lower().endswith(".pdf"):
+                    path = os.path.join(root, file)
+                    yield {"path": path, "name": os.path.relpath(path, source), "user_id": default_user}
+        return
+
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            entry = json.loads(line) if line.startswith("{") else {"path": line}
+            path = entry["path"] if os.path.isabs(entry["path"]) else os.path.join(base, entry["path"])
+            yield {
+                "path": path,
+                "name": entry.get("name") or os.path.basename(path),
+                "user_id": entry.get("user_id") or default_user
+            }
+
+
+# ------------------ CHECKPOINT ------------------
+class Checkpoint:
+    """SQLite record of every PDF that reached a final state (done, duplicate, linked, failed)."""
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, status TEXT, pdf_id TEXT, fingerprint TEXT, error TEXT, finished_at TEXT)"
+        )
+        self.conn.commit()
+
+    def finished(self, retry_failed=False):
+        statuses = ("done", "duplicate", "linked") if retry_failed else ("done", "duplicate", "linked", "failed")
+        rows = self.conn.execute(
+            f"SELECT path FROM files WHERE status IN ({','.join('?' * len(statuses))})", statuses
+        )
+        return {row[0] for row in rows}
+
+    def record(self, results):
+        now = datetime.utcnow().isoformat()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+            [(r["path"], r["status"], r.get("pdf_id"), r.get("fingerprint"), r.get("error"), now) for r in results]
+        )
+        self.conn.commit()
+
+    def counts(self):
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM files GROUP BY status").fetchall())
+
+
+# ------------------ PARSE (process pool) ------------------
+def parse_pdf(item):
+    """Runs in a pool worker: fingerprint and parse one PDF."""
+    started = time.perf_counter()
+    try:
+        with open(item["path"], "rb") as f:
+            data = f.read()
+        pages = extract_pages(data)
+        return {
+            **item,
+            "fingerprint": hashlib.sha256(data).hexdigest(),
+            "pages": pages,
+            "parse_seconds": time.perf_counter() - started
+        }
+    except Exception as e:
+        return {**item, "error": f"parse failed: {e}", "parse_seconds": time.perf_counter() - started}
+
+
+def _batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# ------------------ INGEST ------------------
+class BulkIngest:
+    def __init__(self, args):
+        # Imported here so spawned parse workers don't boot the Flask app
+        import app
+        from ocr import needs_ocr, apply_ocr
+        from ingest_pdf import get_embeddings_cached
+        from retrieval import get_backend
+        from rollups import apply_change
+
+        self.app = app
+        self.needs_ocr, self.apply_ocr = needs_ocr, apply_ocr
+        self.embed, self.backend = get_embeddings_cached, get_backend()
+        self.apply_change = apply_change
+        self.args = args
+        self.timings = dict.fromkeys(STAGES, 0.0)
+        self.docs = self.pages = 0
+        self.started = time.perf_counter()
+
+    def _timed(self, stage, fn, *args):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            self.timings[stage] += time.perf_counter() - started
+
+    def run_batch(self, parsed):
+        results = [{"path": p["path"], "status": "failed", "error": p["error"]} for p in parsed if "error" in p]
+        docs = [p for p in parsed if "error" not in p]
+        self.timings["parse"] += sum(p["parse_seconds"] for p in parsed)
+
+        # Identical files already extracted (this run or an earlier one) are reused as /extract reuses
+        # them: skipped when the owner already has the record, linked to a new record for anyone else
+        priors = self.app.pdf_collection.find(
+            {"fingerprint": {"$in": [d["fingerprint"] for d in docs]},
+             "extractionVersion": self.app.EXTRACTION_VERSION,
+             **self.app.REUSABLE_EXTRACTION},
+            {"fingerprint": 1, "user_id": 1}
+        )
+        owned = {(rec["fingerprint"], rec.get("user_id")) for rec in priors}
+        extracted = {fingerprint for fingerprint, _ in owned}
+        unique, linked = [], []
+        for doc in docs:
+            if (doc["fingerprint"], doc["user_id"]) in owned:
+                results.append({"path": doc["path"], "status": "duplicate", "fingerprint": doc["fingerprint"]})
+                continue
+            owned.add((doc["fingerprint"], doc["user_id"]))
+            if doc["fingerprint"] in extracted:
+                linked.append(doc)
+            else:
+                extracted.add(doc["fingerprint"])
+                unique.append(doc)
+
+        for doc in unique:
+            doc["stats"] = summarize_pages(doc["pages"])
+            if self.needs_ocr(doc["stats"]):
+                self._timed("ocr", self.apply_ocr, doc["pages"], doc["path"])
+                doc["stats"] = summarize_pages(doc["pages"])
+
+        if not self.args.no_index:
+            self._index(unique)
+        self._timed("extract", self._extract, unique)
+        results += self._timed("save", self._save, unique)
+        # After the save, so a copy of a file first seen in this batch links to its new record
+        results += self._timed("save", self._link, linked)
+
+        self.docs += len(unique)
+        self.pages += sum(d["stats"]["page_count"] for d in unique)
+        return results
+
+    def _index(self, docs):
+        chunks = [(doc, chunk) for doc in docs for chunk in iter_chunks(doc["pages"])]
+        vectors = self._timed("embed", self.embed, [chunk["text"] for _, chunk in chunks])
+        documents, owner = [], {}
+        for (doc, chunk), vector in zip(chunks, vectors):
+            if not vector:
+                doc["error"] = "embedding failed"
+                continue
+            # Stable keys, and uploads replacing their source's chunks, make a re-run overwrite on either backend
+            document = chunk_document(chunk, vector, doc["fingerprint"])
+            owner[document["id"]] = doc
+            documents.append(document)
+        if not documents:
+            return
+
+        status = self._timed("index", self.backend.upload, documents)
+        for key, entry in status.items():
+            if not entry["succeeded"]:
+                owner[key]["error"] = f"index failed: {entry['error']}"
+
+    def _extract(self, docs):
+        def one(doc):
+            if "error" in doc:
+                return
+            try:
+                doc["ai_data"] = self.app.extract_fields(doc["pages"], doc["stats"]["text"])
+            except Exception as e:
+                doc["error"] = f"extraction failed: {e}"
+
+        if self.args.no_extract:
+            return
+        with ThreadPoolExecutor(max_workers=self.args.extract_concurrency) as pool:
+            list(pool.map(one, docs))
+
+    def _save(self, docs):
+        records, results = [], []
+        for doc in docs:
+            if "error" in doc:
+                results.append({"path": doc["path"], "status": "failed", "error": doc["error"]})
+                continue
+            pdf_id = str(uuid.uuid4())
+            records.append({
+                "pdf_id": pdf_id,
+                "pdfName": os.path.basename(doc["name"]),
+                # --no-extract records are marked so nothing reuses or analyses the empty result
+                "ai_data": doc.get("ai_data", {"extractionMethod": SKIPPED_EXTRACTION}),
+                "pageCount": doc["stats"]["page_count"],
+                "wordCount": doc["stats"]["word_count"],
+                "timestamp": datetime.utcnow(),
+                "user_id": doc["user_id"],
+                "fingerprint": doc["fingerprint"],
+                "extractionVersion": None if self.args.no_extract else self.app.EXTRACTION_VERSION,
+                "searchSource": self.app.search_source(doc["fingerprint"], pdf_id),
+                # Docs whose chunks failed to upload were dropped above
+                **({"indexStatus": "skipped", "indexedAt": None} if self.args.no_index else self.app.index_fields())
+            })
+            results.append({"path": doc["path"], "status": "done", "pdf_id": pdf_id, "fingerprint": doc["fingerprint"]})
+
+        if records:
+            self.app.pdf_collection.insert_many(records, ordered=False)
+            for record in records:
+                self.apply_change(self.app.pdf_collection, self.app.rollup_collection, new=record)
+        return results
+
+    def _link(self, docs):
+        results = []
+        for doc in docs:
+            pdf_id = str(uuid.uuid4())
+            reused = self.app.reuse_prior_extraction(
+                doc["fingerprint"], os.path.basename(doc["name"]), doc["user_id"], pdf_id
+            )
+            if reused is None:
+                # Only a copy of a file that failed earlier in this batch gets here
+                results.append({"path": doc["path"], "status": "failed", "error": "identical file failed to extract"})
+            else:
+                results.append({"path": doc["path"], "status": "linked", "pdf_id": pdf_id, "fingerprint": doc["fingerprint"]})
+        return results
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        return {
+            "docs": self.docs,
+            "pages": self.pages,
+            "elapsed_seconds": round(elapsed, 1),
+            "docs_per_second": round(self.docs / elapsed, 2) if elapsed else 0.0,
+            "pages_per_second": round(self.pages / elapsed, 2) if elapsed else 0.0,
+            # parse is summed across pool workers, so it can exceed wall time
+            "stage_seconds": {stage: round(s, 1) for stage, s in self.timings.items()}
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-ingest a directory or manifest of PDFs.")
+    parser.add_argument("source", help="directory of PDFs or manifest file")
+    parser.add_argument("--user-id", default="bulk-import", help="owner for entries without a user_id")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="parse processes")
+    parser.add_argument("--batch-docs", type=int, default=32, help="PDFs per embed/index/save batch")
+    parser.add_argument("--extract-concurrency", type=int, default=4, help="GPT extraction calls in flight")
+    parser.add_argument("--checkpoint", default="bulk_ingest.checkpoint.sqlite")
+    parser.add_argument("--retry-failed", action="store_true", help="also retry PDFs that failed before")
+    parser.add_argument("--no-index", action="store_true", help="skip embeddings and the search index")
+    parser.add_argument("--no-extract", action="store_true", help="skip GPT extraction")
+    parser.add_argument("--limit", type=int, help="stop after this many PDFs")
+    parser.add_argument("--json", help="write the final report to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    checkpoint = Checkpoint(args.checkpoint)
+    finished = checkpoint.finished(retry_failed=args.retry_failed)
+    pending = [item for item in iter_sources(args.source, args.user_id) if item["path"] not in finished]
+    if args.limit:
+        pending = pending[:args.limit]
+    print(f"📦 {len(pending)} PDFs to ingest ({len(finished)} already finished)")
+    if not pending:
+        return
+
+    ingest = BulkIngest(args)
+    context = multiprocessing.get_context(BULK_MP_CONTEXT)
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=context) as pool:
+        batches = _batches(pending, args.batch_docs)
+        submit = lambda batch: [pool.submit(parse_pdf, item) for item in batch] if batch else None
+
+        # Keep the pool parsing the next batch while this one is embedded, indexed and saved
+        upcoming = submit(next(batches, None))
+        while upcoming:
+            current, upcoming = upcoming, submit(next(batches, None))
+            results = ingest.run_batch([f.result() for f in current])
+            checkpoint.record(results)
+
+            r = ingest.report()
+            failed = sum(1 for x in results if x["status"] == "failed")
+            print(f"⏱️ {r['docs']} docs, {r['pages']} pages | {r['docs_per_second']} docs/s, "
+                  f"{r['pages_per_second']} pages/s | {failed} failed in batch | "
+                  + " ".join(f"{k}={v}s" for k, v in r["stage_seconds"].items()), flush=True)
+
+    report = {**ingest.report(), "checkpoint": checkpoint.counts()}
+    print(f"✅ Done: {json.dumps(report)}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
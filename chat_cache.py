@@ -0,0 +1,139 @@
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+
+from clients import lazy_import
+
+# Answer cache for /chat.
+#
+# Entries are keyed by (pdf_id, normalized question, prompt version) and
+# remember the record revision they were answered against, so an edit saved
+# by any worker makes older answers stale. Eviction is LRU with a TTL.
+# Semantic mode also matches near-duplicate questions about the same PDF by
+# cosine similarity of their embeddings.
+
+CHAT_CACHE_ENABLED = os.getenv("CHAT_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+CHAT_CACHE_MAX_ENTRIES = int(os.getenv("CHAT_CACHE_MAX_ENTRIES", "2000"))
+CHAT_CACHE_TTL_SECONDS = int(os.getenv("CHAT_CACHE_TTL_SECONDS", "3600"))
+CHAT_CACHE_SEMANTIC = os.getenv("CHAT_CACHE_SEMANTIC", "false").lower() in ("1", "true", "yes")
+CHAT_CACHE_SIMILARITY = float(os.getenv("CHAT_CACHE_SIMILARITY", "0.95"))
+
+
+def normalize_question(question):
+    return re.sub(r"[^\w\s]", "", re.sub(r"\s+", " ", question or "")).strip().lower()
+
+
+class AnswerCache:
+    def __init__(self, max_entries=CHAT_CACHE_MAX_ENTRIES, ttl=CHAT_CACHE_TTL_SECONDS,
+                 semantic=CHAT_CACHE_SEMANTIC, threshold=CHAT_CACHE_SIMILARITY):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.semantic = semantic
+        self.threshold = threshold
+        self._entries = OrderedDict()
+        self._by_pdf = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "semantic_hits": 0, "misses": 0, "saved_seconds": 0.0}
+
+    def _key(self, pdf_id, question, version):
+        return (pdf_id, normalize_question(question), version)
+
+    def get(self, pdf_id, question, version, revision, query_vector=None):
+        """Cached answer for this question about this PDF revision, or None."""
+        if not CHAT_CACHE_ENABLED:
+            return None
+        key = self._key(pdf_id, question, version)
+        now = time.time()
+
+        with self._lock:
+            entry = self._live_entry(key, revision, now)
+            if entry is None and self.semantic and query_vector:
+                entry = self._nearest(pdf_id, version, revision, query_vector, now)
+                if entry is not None:
+                    self._stats["semantic_hits"] += 1
+
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+
+            self._entries.move_to_end(entry["key"])
+            self._stats["hits"] += 1
+            self._stats["saved_seconds"] += entry["latency"]
+            return entry["answer"]
+
+    def put(self, pdf_id, question, version, revision, answer, latency, query_vector=None):
+        if not CHAT_CACHE_ENABLED:
+            return
+        key = self._key(pdf_id, question, version)
+        vector = None
+        if self.semantic and query_vector:
+            np = lazy_import("numpy")
+            vector = np.asarray(query_vector, dtype=np.float32)
+            vector /= np.linalg.norm(vector) or 1
+
+        with self._lock:
+            self._entries[key] = {
+                "key": key,
+                "answer": answer,
+                "revision": revision,
+                "latency": latency,
+                "vector": vector,
+                "expires": time.time() + self.ttl
+            }
+            self._entries.move_to_end(key)
+            self._by_pdf.setdefault(pdf_id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                old_key, _ = self._entries.popitem(last=False)
+                self._forget(old_key)
+
+    def invalidate(self, pdf_id):
+        """Drop every cached answer for a PDF (called when /save edits it)."""
+        with self._lock:
+            for key in self._by_pdf.pop(pdf_id, set()):
+                self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["saved_seconds"] = round(stats["saved_seconds"], 3)
+        return stats
+
+    # ---------- internals (lock held) ----------
+    def _live_entry(self, key, revision, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry["expires"] < now or entry["revision"] != revision:
+            self._entries.pop(key)
+            self._forget(key)
+            return None
+        return entry
+
+    def _nearest(self, pdf_id, version, revision, query_vector, now):
+        candidates = [
+            self._live_entry(key, revision, now)
+            for key in list(self._by_pdf.get(pdf_id, ()))
+            if key[2] == version
+        ]
+        candidates = [e for e in candidates if e is not None and e["vector"] is not None]
+        if not candidates:
+            return None
+
+        np = lazy_import("numpy")
+        query = np.asarray(query_vector, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1
+        scores = np.stack([e["vector"] for e in candidates]) @ query
+        best = int(np.argmax(scores))
+        return candidates[best] if scores[best] >= self.threshold else None
+
+    def _forget(self, key):
+        keys = self._by_pdf.get(key[0])
+        if keys:
+            keys.discard(key)
+            if not keys:
+                self._by_pdf.pop(key[0], None)
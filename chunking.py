@@ -0,0 +1,72 @@
+import os
+from collections import deque
+
+from long_doc import CHARS_PER_TOKEN
+
+# Token-window chunking for the search index.
+#
+# Words from consecutive pages are packed into windows of about CHUNK_TOKENS
+# tokens, and each window starts with the last CHUNK_OVERLAP_TOKENS tokens of
+# the previous one. A dense page becomes several chunks, and short pages
+# (covers, signature pages) join their neighbours instead of becoming
+# vectors of their own. Each chunk records the pages it came from.
+#
+# Token counts use the same chars/4 estimate as long_doc.
+
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "512"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "64"))
+
+
+def _word_tokens(word):
+    return (len(word) + 1) / CHARS_PER_TOKEN
+
+
+def _words(text, max_chars):
+    # Runs without whitespace (tables, base64, OCR noise) are cut so no one word overflows a window
+    for word in text.split():
+        for start in range(0, len(word), max_chars):
+            yield word[start:start + max_chars]
+
+
+def iter_chunks(pages, max_tokens=CHUNK_TOKENS, overlap=CHUNK_OVERLAP_TOKENS):
+    """Yield chunks from an iterable of page records (see ingest_pdf.extract_pages).
+
+    Each chunk is a dict with `index`, `text`, `page_start`, `page_end` and
+    an estimated `tokens` count.
+    """
+    overlap = min(overlap, max_tokens // 2)
+    window = deque()  # (word, page, tokens)
+    size = 0.0
+    fresh = 0  # words added since the last chunk was emitted
+    index = 0
+
+    def emit():
+        return {
+            "index": index,
+            "text": " ".join(word for word, _, _ in window),
+            "page_start": window[0][1],
+            "page_end": window[-1][1],
+            "tokens": round(size)
+        }
+
+    max_word_chars = max(1, (max_tokens // 4) * CHARS_PER_TOKEN)
+    for page in pages:
+        for word in _words(page["text"], max_word_chars):
+            tokens = _word_tokens(word)
+            window.append((word, page["page"], tokens))
+            size += tokens
+            fresh += 1
+            if size >= max_tokens:
+                yield emit()
+                index += 1
+                fresh = 0
+                while window and size > overlap:
+                    size -= window.popleft()[2]
+
+    if fresh:
+        yield emit()
+
+
+def chunk_metadata(source_name, chunk):
+    """The index's metadata string: "source:<name>;pages:<start>-<end>"."""
+    return f"source:{source_name};pages:{chunk['page_start']}-{chunk['page_end']}"
@@ -0,0 +1,283 @@
+import os
+import time
+import logging
+import importlib
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Shared, long-lived clients, created once per worker process.
+#
+# Nothing is built at import time. The first call to openai_client(),
+# mongo_db(), blob_container() or http_session() in a process builds that
+# client (pooled, keep-alive) and every later call reuses it. A fork (e.g.
+# gunicorn --preload) is detected by pid and the child builds its own set,
+# so no socket is ever shared across processes.
+#
+# Module-level names such as app.client_azure and app.pdf_collection are
+# LazyProxy objects over these getters, so callers keep using them as before.
+#
+# Heavy modules (openai, pymongo, bson, numpy, httpx, PyMuPDF, the Blob SDK)
+# are only imported through lazy_import() on first use, never at module
+# import. startup_report() lists what those imports and client inits cost;
+# the app logs it at boot and serves it at GET /clients/stats.
+#
+# async_openai_client() and async_http_client() are the asyncio counterparts
+# used by the ASGI server (asgi.py). They belong to the event loop of the
+# worker process that first asks for them.
+
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "60"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_TIMEOUT_MS = int(os.getenv("MONGO_TIMEOUT_MS", "5000"))
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+# One event loop multiplexes every in-flight request, so its pool is larger
+ASYNC_HTTP_POOL_SIZE = int(os.getenv("ASYNC_HTTP_POOL_SIZE", "200"))
+HTTP_TIMEOUT_SECONDS = float(os.getenv("HTTP_TIMEOUT_SECONDS", "60"))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "5"))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+BLOB_TIMEOUT_SECONDS = int(os.getenv("BLOB_TIMEOUT_SECONDS", "60"))
+
+_import_costs = {}
+_import_lock = threading.Lock()
+
+
+def lazy_import(name):
+    """importlib.import_module that records how long the first import took."""
+    with _import_lock:
+        if name not in _import_costs:
+            started = time.perf_counter()
+            module = importlib.import_module(name)
+            _import_costs[name] = time.perf_counter() - started
+            return module
+    return importlib.import_module(name)
+
+
+class ClientRegistry:
+    def __init__(self):
+        self._factories = {}
+        self._clients = {}
+        self._init_costs = {}
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def register(self, name, factory):
+        self._factories[name] = factory
+
+    def get(self, name):
+        if self._pid == os.getpid() and name in self._clients:
+            return self._clients[name]
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked: the parent's sockets are not ours to use
+                self._clients, self._init_costs, self._pid = {}, {}, os.getpid()
+            if name not in self._clients:
+                started = time.perf_counter()
+                self._clients[name] = self._factories[name]()
+                self._init_costs[name] = time.perf_counter() - started
+                logging.info(f"🔌 {name} client ready in {self._init_costs[name] * 1000:.0f} ms (pid {self._pid})")
+            return self._clients[name]
+
+    def init_costs(self):
+        with self._lock:
+            return dict(self._init_costs) if self._pid == os.getpid() else {}
+
+
+registry = ClientRegistry()
+
+
+# ------------------ FACTORIES ------------------
+def _build_openai():
+    openai = lazy_import("openai")
+    return openai.AzureOpenAI(
+        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        api_version=os.getenv("AZURE_API_VERSION"),
+        timeout=OPENAI_TIMEOUT_SECONDS,
+        max_retries=OPENAI_MAX_RETRIES
+    )
+
+
+def _build_mongo():
+    pymongo = lazy_import("pymongo")
+    return pymongo.MongoClient(
+        os.getenv("MONGO_URI"),
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        connectTimeoutMS=MONGO_TIMEOUT_MS,
+        serverSelectionTimeoutMS=MONGO_TIMEOUT_MS
+    )
+
+
+def _build_blob_container():
+    blob = lazy_import("azure.storage.blob")
+    service = blob.BlobServiceClient.from_connection_string(
+        os.getenv("AZURE_BLOB_CONNECTION_STRING"),
+        connection_timeout=BLOB_TIMEOUT_SECONDS,
+        read_timeout=BLOB_TIMEOUT_SECONDS
+    )
+    return service.get_container_client(os.getenv("AZURE_STORAGE_CONTAINER"))
+
+
+def _build_async_openai():
+    openai = lazy_import("openai")
+    return openai.AsyncAzureOpenAI(
+        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        api_version=os.getenv("AZURE_API_VERSION"),
+        timeout=OPENAI_TIMEOUT_SECONDS,
+        max_retries=OPENAI_MAX_RETRIES
+    )
+
+
+def _build_async_http():
+    httpx = lazy_import("httpx")
+    return httpx.AsyncClient(
+        timeout=HTTP_TIMEOUT_SECONDS,
+        limits=httpx.Limits(max_connections=ASYNC_HTTP_POOL_SIZE, max_keepalive_connections=ASYNC_HTTP_POOL_SIZE)
+    )
+
+
+def _build_http_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+registry.register("openai", _build_openai)
+registry.register("mongo", _build_mongo)
+registry.register("blob", _build_blob_container)
+registry.register("http", _build_http_session)
+registry.register("openai_async", _build_async_openai)
+registry.register("http_async", _build_async_http)
+
+
+def openai_client():
+    return registry.get("openai")
+
+
+def mongo_client():
+    return registry.get("mongo")
+
+
+def mongo_db(name="pdf_data"):
+    return mongo_client()[name]
+
+
+def blob_container():
+    return registry.get("blob")
+
+
+def http_session():
+    """Keep-alive requests.Session for Azure OpenAI REST and Azure Search calls."""
+    return registry.get("http")
+
+
+def async_openai_client():
+    return registry.get("openai_async")
+
+
+def async_http_client():
+    """Keep-alive httpx.AsyncClient for Azure OpenAI REST and Azure Search calls from coroutines."""
+    return registry.get("http_async")
+
+
+def post_with_retry(url, headers, payload, max_retries=HTTP_MAX_RETRIES, on_throttle=None):
+    """POST over the pooled session, backing off on 429/5xx and honouring Retry-After.
+
+    `payload` is sent as JSON, or as-is when it is already serialized bytes.
+    `on_throttle(seconds)` is called before sleeping on a 429.
+    """
+    body = {"data": payload} if isinstance(payload, bytes) else {"json": payload}
+    delay = 1.0
+    for attempt in range(max_retries + 1):
+        try:
+            res = http_session().post(url, headers=headers, timeout=HTTP_TIMEOUT_SECONDS, **body)
+        except requests.RequestException as e:
+            if attempt == max_retries:
+                raise
+            logging.warning(f"⚠️ {e} — retrying in {delay:.1f}s")
+        else:
+            if res.status_code not in RETRY_STATUSES or attempt == max_retries:
+                return res
+            retry_after = res.headers.get("Retry-After")
+            if retry_after and retry_after.replace(".", "", 1).isdigit():
+                delay = float(retry_after)
+            logging.warning(f"⚠️ HTTP {res.status_code} — retrying in {delay:.1f}s")
+            if res.status_code == 429 and on_throttle:
+                on_throttle(delay)
+        time.sleep(delay)
+        delay = min(delay * 2, 30)
+
+
+async def apost_with_retry(url, headers, payload, max_retries=HTTP_MAX_RETRIES, on_throttle=None):
+    """post_with_retry for coroutines, over the shared httpx.AsyncClient."""
+    import asyncio
+    httpx = lazy_import("httpx")
+
+    body = {"content": payload} if isinstance(payload, bytes) else {"json": payload}
+    delay = 1.0
+    for attempt in range(max_retries + 1):
+        try:
+            res = await async_http_client().post(url, headers=headers, **body)
+        except httpx.HTTPError as e:
+            if attempt == max_retries:
+                raise
+            logging.warning(f"⚠️ {e} — retrying in {delay:.1f}s")
+        else:
+            if res.status_code not in RETRY_STATUSES or attempt == max_retries:
+                return res
+            retry_after = res.headers.get("Retry-After")
+            if retry_after and retry_after.replace(".", "", 1).isdigit():
+                delay = float(retry_after)
+            logging.warning(f"⚠️ HTTP {res.status_code} — retrying in {delay:.1f}s")
+            if res.status_code == 429 and on_throttle:
+                on_throttle(delay)
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 30)
+
+
+class LazyProxy:
+    """Stands in for a client object and resolves it through `getter` on every use."""
+
+    def __init__(self, getter):
+        object.__setattr__(self, "_getter", getter)
+
+    def __getattr__(self, name):
+        return getattr(self._getter(), name)
+
+    def __getitem__(self, key):
+        return self._getter()[key]
+
+    def __repr__(self):
+        return f"<LazyProxy {self._getter.__name__}>"
+
+
+def collection_proxy(name, db_name="pdf_data"):
+    def collection():
+        return mongo_db(db_name)[name]
+    collection.__name__ = f"{db_name}.{name}"
+    return LazyProxy(collection)
+
+
+# ------------------ REPORTING ------------------
+def startup_report(boot_seconds=None):
+    with _import_lock:
+        imports = {name: round(s * 1000, 1) for name, s in _import_costs.items()}
+    return {
+        "pid": os.getpid(),
+        "boot_ms": round(boot_seconds * 1000, 1) if boot_seconds is not None else None,
+        "import_ms": imports,
+        "client_init_ms": {name: round(s * 1000, 1) for name, s in registry.init_costs().items()}
+    }
+
+
+def warm_up(names=("mongo", "openai", "http", "blob")):
+    """Build clients ahead of the first request (e.g. from a gunicorn post_fork hook)."""
+    for name in names:
+        try:
+            registry.get(name)
+        except Exception as e:
+            logging.warning(f"⚠️ Could not warm up {name} client: {e}")
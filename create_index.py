@@ -33,7 +33,9 @@ index_config = {
             "dimensions": 1536,  # ✅ FIXED: must be named "dimensions"
             "vectorSearchConfiguration": "default"
         },
-        {"name": "metadata", "type": "Edm.String", "searchable": True}
+        {"name": "metadata", "type": "Edm.String", "searchable": True},
+        # Chat filters on the document's source (fingerprint or pdf_id); rerun this script to add it to an existing index
+        {"name": "source", "type": "Edm.String", "searchable": False, "filterable": True}
     ],
     "vectorSearch": {
         "algorithmConfigurations": [
@@ -0,0 +1,135 @@
+import os
+import sys
+import logging
+import argparse
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+
+from clients import lazy_import
+
+# Index declarations for the pdf_data database.
+#
+# ensure_indexes() runs at app startup and creates whatever is missing.
+# `python db_indexes.py check` explains every route's query shape and fails
+# if any of them would fall back to a COLLSCAN.
+
+# pymongo's sort directions, spelled out so importing this module at app
+# boot doesn't import pymongo
+ASCENDING, DESCENDING = 1, -1
+
+INDEXES = {
+    "extracted_data": [
+        {"keys": [("pdf_id", ASCENDING)], "name": "pdf_id_unique", "unique": True},
+        # _id breaks timestamp ties for /analytics/pdf-details keyset pagination
+        {"keys": [("user_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)], "name": "user_id_timestamp_id"},
+        {"keys": [("fingerprint", ASCENDING), ("extractionVersion", ASCENDING)], "name": "fingerprint_version"},
+    ],
+    "users": [
+        {"keys": [("email", ASCENDING)], "name": "email_unique", "unique": True},
+    ],
+    "analytics_rollups": [
+        {"keys": [("user_id", ASCENDING), ("day", ASCENDING)], "name": "user_id_day"},
+    ],
+    "extract_jobs": [
+        {"keys": [("job_id", ASCENDING)], "name": "job_id_unique", "unique": True},
+        {"keys": [("status", ASCENDING), ("created_at", ASCENDING)], "name": "status_created_at"},
+    ],
+}
+
+
+def ensure_indexes(db):
+    """Create any declared index that doesn't exist yet; returns the names created."""
+    PyMongoError = lazy_import("pymongo.errors").PyMongoError
+    created = []
+    for collection_name, specs in INDEXES.items():
+        collection = db[collection_name]
+        try:
+            existing = {tuple(info["key"]) for info in collection.index_information().values()}
+        except PyMongoError as e:
+            logging.error(f"❌ Could not list indexes on {collection_name}: {e}")
+            continue
+        for spec in specs:
+            if tuple(spec["keys"]) in existing:
+                continue
+            try:
+                collection.create_index(spec["keys"], name=spec["name"], unique=spec.get("unique", False))
+                created.append(f"{collection_name}.{spec['name']}")
+            except PyMongoError as e:
+                # e.g. duplicate emails blocking a unique index; don't stop the others
+                logging.error(f"❌ Could not create index {collection_name}.{spec['name']}: {e}")
+    if created:
+        logging.info(f"🗂️ Created indexes: {', '.join(created)}")
+    return created
+
+
+def route_query_shapes():
+    """(label, collection, filter, sort) for every query a route issues."""
+    ObjectId = lazy_import("bson").ObjectId
+    since = datetime.utcnow() - timedelta(days=30)
+    return [
+        ("/save, /chat: record by pdf_id", "extracted_data", {"pdf_id": "x"}, None),
+        ("/analytics: user + period", "extracted_data", {"user_id": "u", "timestamp": {"$gte": since}}, None),
+        ("/analytics/trends: user + period", "extracted_data", {"user_id": "u", "timestamp": {"$gte": since}}, None),
+        ("/analytics/pdf-details: user, newest first", "extracted_data", {"user_id": "u"}, [("timestamp", -1), ("_id", -1)]),
+        ("/analytics/pdf-details: next page", "extracted_data",
+         {"user_id": "u", "$or": [{"timestamp": {"$lt": since}}, {"timestamp": since, "_id": {"$lt": ObjectId()}}]},
+         [("timestamp", -1), ("_id", -1)]),
+        ("/extract: duplicate upload lookup", "extracted_data",
+         {"fingerprint": "f", "extractionVersion": "v", "ai_data.raw_output": {"$exists": False},
+          "ai_data.extractionMethod": {"$ne": "skipped"}}, None),
+        ("deferred index: records sharing a search source", "extracted_data",
+         {"fingerprint": "f", "searchSource": "f"}, None),
+        ("index: was the search source indexed before", "extracted_data",
+         {"fingerprint": "f", "searchSource": "f", "pdf_id": {"$ne": "p"}}, None),
+        ("/signup, /login: user by email", "users", {"email": "a@b.c"}, None),
+        ("rollups: user + days", "analytics_rollups", {"user_id": "u", "day": {"$gte": since}, "count": {"$gt": 0}},
+         [("day", 1)]),
+        ("jobs: status by job_id", "extract_jobs", {"job_id": "j"}, None),
+        ("jobs: claim oldest queued or lapsed", "extract_jobs",
+         {"$or": [{"status": "queued"}, {"status": "running", "lease_until": {"$lt": since}}]}, [("created_at", 1)]),
+    ]
+
+
+def _stages(plan):
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from _stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _stages(item)
+
+
+def check_query_plans(db):
+    """Explain each route query; returns the labels whose winning plan is a COLLSCAN."""
+    failures = []
+    for label, collection_name, query, sort in route_query_shapes():
+        cursor = db[collection_name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        winning = cursor.explain().get("queryPlanner", {}).get("winningPlan", {})
+        stages = list(_stages(winning))
+        ok = "COLLSCAN" not in stages
+        print(f"{'✅' if ok else '❌'} {label}: {' <- '.join(stages)}")
+        if not ok:
+            failures.append(label)
+    return failures
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Create and verify pdf_data indexes.")
+    parser.add_argument("command", choices=["ensure", "check"])
+    args = parser.parse_args()
+
+    from pymongo import MongoClient
+
+    db = MongoClient(os.getenv("MONGO_URI"))["pdf_data"]
+    if args.command == "ensure":
+        print(f"✅ Created {len(ensure_indexes(db))} indexes")
+    else:
+        bad = check_query_plans(db)
+        print("✅ No route query falls back to COLLSCAN" if not bad else f"❌ {len(bad)} route queries scan the collection")
+        sys.exit(1 if bad else 0)
@@ -0,0 +1,247 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from array import array
+from datetime import datetime
+
+from clients import mongo_db, lazy_import
+
+# Content-addressed embedding cache.
+#
+# Keys are sha256(deployment + normalized chunk text), so the same page
+# embedded by the same deployment is only ever paid for once. Vectors are
+# stored as packed float32 (what the search index keeps anyway).
+#
+#   tier 1 (optional): local SQLite file, LRU with a size cap
+#   tier 2:            Mongo collection pdf_data.embedding_cache
+
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+EMBEDDING_CACHE_DISK_PATH = os.getenv("EMBEDDING_CACHE_DISK_PATH")  # unset = no disk tier
+EMBEDDING_CACHE_DISK_MAX_MB = float(os.getenv("EMBEDDING_CACHE_DISK_MAX_MB", "512"))
+
+_stats = {"disk_hits": 0, "mongo_hits": 0, "misses": 0}
+_stats_lock = threading.Lock()
+
+def normalize_text(text):
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def cache_key(text, deployment):
+    return hashlib.sha256(f"{deployment}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+def _pack(vector):
+    return array("f", vector).tobytes()
+
+
+def _unpack(blob):
+    vector = array("f")
+    vector.frombytes(bytes(blob))
+    return vector.tolist()
+
+
+def _count(name, n):
+    if n:
+        with _stats_lock:
+            _stats[name] += n
+
+
+def cache_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats["disk_hits"] + stats["mongo_hits"] + stats["misses"]
+    stats["hit_rate"] = round((lookups - stats["misses"]) / lookups, 4) if lookups else 0.0
+    return stats
+
+
+# ------------------ MONGO TIER ------------------
+def _mongo_collection():
+    return mongo_db()["embedding_cache"]
+
+
+def _mongo_get(keys):
+    found = {}
+    for doc in _mongo_collection().find({"_id": {"$in": keys}}, {"vector": 1}):
+        found[doc["_id"]] = _unpack(doc["vector"])
+    return found
+
+
+def _mongo_put(entries, deployment):
+    UpdateOne, Binary = lazy_import("pymongo").UpdateOne, lazy_import("bson").Binary
+    now = datetime.utcnow()
+    ops = [
+        UpdateOne(
+            {"_id": key},
+            {"$setOnInsert": {"vector": Binary(_pack(vector)), "deployment": deployment, "created_at": now}},
+            upsert=True
+        )
+        for key, vector in entries.items()
+    ]
+    if ops:
+        _mongo_collection().bulk_write(ops, ordered=False)
+
+
+# ------------------ DISK TIER (LRU) ------------------
+class DiskLRU:
+    """SQLite-backed LRU; safe to share between worker processes on one host."""
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings "
+                "(key TEXT PRIMARY KEY, vector BLOB, size INTEGER, last_used REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings(last_used)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, keys):
+        if not keys:
+            return {}
+        found = {}
+        with self._connect() as conn:
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                marks = ",".join("?" * len(part))
+                rows = conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({marks})", part).fetchall()
+                for key, blob in rows:
+                    found[key] = _unpack(blob)
+            if found:
+                now = time.time()
+                conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, k) for k in found])
+        return found
+
+    def put(self, entries):
+        if not entries:
+            return
+        now = time.time()
+        rows = []
+        for key, vector in entries.items():
+            blob = _pack(vector)
+            rows.append((key, blob, len(blob), now))
+        with self._connect() as conn:
+            conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+            self._evict(conn)
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Trim to 90% of the cap so we don't evict on every insert
+        excess = total - int(self.max_bytes * 0.9)
+        freed = 0
+        victims = []
+        for key, size in conn.execute("SELECT key, size FROM embeddings ORDER BY last_used ASC"):
+            victims.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        conn.executemany("DELETE FROM embeddings WHERE key = ?", victims)
+        logging.info(f"🧹 Evicted {len(victims)} embeddings from disk cache ({freed} bytes)")
+
+
+_disk = None
+_disk_lock = threading.Lock()
+
+
+def _disk_tier():
+    global _disk
+    if not EMBEDDING_CACHE_DISK_PATH:
+        return None
+    with _disk_lock:
+        if _disk is None:
+            _disk = DiskLRU(EMBEDDING_CACHE_DISK_PATH, int(EMBEDDING_CACHE_DISK_MAX_MB * 1024 * 1024))
+    return _disk
+
+
+def _disk_put(disk, entries):
+    try:
+        disk.put(entries)
+    except sqlite3.Error as e:
+        logging.warning(f"⚠️ Could not write disk embedding cache: {e}")
+
+
+# ------------------ PUBLIC API ------------------
+def _lookup(texts, deployment):
+    """Cached vectors for `texts`: returns (keys, found, missing keys, text for each key)."""
+    keys = [cache_key(t, deployment) for t in texts]
+    unique_keys = list(dict.fromkeys(keys))
+    found = {}
+
+    disk = _disk_tier()
+    if disk:
+        try:
+            found.update(disk.get(unique_keys))
+        except sqlite3.Error as e:
+            logging.warning(f"⚠️ Disk embedding cache unavailable: {e}")
+    _count("disk_hits", len(found))
+
+    missing = [k for k in unique_keys if k not in found]
+    if missing:
+        try:
+            from_mongo = _mongo_get(missing)
+        except Exception as e:
+            logging.warning(f"⚠️ Mongo embedding cache unavailable: {e}")
+            from_mongo = {}
+        _count("mongo_hits", len(from_mongo))
+        found.update(from_mongo)
+        if disk:
+            _disk_put(disk, from_mongo)
+
+    missing = [k for k in unique_keys if k not in found]
+    _count("misses", len(missing))
+    return keys, found, missing, dict(zip(keys, texts))
+
+
+def _store(fresh, deployment):
+    try:
+        _mongo_put(fresh, deployment)
+    except Exception as e:
+        logging.warning(f"⚠️ Could not write embedding cache: {e}")
+    disk = _disk_tier()
+    if disk:
+        _disk_put(disk, fresh)
+
+
+def embed_with_cache(texts, embed_fn, deployment):
+    """Return vectors for `texts`, calling `embed_fn` only for unseen content.
+
+    `embed_fn(list_of_texts)` must return vectors in input order, [] on failure.
+    Duplicate texts within one call are embedded once.
+    """
+    if not EMBEDDING_CACHE_ENABLED:
+        return embed_fn(texts)
+
+    keys, found, missing, text_for_key = _lookup(texts, deployment)
+    if missing:
+        vectors = embed_fn([text_for_key[k] for k in missing])
+        fresh = {k: v for k, v in zip(missing, vectors) if v}
+        found.update(fresh)
+        _store(fresh, deployment)
+
+    return [found.get(k, []) for k in keys]
+
+
+async def embed_with_cache_async(texts, embed_fn, deployment):
+    """embed_with_cache for coroutines: `embed_fn` is awaited, cache I/O runs in a thread."""
+    import asyncio
+
+    if not EMBEDDING_CACHE_ENABLED:
+        return await embed_fn(texts)
+
+    keys, found, missing, text_for_key = await asyncio.to_thread(_lookup, texts, deployment)
+    if missing:
+        vectors = await embed_fn([text_for_key[k] for k in missing])
+        fresh = {k: v for k, v in zip(missing, vectors) if v}
+        found.update(fresh)
+        await asyncio.to_thread(_store, fresh, deployment)
+
+    return [found.get(k, []) for k in keys]
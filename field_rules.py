@@ -0,0 +1,242 @@
+import os
+import re
+import json
+import logging
+
+from long_doc import CONFIDENCE_FIELDS, RAW_FIELDS
+
+# Deterministic field extraction that runs before GPT.
+#
+# Every rule is a precompiled pattern run against one line at a time, with
+# lines capped at FIELD_RULES_MAX_LINE_CHARS and only bounded quantifiers
+# in the patterns, so matching cost stays linear in the document size.
+# Rules produce {"value", "confidence"} candidates in the same nested shape
+# the model returns, so flatten_extraction and long_doc.merge_candidates
+# treat them like any other extraction. After a GPT call, rule values only
+# fill the FALLBACK_FIELDS the model left empty.
+#
+# Generic rules cover common labels from any insurer. A template is a set of
+# higher-confidence rules for one insurer's fixed-layout schedule, picked
+# when its `detect` pattern appears near the top of the document. Extra
+# templates can be loaded from the JSON file at FIELD_RULES_TEMPLATES:
+#
+#   [{"name": "acme-health", "provider": "Acme Health Insurance",
+#     "detect": "Acme Health Insurance Co",
+#     "rules": {"policyNumber": [{"pattern": "Policy No\\.?\\s*:\\s*([A-Z0-9/-]{6,25})",
+#                                 "confidence": 96}]}}]
+#
+# When every FIELD_RULES_REQUIRED field reaches FIELD_RULES_MIN_CONFIDENCE,
+# the GPT call is skipped.
+
+FIELD_RULES_ENABLED = os.getenv("FIELD_RULES_ENABLED", "true").lower() in ("1", "true", "yes")
+FIELD_RULES_MIN_CONFIDENCE = int(os.getenv("FIELD_RULES_MIN_CONFIDENCE", "90"))
+FIELD_RULES_REQUIRED = [
+    f.strip() for f in os.getenv(
+        "FIELD_RULES_REQUIRED",
+        "policyholderName,policyNumber,issueDate,expirationDate,providerName,premiumAmount"
+    ).split(",") if f.strip()
+]
+FIELD_RULES_TEMPLATES = os.getenv("FIELD_RULES_TEMPLATES")
+FIELD_RULES_MAX_LINE_CHARS = int(os.getenv("FIELD_RULES_MAX_LINE_CHARS", "400"))
+# How far into the document a template's detect pattern is looked for
+TEMPLATE_DETECT_CHARS = 4000
+MAX_TERMS = 25
+# Fields the rules fill in when GPT left them empty, as the old post-GPT
+# regex fallbacks did; the model's answer stands for everything else
+FALLBACK_FIELDS = ("premiumAmount", "deductibles")
+
+AMOUNT = r"(?:Rs\.?|INR|₹)\s?\d[\d,]{0,15}(?:\.\d{1,2})?"
+FREQUENCY = r"(?:monthly|quarterly|half[- ]yearly|annually|yearly)"
+DATE = (
+    r"\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}"
+    r"|\d{1,2}(?:st|nd|rd|th)?[ -][A-Za-z]{3,9},?[ -]\d{4}"
+    r"|[A-Za-z]{3,9} \d{1,2},? \d{4}"
+)
+SEP = r"\s{0,3}[:\-]?\s{0,3}"
+
+
+class Rule:
+    def __init__(self, pattern, confidence, flags=re.IGNORECASE):
+        self.pattern = re.compile(pattern, flags)
+        self.confidence = confidence
+
+    def match(self, line):
+        m = self.pattern.search(line)
+        if not m:
+            return None
+        value = (m.group(1) if m.groups() else m.group(0)).strip(" .,;:-")
+        return value or None
+
+
+GENERIC_RULES = {
+    "policyNumber": [
+        # The value must contain a digit so label text like "Policy Number: Details" isn't taken
+        Rule(rf"\bpolicy\s?(?:no|number|#)\.?{SEP}(?=[A-Z/-]{{0,29}}\d)([A-Z0-9][A-Z0-9/-]{{4,29}})\b", 85),
+    ],
+    "policyholderName": [
+        Rule(rf"\b(?:policy\s?holder|proposer|insured|life assured)(?:'s)?(?: name)?\s{{0,3}}:\s{{0,3}}"
+             rf"([A-Za-z][A-Za-z .']{{2,60}})", 80),
+    ],
+    "issueDate": [
+        Rule(rf"\b(?:date of issue|issue date|date of commencement|commencement date|policy start date)"
+             rf"{SEP}({DATE})", 85),
+    ],
+    "expirationDate": [
+        Rule(rf"\b(?:expiry date|date of expiry|expiration date|policy end date|maturity date|valid (?:till|until))"
+             rf"{SEP}({DATE})", 85),
+    ],
+    "premiumAmount": [
+        Rule(rf"\b(?:sum assured|total benefit|maturity amount)[^\n]{{0,60}}?({AMOUNT})", 75),
+    ],
+    "deductibles": [
+        Rule(rf"\b(?:premium frequency|recurring premium)[^\n]{{0,60}}?({AMOUNT}(?:\s{{0,3}}{FREQUENCY})?)", 75),
+        Rule(rf"\bpremium(?: per| payable)?[^\n]{{0,60}}?({AMOUNT}(?:\s{{0,3}}{FREQUENCY})?)", 70),
+    ],
+    "policyholderAddress": [
+        Rule(r"\b(?:address|correspondence address)\s{0,3}:\s{0,3}([^\n]{10,200})", 60),
+    ],
+}
+
+EXCLUSIONS_HEADING = re.compile(r"\bexclusions?\b", re.IGNORECASE)
+BULLET = re.compile(r"^\s{0,6}(?:[-•*▪]|\(?\d{1,3}[.)]|\(?[a-z][.)])\s{1,4}(\S.{4,300})$")
+
+
+# ------------------ TEMPLATES ------------------
+class Template:
+    def __init__(self, name, provider, detect, rules=None):
+        self.name = name
+        self.provider = provider
+        self.detect = re.compile(detect, re.IGNORECASE)
+        self.rules = {
+            field: [r if isinstance(r, Rule) else Rule(r["pattern"], r["confidence"]) for r in field_rules]
+            for field, field_rules in (rules or {}).items()
+        }
+
+
+# LIC's policy schedule prints one "Label : value" pair per line with fixed
+# labels, so rules anchored to the start of the line are trusted above the
+# generic ones and clear FIELD_RULES_MIN_CONFIDENCE on their own.
+LIC_RULES = {
+    "policyNumber": [Rule(r"^Policy (?:No|Number)\.?\s{0,3}:\s{0,3}(\d{9})\b", 95)],
+    "policyholderName": [Rule(r"^Name of (?:the )?Life Assured\s{0,3}:\s{0,3}([A-Za-z][A-Za-z .']{2,60})", 95)],
+    "issueDate": [Rule(rf"^Date of Commencement(?: of Policy)?\s{{0,3}}:\s{{0,3}}({DATE})", 95)],
+    "expirationDate": [Rule(rf"^Date of Maturity\s{{0,3}}:\s{{0,3}}({DATE})", 95)],
+    "premiumAmount": [Rule(rf"^(?:Basic )?Sum Assured\s{{0,3}}:\s{{0,3}}({AMOUNT})", 95)],
+    "deductibles": [
+        Rule(rf"^Instal(?:l)?ment Premium\s{{0,3}}:\s{{0,3}}({AMOUNT}(?:\s{{0,3}}{FREQUENCY})?)", 95),
+    ],
+}
+
+# Insurers whose name on the schedule identifies the provider outright.
+# Layout-specific field rules for the others are added through FIELD_RULES_TEMPLATES.
+BUILTIN_TEMPLATES = [
+    Template("lic", "LIC", r"Life Insurance Corporation of India", LIC_RULES),
+    Template("star-health", "Star Health", r"Star Health and Allied Insurance"),
+    Template("hdfc-ergo", "HDFC Ergo", r"HDFC ERGO General Insurance"),
+    Template("icici-lombard", "ICICI Lombard", r"ICICI Lombard General Insurance"),
+    Template("bajaj-allianz", "Bajaj Allianz", r"Bajaj Allianz (?:General|Life) Insurance"),
+    Template("sbi-life", "SBI Life", r"SBI Life Insurance"),
+]
+
+
+def load_templates(path=FIELD_RULES_TEMPLATES):
+    templates = list(BUILTIN_TEMPLATES)
+    if not path:
+        return templates
+    try:
+        with open(path, encoding="utf-8") as f:
+            loaded = [Template(t["name"], t["provider"], t["detect"], t.get("rules")) for t in json.load(f)]
+    except (OSError, ValueError, KeyError, re.error) as e:
+        logging.error(f"❌ Could not load field rule templates from {path}: {e}")
+        return templates
+    # File templates come first so they can override a built-in for the same insurer
+    return loaded + templates
+
+
+TEMPLATES = load_templates()
+
+
+def detect_template(text, templates=None):
+    head = text[:TEMPLATE_DETECT_CHARS]
+    for template in templates or TEMPLATES:
+        if template.detect.search(head):
+            return template
+    return None
+
+
+# ------------------ ENGINE ------------------
+def _lines(text):
+    for line in text.splitlines():
+        line = line.strip()
+        if line:
+            yield line[:FIELD_RULES_MAX_LINE_CHARS]
+
+
+def _terms(lines):
+    terms, in_section = [], False
+    for line in lines:
+        if EXCLUSIONS_HEADING.search(line) and len(line) < 80:
+            in_section = True
+            continue
+        if in_section:
+            m = BULLET.match(line)
+            if m:
+                terms.append(m.group(1).strip())
+                if len(terms) >= MAX_TERMS:
+                    break
+            elif terms:
+                in_section = False
+    return terms or None
+
+
+def run_rules(text, templates=None):
+    """Extract what the rules can find; returns the model's nested JSON shape.
+
+    Also carries `_template` (matched template name or None) for logging.
+    """
+    template = detect_template(text, templates)
+    lines = list(_lines(text))
+    result = {field: {"value": None, "confidence": 0} for field in CONFIDENCE_FIELDS}
+
+    for field in CONFIDENCE_FIELDS:
+        rules = (template.rules.get(field, []) if template else []) + GENERIC_RULES.get(field, [])
+        for rule in rules:
+            if rule.confidence <= result[field]["confidence"]:
+                continue
+            for line in lines:
+                value = rule.match(line)
+                if value:
+                    result[field] = {"value": value, "confidence": rule.confidence}
+                    break
+
+    if template and result["providerName"]["confidence"] < 95:
+        result["providerName"] = {"value": template.provider, "confidence": 95}
+
+    for field, raw in RAW_FIELDS.items():
+        result[raw] = result[field]["value"]
+    result["termsAndExclusions"] = _terms(lines)
+    result["_template"] = template.name if template else None
+    return result
+
+
+def rules_suffice(rules, required=None, min_confidence=None):
+    """True when every required field cleared the confidence bar."""
+    required = FIELD_RULES_REQUIRED if required is None else required
+    min_confidence = FIELD_RULES_MIN_CONFIDENCE if min_confidence is None else min_confidence
+    return FIELD_RULES_ENABLED and all(
+        rules.get(field, {}).get("value") and rules[field]["confidence"] >= min_confidence
+        for field in required
+    )
+
+
+def fill_missing(parsed, rules, fields=FALLBACK_FIELDS):
+    """Use rule values for the `fields` the model left empty."""
+    for field in fields:
+        candidate = rules.get(field) or {}
+        current = parsed.get(field)
+        current_value = current.get("value") if isinstance(current, dict) else current
+        if candidate.get("value") and not current_value:
+            parsed[field] = dict(candidate)
+            if field in RAW_FIELDS and not parsed.get(RAW_FIELDS[field]):
+                parsed[RAW_FIELDS[field]] = rules.get(RAW_FIELDS[field])
+    return parsed
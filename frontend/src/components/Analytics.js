@@ -23,6 +23,9 @@ ChartJS.register(
   Legend
 );
 
+// Rows per /analytics/pdf-details request; "Load more" fetches the next page
+const PDF_PAGE_SIZE = 50;
+
 const Analytics = () => {
   const [analytics, setAnalytics] = useState({
     total_pdfs: 0,
@@ -33,6 +36,7 @@ const Analytics = () => {
   });
   const [trend, setTrend] = useState([]);
   const [filter, setFilter] = useState("all");
+  const [nextCursor, setNextCursor] = useState(null);
 
   const fetchAnalytics = useCallback(async () => {
     try {
@@ -45,6 +49,7 @@ const Analytics = () => {
 
       const pdfRes = await axios.post("/analytics/pdf-details", {
         user_id,
+        limit: PDF_PAGE_SIZE,
       });
 
       const combinedAnalytics = {
@@ -54,6 +59,7 @@ const Analytics = () => {
         field_confidences: res.data.field_confidences || {},
         pdfs: pdfRes.data.pdfs || []
       };
+      setNextCursor(pdfRes.data.next_cursor || null);
 
       console.log("✅ Combined Analytics:", combinedAnalytics);
       setAnalytics(combinedAnalytics);
@@ -62,6 +68,24 @@ const Analytics = () => {
     }
   }, [filter]);
 
+  const loadMorePdfs = async () => {
+    try {
+      const user_id = localStorage.getItem("token");
+      const pdfRes = await axios.post("/analytics/pdf-details", {
+        user_id,
+        limit: PDF_PAGE_SIZE,
+        cursor: nextCursor,
+      });
+      setAnalytics((prev) => ({
+        ...prev,
+        pdfs: [...prev.pdfs, ...(pdfRes.data.pdfs || [])],
+      }));
+      setNextCursor(pdfRes.data.next_cursor || null);
+    } catch (err) {
+      console.error("PDF Details Error:", err);
+    }
+  };
+
   const fetchTrendData = useCallback(async () => {
     try {
       const user_id = localStorage.getItem("token");
@@ -248,6 +272,11 @@ const Analytics = () => {
             ))}
           </tbody>
         </table>
+        {nextCursor && (
+          <button className="load-more" onClick={loadMorePdfs}>
+            Load more
+          </button>
+        )}
       </div>
     </div>
   );
@@ -1,86 +1,200 @@
 import os
-import fitz  # PyMuPDF – used for reading PDF
+import re
+import asyncio
 import requests
-import uuid
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from azure.storage.blob import BlobServiceClient
+from embedding_cache import embed_with_cache, embed_with_cache_async
+from retrieval import get_backend
+from chunking import iter_chunks, chunk_metadata
+from rate_limit import limiter, estimate_tokens, current_priority
+from clients import post_with_retry, apost_with_retry, lazy_import
+from metrics import span
 
 # Load environment variables
 load_dotenv()
 
 # Configurations from .env
-BLOB_CONN_STR = f"DefaultEndpointsProtocol=https;AccountName={os.getenv('AZURE_STORAGE_ACCOUNT')};AccountKey={os.getenv('AZURE_STORAGE_KEY')};EndpointSuffix=core.windows.net"
-BLOB_CONTAINER = os.getenv('AZURE_STORAGE_CONTAINER')
-
 EMBEDDING_URL = f"{os.getenv('AZURE_OPENAI_ENDPOINT')}openai/deployments/{os.getenv('AZURE_EMBEDDING_DEPLOYMENT')}/embeddings?api-version={os.getenv('AZURE_API_VERSION')}"
 EMBEDDING_HEADERS = {
     "api-key": os.getenv("AZURE_OPENAI_API_KEY"),
     "Content-Type": "application/json"
 }
 
-SEARCH_URL = f"{os.getenv('AZURE_SEARCH_ENDPOINT')}/indexes/{os.getenv('AZURE_SEARCH_INDEX')}/docs/index?api-version=2023-07-01-Preview"
-SEARCH_HEADERS = {
-    "Content-Type": "application/json",
-    "api-key": os.getenv("AZURE_SEARCH_API_KEY")
-}
-
+# Batched embedding requests: chunks per request, requests in flight, retries
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "16"))
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "5"))
+
+# 📄 Extract Text Page-by-Page (single parse, one record per page)
+def extract_pages(source):
+    """Parse a PDF once and return one record per page.
+
+    `source` is a file path or the raw PDF bytes. Each record is a dict with
+    `page` (1-based), `text` (stripped), `word_count` and `is_empty`.
+    """
+    fitz = lazy_import("fitz")  # PyMuPDF – used for reading PDF
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        doc = fitz.open(stream=source, filetype="pdf")
+    else:
+        doc = fitz.open(source)
+
+    pages = []
+    with doc:
+        for number, page in enumerate(doc, start=1):
+            text = page.get_text().strip()
+            pages.append({
+                "page": number,
+                "text": text,
+                "word_count": len(text.split()),
+                "is_empty": not text
+            })
+    return pages
+
+
+def summarize_pages(pages):
+    """Totals the /extract pipeline needs from the page records."""
+    page_count = len(pages)
+    empty_pages = sum(1 for p in pages if p["is_empty"])
+    return {
+        "page_count": page_count,
+        "word_count": sum(p["word_count"] for p in pages),
+        "empty_pages": empty_pages,
+        "empty_ratio": empty_pages / page_count if page_count else 1.0,
+        "text": "".join(p["text"] + "\n" for p in pages if not p["is_empty"])
+    }
 
 
-# 📄 Extract Text Page-by-Page
 def extract_chunks(pdf_path):
-    doc = fitz.open(pdf_path)
-    chunks = []
-    for page in doc:
-        text = page.get_text().strip()
-        if text:
-            chunks.append(text)
-    return chunks
-
-# 🧠 Get Embedding Vector for Each Chunk
-def get_embedding(text):
+    return list(iter_chunks(extract_pages(pdf_path)))
+
+# 🧠 Get Embedding Vectors, many chunks per request
+def _embed_batch(batch, prio=None):
+    deployment = os.getenv("AZURE_EMBEDDING_DEPLOYMENT")
     data = {
-        "input": text,
-        "model": os.getenv("AZURE_EMBEDDING_DEPLOYMENT")
+        "input": batch,
+        "model": deployment
     }
-    res = requests.post(EMBEDDING_URL, headers=EMBEDDING_HEADERS, json=data)
-    if res.status_code == 200:
-        return res.json()['data'][0]['embedding']
-    else:
+    limiter.acquire(deployment, estimate_tokens(text="".join(batch), completion_tokens=0), prio)
+    try:
+        res = post_with_retry(
+            EMBEDDING_URL, EMBEDDING_HEADERS, data, max_retries=EMBEDDING_MAX_RETRIES,
+            on_throttle=lambda seconds: limiter.block(deployment, seconds)
+        )
+    except requests.RequestException as e:
+        print("❌ Embedding failed:", e)
+        return [[] for _ in batch]
+    return _vectors(res, batch)
+
+
+def _vectors(res, batch):
+    if res.status_code != 200:
         print("❌ Embedding failed:", res.text)
+        return [[] for _ in batch]
+
+    # The API tags each vector with the position of its input
+    vectors = [[] for _ in batch]
+    for item in res.json()["data"]:
+        vectors[item["index"]] = item["embedding"]
+    return vectors
+
+
+def get_embeddings(texts, batch_size=EMBEDDING_BATCH_SIZE, concurrency=EMBEDDING_CONCURRENCY):
+    """Embed `texts`, returning vectors in the same order ([] where a batch failed)."""
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    if not batches:
         return []
+    if len(batches) == 1:
+        return _embed_batch(batches[0])
+
+    # Pool threads don't inherit the caller's priority, so pass it along
+    prio = current_priority()
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(batches)))) as pool:
+        results = pool.map(lambda batch: _embed_batch(batch, prio), batches)
+    return [vector for batch in results for vector in batch]
+
+
+async def _embed_batch_async(batch):
+    httpx = lazy_import("httpx")
+    deployment = os.getenv("AZURE_EMBEDDING_DEPLOYMENT")
+    data = {
+        "input": batch,
+        "model": deployment
+    }
+    await limiter.acquire_async(deployment, estimate_tokens(text="".join(batch), completion_tokens=0))
+    try:
+        res = await apost_with_retry(
+            EMBEDDING_URL, EMBEDDING_HEADERS, data, max_retries=EMBEDDING_MAX_RETRIES,
+            on_throttle=lambda seconds: limiter.block(deployment, seconds)
+        )
+    except httpx.HTTPError as e:
+        print("❌ Embedding failed:", e)
+        return [[] for _ in batch]
+    return _vectors(res, batch)
+
+
+async def get_embeddings_async(texts, batch_size=EMBEDDING_BATCH_SIZE, concurrency=EMBEDDING_CONCURRENCY):
+    """get_embeddings for coroutines; batches share the event loop instead of a thread pool."""
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    semaphore = asyncio.Semaphore(max(1, concurrency))
 
-# 🔍 Push Chunk + Embedding to Azure Cognitive Search
-def push_chunks_to_search(chunks, source_name):
+    async def one(batch):
+        async with semaphore:
+            return await _embed_batch_async(batch)
+
+    results = await asyncio.gather(*(one(batch) for batch in batches))
+    return [vector for batch in results for vector in batch]
+
+
+def get_embedding(text):
+    return get_embeddings([text])[0]
+
+
+def get_embeddings_cached(texts):
+    """get_embeddings, but identical chunks seen before come from the embedding cache."""
+    return embed_with_cache(texts, get_embeddings, os.getenv("AZURE_EMBEDDING_DEPLOYMENT"))
+
+
+async def get_embeddings_cached_async(texts):
+    return await embed_with_cache_async(texts, get_embeddings_async, os.getenv("AZURE_EMBEDDING_DEPLOYMENT"))
+
+def chunk_document(chunk, vector, source_name):
+    """One search index document. Its id is stable per source and chunk, so re-indexing overwrites."""
+    return {
+        # Search keys allow letters, digits, _, - and = only
+        "id": re.sub(r"[^A-Za-z0-9_=-]", "_", f"{source_name}-{chunk['index']}"),
+        "content": chunk["text"],
+        "embedding": vector,
+        "metadata": chunk_metadata(source_name, chunk),
+        "source": source_name
+    }
+
+
+def chunk_documents(chunks, vectors, source_name):
+    """Search index documents for embedded chunks; chunks whose embedding failed are skipped."""
     documents = []
-    for i, chunk in enumerate(chunks):
-        print(f"🔄 Processing chunk {i+1}/{len(chunks)}")
-        vector = get_embedding(chunk)
+    for chunk, vector in zip(chunks, vectors):
         if not vector:
             print("❌ Skipping chunk due to missing embedding")
             continue
-        documents.append({
-            "@search.action": "upload",
-            "id": str(uuid.uuid4()),
-            "content": chunk,
-            "embedding": vector,
-            "metadata": f"source:{source_name}"
-        })
+        documents.append(chunk_document(chunk, vector, source_name))
+    return documents
 
-    if not documents:
-        print("❌ No documents to upload to Azure Search.")
-        return
 
-    payload = {"value": documents}
-    res = requests.post(SEARCH_URL, headers=SEARCH_HEADERS, json=payload)
+# 🔍 Push Chunk + Embedding to the retrieval backend (Azure Cognitive Search or local)
+def push_chunks_to_search(chunks, source_name, replace=True):
+    """Embed and upload chunks from chunking.iter_chunks; returns the backend's per-document status."""
+    print(f"🔄 Embedding {len(chunks)} chunks")
+    with span("embed"):
+        vectors = get_embeddings_cached([chunk["text"] for chunk in chunks])
+    documents = chunk_documents(chunks, vectors, source_name)
 
-    print("🔍 Azure Search Response:")
-    print("Status Code:", res.status_code)
-    print("Response Body:", res.text)
+    if not documents:
+        print("❌ No documents to upload to Azure Search.")
+        return {}
 
-    if res.status_code == 200:
-        print("✅ Chunks uploaded to Azure Cognitive Search successfully.")
-    else:
-        print("❌ Failed to upload to Azure Cognitive Search.")
+    with span("search_upload"):
+        return get_backend().upload(documents, replace=replace)
 
 # 🚀 Run Everything Together
 def process_pdf(pdf_path):
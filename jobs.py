@@ -0,0 +1,380 @@
+import os
+import sys
+import uuid
+import queue
+import shlex
+import shutil
+import logging
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
+from clients import lazy_import
+
+# Background job queue for /extract.
+#
+# A queue owns a pool of worker threads inside the current process. start()
+# launches them once per process id, so each gunicorn worker (after fork)
+# gets its own pool; the app calls it at boot and before requests. The handler receives the job payload and a progress callback
+# `progress(stage, percent)` and returns the result that /extract would have
+# returned inline.
+#
+# The default "mongo" backend keeps jobs in a collection and their uploads
+# in GridFS, so any web worker (on any host) can claim a job or report its
+# status. A claim is a lease of EXTRACT_JOB_LEASE_SECONDS that the running
+# worker keeps renewing; a job whose lease lapses (its worker died) is
+# claimed again, up to EXTRACT_JOB_MAX_ATTEMPTS times. Only the worker still
+# holding the lease may finish a job or delete its upload. "memory" keeps
+# everything in one process and refuses to start under several web workers.
+#
+# EXTRACT_QUEUE_MAX is a soft limit for the mongo backend: the depth count
+# and the insert are separate operations, so processes submitting at the
+# same moment can overshoot it by a few jobs.
+
+EXTRACT_QUEUE_BACKEND = os.getenv("EXTRACT_QUEUE_BACKEND", "mongo")
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", "2"))
+EXTRACT_QUEUE_MAX = int(os.getenv("EXTRACT_QUEUE_MAX", "20"))
+EXTRACT_RETRY_AFTER = int(os.getenv("EXTRACT_RETRY_AFTER", "30"))
+EXTRACT_JOB_DIR = os.getenv("EXTRACT_JOB_DIR", os.path.join(tempfile.gettempdir(), "smartdoc-jobs"))
+EXTRACT_JOB_HISTORY = int(os.getenv("EXTRACT_JOB_HISTORY", "500"))
+EXTRACT_JOB_LEASE_SECONDS = float(os.getenv("EXTRACT_JOB_LEASE_SECONDS", "300"))
+EXTRACT_JOB_MAX_ATTEMPTS = int(os.getenv("EXTRACT_JOB_MAX_ATTEMPTS", "3"))
+
+
+class QueueFull(Exception):
+    """Raised when the queue is at EXTRACT_QUEUE_MAX and the job is shed."""
+
+    def __init__(self, retry_after=EXTRACT_RETRY_AFTER):
+        super().__init__("Extraction queue is full")
+        self.retry_after = retry_after
+
+
+class _BaseJobQueue:
+    def __init__(self, handler, workers=EXTRACT_WORKERS, max_depth=EXTRACT_QUEUE_MAX,
+                 job_dir=EXTRACT_JOB_DIR):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.max_depth = max_depth
+        self.job_dir = job_dir
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    # ---------- public API ----------
+    def submit_upload(self, file, payload):
+        """Persist an uploaded file and enqueue it.
+
+        `file` is a Werkzeug upload, or the path of an upload already spooled
+        to disk (large-file mode), which the queue takes over.
+        Raises QueueFull before anything is written when the queue is at depth
+        (a soft limit across processes, see above).
+        """
+        self.start()
+        if self.depth() >= self.max_depth:
+            raise QueueFull()
+
+        job_id = str(uuid.uuid4())
+        stored = self._store_upload(job_id, file)
+        try:
+            self._enqueue(job_id, {**payload, **stored})
+        except QueueFull:
+            self._discard_upload(stored)
+            raise
+        return job_id
+
+    def get(self, job_id):
+        raise NotImplementedError
+
+    def depth(self):
+        raise NotImplementedError
+
+    # ---------- worker side ----------
+    def start(self):
+        """Start this process's worker threads, if they aren't running yet."""
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._reset_after_fork()
+            for i in range(self.workers):
+                threading.Thread(target=self._worker_loop, name=f"extract-worker-{i}", daemon=True).start()
+            self._pid = os.getpid()
+            logging.info(f"🧵 Started {self.workers} extraction workers ({type(self).__name__})")
+
+    def _reset_after_fork(self):
+        pass
+
+    # ---------- upload storage ----------
+    def _store_upload(self, job_id, file):
+        """Keep the upload where a worker can read it; returns the payload fields that locate it."""
+        os.makedirs(self.job_dir, exist_ok=True)
+        path = os.path.join(self.job_dir, f"{job_id}.pdf")
+        if isinstance(file, str):
+            shutil.move(file, path)
+        else:
+            file.save(path)
+        return {"path": path}
+
+    def _fetch_upload(self, job_id, payload):
+        """Local path of the job's upload."""
+        return payload["path"]
+
+    def _discard_upload(self, payload):
+        _remove_quietly(payload.get("path"))
+
+    def _run(self, job_id, payload):
+        def progress(stage, percent):
+            self._update(job_id, {"stage": stage, "progress": percent})
+
+        self._update(job_id, {"status": "running", "started_at": datetime.utcnow()})
+        path, finished = None, False
+        try:
+            path = self._fetch_upload(job_id, payload)
+            result = self.handler({**payload, "path": path}, progress)
+            finished = self._update(job_id, {
+                "status": "done",
+                "progress": 100,
+                "stage": "done",
+                "result": result,
+                "finished_at": datetime.utcnow()
+            })
+        except Exception as e:
+            logging.error(f"❌ Extraction job {job_id} failed: {e}")
+            finished = self._update(job_id, {"status": "failed", "error": str(e), "finished_at": datetime.utcnow()})
+        finally:
+            _remove_quietly(path)
+            # A worker whose lease lapsed no longer owns the job; its new claimant still needs the upload
+            if finished:
+                self._discard_upload(payload)
+
+
+class InProcessJobQueue(_BaseJobQueue):
+    """Jobs live in this process only; nothing beyond the web worker is needed."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._reset_after_fork()
+
+    def _reset_after_fork(self):
+        self._queue = queue.Queue(maxsize=self.max_depth)
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _enqueue(self, job_id, payload):
+        with self._lock:
+            self._jobs[job_id] = _new_job(job_id)
+            self._prune()
+        try:
+            self._queue.put_nowait((job_id, payload))
+        except queue.Full:
+            with self._lock:
+                self._jobs.pop(job_id, None)
+            raise QueueFull()
+
+    def _update(self, job_id, fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+        return True
+
+    def _prune(self):
+        finished = [j for j in self._jobs.values() if j["status"] in ("done", "failed")]
+        overflow = len(self._jobs) - EXTRACT_JOB_HISTORY
+        for job in sorted(finished, key=lambda j: j["created_at"])[:max(0, overflow)]:
+            self._jobs.pop(job["job_id"], None)
+
+    def _worker_loop(self):
+        while True:
+            job_id, payload = self._queue.get()
+            try:
+                self._run(job_id, payload)
+            finally:
+                self._queue.task_done()
+
+
+class MongoJobQueue(_BaseJobQueue):
+    """Jobs are documents in a Mongo collection shared by every web worker.
+
+    Uploads are stored in GridFS next to the jobs, so any worker that can
+    reach Mongo may claim a job, and status survives the worker that
+    accepted the upload.
+    """
+
+    POLL_INTERVAL = float(os.getenv("EXTRACT_QUEUE_POLL_SECONDS", "1.0"))
+
+    def __init__(self, collection, *args, lease_seconds=EXTRACT_JOB_LEASE_SECONDS,
+                 max_attempts=EXTRACT_JOB_MAX_ATTEMPTS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.collection = collection
+        self.lease = timedelta(seconds=lease_seconds)
+        self.max_attempts = max(1, max_attempts)
+        self._wakeup = threading.Event()
+        self._claims = threading.local()  # the lease this worker thread holds
+
+    def depth(self):
+        return self.collection.count_documents({"status": "queued"})
+
+    def get(self, job_id):
+        return self.collection.find_one({"job_id": job_id}, {"_id": 0, "payload": 0, "lease_id": 0})
+
+    def _enqueue(self, job_id, payload):
+        self.collection.insert_one({**_new_job(job_id), "payload": payload, "attempts": 0})
+        self._wakeup.set()
+
+    def _update(self, job_id, fields):
+        """Returns False when this worker's lease was lost and the job belongs to a new claimant."""
+        lease_id = getattr(self._claims, "lease_id", None)
+        query = {"job_id": job_id, "lease_id": lease_id} if lease_id else {"job_id": job_id}
+        return self.collection.update_one(query, {"$set": fields}).matched_count > 0
+
+    # ---------- upload storage ----------
+    def _bucket(self):
+        import gridfs
+        return gridfs.GridFSBucket(self.collection.database, bucket_name="extract_job_uploads")
+
+    def _store_upload(self, job_id, file):
+        if isinstance(file, str):
+            with open(file, "rb") as f:
+                file_id = self._bucket().upload_from_stream(f"{job_id}.pdf", f)
+            _remove_quietly(file)
+        else:
+            file.stream.seek(0)
+            file_id = self._bucket().upload_from_stream(f"{job_id}.pdf", file.stream)
+        return {"file_id": file_id}
+
+    def _fetch_upload(self, job_id, payload):
+        os.makedirs(self.job_dir, exist_ok=True)
+        path = os.path.join(self.job_dir, f"{job_id}-{uuid.uuid4().hex[:8]}.pdf")
+        with open(path, "wb") as f:
+            self._bucket().download_to_stream(payload["file_id"], f)
+        return path
+
+    def _discard_upload(self, payload):
+        import gridfs
+        if payload.get("file_id") is None:
+            return
+        try:
+            self._bucket().delete(payload["file_id"])
+        except gridfs.errors.NoFile:
+            pass
+
+    # ---------- leases ----------
+    def _claim(self):
+        """Oldest queued job, or a running one whose worker stopped renewing its lease."""
+        now = datetime.utcnow()
+        lease_id = uuid.uuid4().hex
+        return self.collection.find_one_and_update(
+            {"$or": [{"status": "queued"}, {"status": "running", "lease_until": {"$lt": now}}]},
+            {
+                "$set": {"status": "running", "started_at": now, "lease_id": lease_id, "lease_until": now + self.lease},
+                "$inc": {"attempts": 1}
+            },
+            sort=[("created_at", 1)],
+            return_document=lazy_import("pymongo").ReturnDocument.AFTER
+        )
+
+    def _renew(self, job_id, lease_id, stop):
+        while not stop.wait(self.lease.total_seconds() / 3):
+            try:
+                self.collection.update_one(
+                    {"job_id": job_id, "lease_id": lease_id, "status": "running"},
+                    {"$set": {"lease_until": datetime.utcnow() + self.lease}}
+                )
+            except Exception as e:
+                logging.error(f"❌ Could not renew the lease on extraction job {job_id}: {e}")
+
+    def _run_claimed(self, job):
+        job_id = job["job_id"]
+        self._claims.lease_id = job["lease_id"]
+        try:
+            if job["attempts"] > self.max_attempts:
+                logging.error(f"❌ Extraction job {job_id} abandoned after {self.max_attempts} attempts")
+                if self._update(job_id, {
+                    "status": "failed",
+                    "error": f"Worker lost {self.max_attempts} times",
+                    "finished_at": datetime.utcnow()
+                }):
+                    self._discard_upload(job["payload"])
+                return
+            if job["attempts"] > 1:
+                logging.warning(f"♻️ Reclaimed extraction job {job_id} (attempt {job['attempts']})")
+
+            stop = threading.Event()
+            heartbeat = threading.Thread(
+                target=self._renew, args=(job_id, job["lease_id"], stop), name="extract-lease", daemon=True
+            )
+            heartbeat.start()
+            try:
+                self._run(job_id, job["payload"])
+            finally:
+                stop.set()
+        finally:
+            self._claims.lease_id = None
+
+    def _worker_loop(self):
+        while True:
+            try:
+                job = self._claim()
+            except Exception as e:
+                logging.error(f"❌ Could not claim extraction job: {e}")
+                job = None
+
+            if not job:
+                self._wakeup.wait(self.POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+            self._run_claimed(job)
+
+
+def _new_job(job_id):
+    return {
+        "job_id": job_id,
+        "status": "queued",
+        "stage": "queued",
+        "progress": 0,
+        "result": None,
+        "error": None,
+        "created_at": datetime.utcnow()
+    }
+
+
+def _remove_quietly(path):
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def web_workers():
+    """Worker processes the server was started with (WEB_CONCURRENCY, or gunicorn/uvicorn -w/--workers)."""
+    server = os.path.basename(sys.argv[0]) in ("gunicorn", "uvicorn")
+    args = (sys.argv[1:] if server else []) + shlex.split(os.getenv("GUNICORN_CMD_ARGS", ""))
+    workers = int(os.getenv("WEB_CONCURRENCY", "1") or 1)
+    for i, arg in enumerate(args):
+        if arg in ("-w", "--workers") and i + 1 < len(args):
+            workers = int(args[i + 1])
+        elif arg.startswith("--workers="):
+            workers = int(arg.split("=", 1)[1])
+    return workers
+
+
+def create_job_queue(handler, collection=None):
+    """Build the queue selected by EXTRACT_QUEUE_BACKEND ("mongo" or "memory")."""
+    if EXTRACT_QUEUE_BACKEND == "memory":
+        if web_workers() > 1:
+            raise RuntimeError(
+                "EXTRACT_QUEUE_BACKEND=memory keeps jobs inside one process, so job status would 404 "
+                "on the other web workers; use EXTRACT_QUEUE_BACKEND=mongo or a single worker"
+            )
+        return InProcessJobQueue(handler)
+    return MongoJobQueue(collection, handler)
@@ -0,0 +1,138 @@
+import os
+import sys
+import uuid
+import hashlib
+import logging
+import resource
+import tempfile
+import threading
+
+# Bounded-memory handling of big uploads.
+#
+# In large-file mode the upload is copied to disk once, in chunks, while it
+# is fingerprinted. Every stage then works from that path: the blob upload
+# streams from it, PyMuPDF and the OCR workers open it directly, and nothing
+# holds the whole PDF in memory. LARGE_FILE_MODE is "auto" (uploads of at
+# least LARGE_FILE_THRESHOLD_MB), "always" or "never".
+#
+# MemoryWatch samples the worker's RSS while a request runs. Its peak is
+# reported per request, and growth past EXTRACT_MEMORY_LIMIT_MB stops the
+# pipeline at the next stage boundary (0 = no limit). RSS is per process, so
+# with several requests in flight in one worker the figures include their
+# neighbours; treat them as an upper bound.
+
+LARGE_FILE_MODE = os.getenv("LARGE_FILE_MODE", "auto").lower()
+LARGE_FILE_THRESHOLD_MB = float(os.getenv("LARGE_FILE_THRESHOLD_MB", "20"))
+# Same default as the job queue's directory, so handing a spool to a job is a rename
+EXTRACT_SPOOL_DIR = os.getenv(
+    "EXTRACT_SPOOL_DIR", os.getenv("EXTRACT_JOB_DIR", os.path.join(tempfile.gettempdir(), "smartdoc-jobs"))
+)
+EXTRACT_MEMORY_LIMIT_MB = float(os.getenv("EXTRACT_MEMORY_LIMIT_MB", "0"))
+MEMORY_SAMPLE_INTERVAL = float(os.getenv("MEMORY_SAMPLE_INTERVAL", "0.05"))
+SPOOL_CHUNK_SIZE = 1024 * 1024
+MB = 1024 * 1024
+
+
+class MemoryLimitExceeded(Exception):
+    def __init__(self, stage, growth, limit):
+        super().__init__(
+            f"Memory limit exceeded before {stage}: "
+            f"{growth / MB:.0f} MB used, limit is {limit / MB:.0f} MB"
+        )
+        self.stage = stage
+
+
+# ------------------ SPOOLING ------------------
+def upload_size(stream):
+    """Size of an upload's (seekable) stream in bytes, without reading it."""
+    position = stream.tell()
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(position)
+    return size
+
+
+def use_large_file_mode(size):
+    if LARGE_FILE_MODE == "always":
+        return True
+    if LARGE_FILE_MODE == "never":
+        return False
+    return size >= LARGE_FILE_THRESHOLD_MB * MB
+
+
+def spool_upload(stream, directory=EXTRACT_SPOOL_DIR):
+    """Copy an upload's stream to disk in chunks; returns (path, sha256 hex digest)."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{uuid.uuid4()}.pdf")
+    digest = hashlib.sha256()
+    stream.seek(0)
+    with open(path, "wb") as out:
+        for chunk in iter(lambda: stream.read(SPOOL_CHUNK_SIZE), b""):
+            digest.update(chunk)
+            out.write(chunk)
+    stream.seek(0)
+    return path, digest.hexdigest()
+
+
+def remove_spool(path):
+    if path:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+# ------------------ MEMORY ------------------
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss():
+    """Resident set size of this process in bytes."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        # No procfs (macOS): fall back to the lifetime peak
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+class MemoryWatch:
+    """Track peak RSS while the block runs and enforce a growth ceiling."""
+
+    def __init__(self, limit_mb=EXTRACT_MEMORY_LIMIT_MB, interval=MEMORY_SAMPLE_INTERVAL):
+        self.limit = int(limit_mb * MB)
+        self.interval = interval
+        self.baseline = self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.baseline = self.peak = current_rss()
+        self._thread = threading.Thread(target=self._sample, name="memory-watch", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+        return False
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    @property
+    def growth(self):
+        return max(0, self.peak - self.baseline)
+
+    def check(self, stage):
+        """Raise MemoryLimitExceeded if the request has grown past the limit."""
+        self.peak = max(self.peak, current_rss())
+        if self.limit and self.growth > self.limit:
+            logging.warning(f"⚠️ Extraction stopped before {stage}: {self.growth / MB:.0f} MB over baseline")
+            raise MemoryLimitExceeded(stage, self.growth, self.limit)
+
+    def report(self):
+        return {"peak_rss_mb": round(self.peak / MB, 1), "growth_mb": round(self.growth / MB, 1)}
@@ -0,0 +1,120 @@
+import os
+import re
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+# Map-reduce extraction for documents too long for one GPT call.
+#
+#   map:    page records -> token-budgeted sections -> one extraction per
+#           section, run concurrently
+#   reduce: per field, keep the candidate with the highest confidence;
+#           termsAndExclusions are unioned in document order
+#
+# The merged result has the same nested shape the model returns for a
+# single call, so flatten_extraction / format_ai_data work unchanged.
+
+LONG_DOC_TOKEN_THRESHOLD = int(os.getenv("LONG_DOC_TOKEN_THRESHOLD", "24000"))
+LONG_DOC_SECTION_TOKENS = int(os.getenv("LONG_DOC_SECTION_TOKENS", "6000"))
+LONG_DOC_CONCURRENCY = int(os.getenv("LONG_DOC_CONCURRENCY", "4"))
+
+# Rough tokens-per-character for English policy text (~4 chars per token)
+CHARS_PER_TOKEN = 4
+
+CONFIDENCE_FIELDS = [
+    "policyholderName", "issueDate", "expirationDate", "providerName",
+    "policyholderAddress", "policyNumber", "premiumAmount", "deductibles"
+]
+# Raw strings travel with the field they were converted into
+RAW_FIELDS = {"issueDate": "issueDateRaw", "expirationDate": "expirationDateRaw"}
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def is_long_document(pages, threshold=LONG_DOC_TOKEN_THRESHOLD):
+    return sum(estimate_tokens(p["text"]) for p in pages if not p["is_empty"]) > threshold
+
+
+def split_sections(pages, budget=LONG_DOC_SECTION_TOKENS):
+    """Group consecutive pages into sections of at most `budget` tokens.
+
+    A single page larger than the budget is cut into budget-sized pieces.
+    """
+    max_chars = budget * CHARS_PER_TOKEN
+    sections, current, size = [], [], 0
+
+    for page in pages:
+        if page["is_empty"]:
+            continue
+        text = page["text"]
+        pieces = [text[i:i + max_chars] for i in range(0, len(text), max_chars)]
+        for piece in pieces:
+            if current and size + len(piece) > max_chars:
+                sections.append("\n".join(current))
+                current, size = [], 0
+            current.append(piece)
+            size += len(piece) + 1
+
+    if current:
+        sections.append("\n".join(current))
+    return sections
+
+
+def _confidence(candidate):
+    try:
+        return float(candidate.get("confidence") or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def merge_candidates(candidates):
+    """Reduce per-section extraction results into one result per field."""
+    merged = {}
+    for field in CONFIDENCE_FIELDS:
+        best, best_section = None, None
+        for section in candidates:
+            candidate = section.get(field)
+            if not isinstance(candidate, dict) or candidate.get("value") in (None, ""):
+                continue
+            if best is None or _confidence(candidate) > _confidence(best):
+                best, best_section = candidate, section
+        merged[field] = best or {"value": None, "confidence": 0}
+        if field in RAW_FIELDS:
+            merged[RAW_FIELDS[field]] = best_section.get(RAW_FIELDS[field]) if best_section else None
+
+    terms, seen = [], set()
+    for section in candidates:
+        for term in section.get("termsAndExclusions") or []:
+            key = re.sub(r"\s+", " ", str(term)).strip().lower()
+            if key and key not in seen:
+                seen.add(key)
+                terms.append(term)
+    merged["termsAndExclusions"] = terms or None
+    return merged
+
+
+def run_map_reduce(pages, extract_fn, budget=LONG_DOC_SECTION_TOKENS, concurrency=LONG_DOC_CONCURRENCY):
+    """Run `extract_fn(section_text) -> (parsed or None, raw)` over every section.
+
+    Returns (merged parsed result or None, raw outputs joined) — the same
+    contract as a single extraction call.
+    """
+    sections = split_sections(pages, budget)
+    logging.info(f"🧩 Map-reduce extraction over {len(sections)} sections")
+
+    def safe_extract(section):
+        try:
+            return extract_fn(section)
+        except Exception as e:
+            logging.error(f"❌ Section extraction failed: {e}")
+            return None, ""
+
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(sections)))) as pool:
+        results = list(pool.map(safe_extract, sections))
+
+    candidates = [parsed for parsed, _ in results if isinstance(parsed, dict)]
+    raw = "\n\n".join(raw for _, raw in results if raw)
+    if not candidates:
+        return None, raw
+    return merge_candidates(candidates), raw
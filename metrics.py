@@ -0,0 +1,237 @@
+import os
+import time
+import logging
+import threading
+import contextvars
+from functools import wraps
+from contextlib import contextmanager
+
+# Stage timing for requests and background work.
+#
+#   with span("parse"):
+#       pages = extract_pages(data)
+#
+# Every span is observed into the `smartdoc_stage_seconds` histogram, and
+# every request into `smartdoc_request_seconds`; GET /metrics renders both
+# in the Prometheus text format. Histograms live in the worker process, so
+# each gunicorn worker reports its own (scrape them individually or
+# aggregate on the Prometheus side).
+#
+# Spans opened on a request's own thread are also listed in that response's
+# Server-Timing header, so browser devtools show where the time went. Spans
+# in pool threads and async jobs only reach the histograms. For streamed
+# responses the header covers the work done before the first byte.
+#
+# Profiling: with PROFILE_ENABLED=true, a request carrying
+# `X-Debug-Profile: 1` runs under cProfile (sampled at PROFILE_SAMPLE_RATE).
+# The stats are written to PROFILE_DIR and named in the X-Profile response
+# header, and the top functions are logged.
+
+METRICS_PREFIX = "smartdoc"
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+PROFILE_ENABLED = os.getenv("PROFILE_ENABLED", "false").lower() in ("1", "true", "yes")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "1.0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_HEADER = "X-Debug-Profile"
+PROFILE_TOP_FUNCTIONS = 25
+
+_spans = contextvars.ContextVar("request_spans", default=None)
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels, buckets=STAGE_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[i] += 1
+            series[-2] += seconds
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        for label_values, values in sorted(series.items()):
+            labels = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.labels, label_values))
+            sep = "," if labels else ""
+            for bound, count in zip(self.buckets, values):
+                lines.append(f'{self.name}_bucket{{{labels}{sep}le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{labels}{sep}le="+Inf"}} {values[-1]}')
+            lines.append(f"{self.name}_sum{{{labels}}} {values[-2]:.6f}")
+            lines.append(f"{self.name}_count{{{labels}}} {values[-1]}")
+        return "\n".join(lines)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+STAGE_SECONDS = Histogram(f"{METRICS_PREFIX}_stage_seconds", "Time spent in each pipeline stage.", ("stage",))
+REQUEST_SECONDS = Histogram(
+    f"{METRICS_PREFIX}_request_seconds", "HTTP request latency up to the response headers.",
+    ("route", "method", "status")
+)
+EXTRACT_MEMORY_MB = Histogram(
+    f"{METRICS_PREFIX}_extract_memory_growth_mb", "Worker RSS growth during one extraction, in MB.",
+    ("mode",), buckets=(16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+)
+
+
+# ------------------ SPANS ------------------
+@contextmanager
+def span(name):
+    """Time the block as stage `name` (histogram + this request's Server-Timing)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - started)
+
+
+def record_span(name, seconds):
+    """Record time measured elsewhere (e.g. a wait loop) as stage `name`."""
+    STAGE_SECONDS.observe(seconds, name)
+    spans = _spans.get()
+    if spans is not None:
+        spans.append((name, seconds))
+
+
+def timed(name):
+    """Decorator form of span()."""
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def server_timing(spans, total=None):
+    """Server-Timing header value; repeated stages (e.g. several GPT calls) are summed."""
+    totals = {}
+    for name, seconds in spans:
+        totals[name] = totals.get(name, 0.0) + seconds
+    entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in totals.items()]
+    if total is not None:
+        entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+def track_request(route, method):
+    """Collect spans for a request served outside Flask (the async routes in asgi.py).
+
+    Call in the request's task; returns finish(status_code), which records
+    the request and returns its Server-Timing header value.
+    """
+    started = time.perf_counter()
+    _spans.set([])
+
+    def finish(status_code):
+        total = time.perf_counter() - started
+        REQUEST_SECONDS.observe(total, route, method, str(status_code))
+        return server_timing(_spans.get() or [], total)
+    return finish
+
+
+def render():
+    return "\n".join(h.render() for h in (STAGE_SECONDS, REQUEST_SECONDS, EXTRACT_MEMORY_MB)) + "\n"
+
+
+# ------------------ PROFILING ------------------
+_profile_lock = threading.Lock()  # one cProfile at a time per process
+
+
+def _start_profile():
+    import random
+    import cProfile
+
+    if random.random() >= PROFILE_SAMPLE_RATE or not _profile_lock.acquire(blocking=False):
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler (a debugger, coverage) already owns the hook
+        _profile_lock.release()
+        return None
+    return profiler
+
+
+def _finish_profile(profiler, route):
+    import io
+    import pstats
+
+    try:
+        profiler.disable()
+    finally:
+        _profile_lock.release()
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    safe_route = route.strip("/").replace("/", "_").replace("<", "").replace(">", "") or "root"
+    path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}_{safe_route}_{os.getpid()}.prof")
+    profiler.dump_stats(path)
+
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+    logging.info(f"🔬 Profile for {route} saved to {path}\n{out.getvalue()}")
+    return path
+
+
+# ------------------ FLASK ------------------
+def init_app(app):
+    """Record request timings, add Server-Timing and serve GET /metrics."""
+    from flask import g, request, Response
+
+    @app.before_request
+    def _start_request():
+        g.metrics_started = time.perf_counter()
+        g.metrics_token = _spans.set([])
+        g.metrics_profiler = None
+        if PROFILE_ENABLED and request.headers.get(PROFILE_HEADER, "").lower() in ("1", "true", "yes"):
+            g.metrics_profiler = _start_profile()
+
+    @app.after_request
+    def _finish_request(response):
+        started = g.pop("metrics_started", None)
+        if started is None:
+            return response
+        total = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_SECONDS.observe(total, route, request.method, str(response.status_code))
+
+        spans = _spans.get() or []
+        response.headers["Server-Timing"] = server_timing(spans, total)
+        profiler = g.pop("metrics_profiler", None)
+        if profiler is not None:
+            response.headers["X-Profile"] = os.path.basename(_finish_profile(profiler, route))
+        return response
+
+    @app.teardown_request
+    def _reset_spans(exc):
+        # A profile left running by an exception that skipped after_request
+        profiler = g.pop("metrics_profiler", None)
+        if profiler is not None:
+            profiler.disable()
+            _profile_lock.release()
+        token = g.pop("metrics_token", None)
+        if token is not None:
+            try:
+                _spans.reset(token)
+            except ValueError:
+                # Streamed responses tear down in the generator's context
+                _spans.set(None)
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        return Response(render(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,86 @@
+import os
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# OCR fallback for scanned PDFs.
+#
+# Pages are rendered one at a time inside the worker that OCRs them, so at
+# most OCR_WORKERS page images exist at once no matter how long the PDF is.
+# Only the pages whose text layer came back empty are OCR'd.
+
+TESSERACT_CMD = os.getenv("TESSERACT_CMD")  # unset = "tesseract" on PATH
+POPPLER_PATH = os.getenv("POPPLER_PATH")    # unset = pdftoppm on PATH
+OCR_DPI = int(os.getenv("OCR_DPI", "300"))
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 2)))
+OCR_MP_CONTEXT = os.getenv("OCR_MP_CONTEXT", "spawn")
+OCR_MIN_WORDS = 30
+
+
+def _ocr_page(pdf_path, page_number):
+    from pdf2image import convert_from_path
+    import pytesseract
+
+    if TESSERACT_CMD:
+        pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
+
+    images = convert_from_path(
+        pdf_path,
+        dpi=OCR_DPI,
+        first_page=page_number,
+        last_page=page_number,
+        poppler_path=POPPLER_PATH
+    )
+    try:
+        return "\n".join(pytesseract.image_to_string(img) for img in images).strip()
+    finally:
+        for img in images:
+            img.close()
+
+
+def needs_ocr(stats):
+    """Same trigger as before: almost no words, or mostly empty pages."""
+    return stats["word_count"] < OCR_MIN_WORDS or stats["empty_ratio"] > 0.5
+
+
+def select_ocr_pages(pages):
+    """Page numbers to OCR: the empty ones, or every page if none are empty."""
+    empty = [p["page"] for p in pages if p["is_empty"]]
+    return empty or [p["page"] for p in pages]
+
+
+def ocr_pages(pdf_path, page_numbers, workers=OCR_WORKERS):
+    """OCR `page_numbers` (1-based) across a process pool; returns {page: text}."""
+    if not page_numbers:
+        return {}
+
+    workers = max(1, min(workers, len(page_numbers)))
+    results = {}
+    context = multiprocessing.get_context(OCR_MP_CONTEXT)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = {pool.submit(_ocr_page, pdf_path, n): n for n in page_numbers}
+        for future, n in futures.items():
+            try:
+                results[n] = future.result()
+            except Exception as e:
+                logging.error(f"❌ Tesseract OCR failed on page {n}: {e}")
+                results[n] = ""
+    return results
+
+
+def apply_ocr(pages, pdf_path, workers=OCR_WORKERS):
+    """OCR the selected pages and write the text back into the page records."""
+    targets = select_ocr_pages(pages)
+    logging.info(f"🔎 OCR on {len(targets)}/{len(pages)} pages with {workers} workers")
+    texts = ocr_pages(pdf_path, targets, workers=workers)
+
+    for page in pages:
+        text = texts.get(page["page"])
+        if text:
+            page.update({
+                "text": text,
+                "word_count": len(text.split()),
+                "is_empty": False,
+                "ocr": True
+            })
+    return pages
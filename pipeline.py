@@ -0,0 +1,151 @@
+import os
+import asyncio
+import inspect
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Stages with declared dependencies, run as soon as their inputs are ready.
+#
+#   pipeline = Pipeline()
+#   pipeline.add("parse", lambda: parse_pdf(source))
+#   pipeline.add("blob", lambda: upload_to_blob(source, filename))
+#   pipeline.add("save", lambda parsed, blob: save(parsed), after=("parse", "blob"))
+#   results = pipeline.run()
+#
+# A stage's function gets its dependencies' results as positional arguments,
+# in `after` order. Independent stages overlap, so a request takes about as
+# long as its slowest chain instead of the sum of every stage.
+#
+# run() uses one thread per ready stage; each one starts in a copy of the
+# caller's context, so spans still reach the request's Server-Timing and the
+# rate-limit priority carries over. run_async() does the same with tasks;
+# there a stage may return an awaitable.
+#
+# Deferred stages are not part of the result. They start in the background
+# once every other stage has succeeded (after the response, for a request),
+# and their failures are only logged. Nothing may depend on one.
+
+PIPELINE_DEFERRED_WORKERS = int(os.getenv("PIPELINE_DEFERRED_WORKERS", "4"))
+
+_deferred_pool = None
+_deferred_tasks = set()  # keeps background tasks referenced until they finish
+
+
+class Stage:
+    def __init__(self, name, fn, after=(), percent=None, deferred=False):
+        self.name = name
+        self.fn = fn
+        self.after = tuple(after)
+        self.percent = percent
+        self.deferred = deferred
+
+
+class Pipeline:
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, name, fn, after=(), percent=None, deferred=False):
+        """Declare a stage. Dependencies must already be declared, which keeps the graph acyclic."""
+        if name in self.stages:
+            raise ValueError(f"Stage {name!r} is already declared")
+        for dependency in after:
+            if dependency not in self.stages:
+                raise ValueError(f"Stage {name!r} depends on undeclared stage {dependency!r}")
+            if self.stages[dependency].deferred:
+                raise ValueError(f"Stage {name!r} cannot depend on deferred stage {dependency!r}")
+        self.stages[name] = Stage(name, fn, after, percent, deferred)
+        return self
+
+    def _split(self):
+        inline = [s for s in self.stages.values() if not s.deferred]
+        deferred = [s for s in self.stages.values() if s.deferred]
+        return inline, deferred
+
+    # ------------------ THREADS ------------------
+    def run(self, before=None):
+        """Run every inline stage; returns {name: result}.
+
+        `before(name, percent)` is called on this thread as each stage
+        starts; raising from it stops the pipeline. The first stage failure
+        is re-raised once the stages already running have finished.
+        """
+        inline, deferred = self._split()
+        results, pending, running = {}, list(inline), {}
+
+        with ThreadPoolExecutor(max_workers=max(1, len(inline))) as pool:
+            while pending or running:
+                for stage in [s for s in pending if all(d in results for d in s.after)]:
+                    pending.remove(stage)
+                    if before is not None:
+                        before(stage.name, stage.percent)
+                    args = [results[d] for d in stage.after]
+                    future = pool.submit(contextvars.copy_context().run, stage.fn, *args)
+                    running[future] = stage.name
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[running.pop(future)] = future.result()
+
+        for stage in deferred:
+            _deferred_executor().submit(_run_deferred, stage, [results[d] for d in stage.after])
+        return results
+
+    # ------------------ ASYNCIO ------------------
+    async def run_async(self, before=None):
+        """run() for coroutines: each stage is a task awaiting its dependencies."""
+        inline, deferred = self._split()
+        tasks = {}
+
+        async def run_stage(stage):
+            args = [await tasks[d] for d in stage.after]
+            if before is not None:
+                before(stage.name, stage.percent)
+            result = stage.fn(*args)
+            if inspect.isawaitable(result):
+                result = await result
+            return result
+
+        for stage in inline:
+            tasks[stage.name] = asyncio.ensure_future(run_stage(stage))
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            # Let cancelled stages unwind before the error reaches the caller
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+
+        results = {name: task.result() for name, task in tasks.items()}
+        for stage in deferred:
+            task = asyncio.ensure_future(_run_deferred_async(stage, [results[d] for d in stage.after]))
+            _deferred_tasks.add(task)
+            task.add_done_callback(_deferred_tasks.discard)
+        return results
+
+
+# ------------------ DEFERRED STAGES ------------------
+def _deferred_executor():
+    global _deferred_pool
+    if _deferred_pool is None:
+        _deferred_pool = ThreadPoolExecutor(
+            max_workers=max(1, PIPELINE_DEFERRED_WORKERS), thread_name_prefix="pipeline-deferred"
+        )
+    return _deferred_pool
+
+
+def _run_deferred(stage, args):
+    try:
+        stage.fn(*args)
+    except Exception as e:
+        logging.error(f"❌ Deferred stage {stage.name} failed: {e}")
+
+
+async def _run_deferred_async(stage, args):
+    try:
+        result = stage.fn(*args)
+        if inspect.isawaitable(result):
+            await result
+    except Exception as e:
+        logging.error(f"❌ Deferred stage {stage.name} failed: {e}")
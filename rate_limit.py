@@ -0,0 +1,292 @@
+import os
+import json
+import asyncio
+import time
+import sqlite3
+import logging
+import tempfile
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from long_doc import estimate_tokens as estimate_text_tokens
+from metrics import record_span
+
+# Client-side rate limiting for Azure OpenAI, shared by every worker process.
+#
+# Each deployment has two token buckets, requests-per-minute and
+# tokens-per-minute, stored in a SQLite file so all gunicorn workers (and
+# bulk_ingest) draw from the same budget. A call refills and takes from both
+# buckets in one IMMEDIATE transaction, or sleeps until it could.
+#
+# Priorities: "interactive" callers (/chat) may drain a bucket completely;
+# "batch" callers (extraction, ingestion) must leave RATE_LIMIT_BATCH_RESERVE
+# of it, so chat keeps headroom during a bulk run.
+#
+# Time spent waiting for a bucket is recorded as the "rate_limit_wait" stage,
+# separate from the caller's own span around the SDK call.
+#
+# A 429 with Retry-After blocks the deployment for every process until the
+# deadline, instead of each worker discovering the throttle separately.
+#
+# With no limit configured (the default) a call never opens the database
+# unless some process has recorded a Retry-After block, and then only
+# reads the block without taking the write lock.
+#
+# Limits: OPENAI_RPM_LIMIT / OPENAI_TPM_LIMIT for every deployment (0 = no
+# bucket), overridden per deployment with RATE_LIMITS, e.g.
+#   RATE_LIMITS='{"gpt-4o": {"rpm": 480, "tpm": 80000}, "text-embedding-3-small": {"tpm": 350000}}'
+
+# Shared by every process on the host, so it lives outside any one worker's CWD
+RATE_LIMIT_DIR = os.getenv("RATE_LIMIT_DIR", os.path.join(tempfile.gettempdir(), "smartdoc"))
+RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB", os.path.join(RATE_LIMIT_DIR, "rate_limit.sqlite"))
+OPENAI_RPM_LIMIT = int(os.getenv("OPENAI_RPM_LIMIT", "0"))
+OPENAI_TPM_LIMIT = int(os.getenv("OPENAI_TPM_LIMIT", "0"))
+RATE_LIMIT_BATCH_RESERVE = float(os.getenv("RATE_LIMIT_BATCH_RESERVE", "0.2"))
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "120"))
+RATE_LIMIT_MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", "3"))
+# Completion allowance counted against TPM when a call doesn't set max_tokens
+RATE_LIMIT_COMPLETION_TOKENS = int(os.getenv("RATE_LIMIT_COMPLETION_TOKENS", "1000"))
+
+PRIORITIES = ("interactive", "batch")
+_priority = contextvars.ContextVar("rate_limit_priority", default="batch")
+
+
+def _limits_for(deployment):
+    overrides = json.loads(os.getenv("RATE_LIMITS") or "{}").get(deployment, {})
+    return {
+        "rpm": int(overrides.get("rpm", OPENAI_RPM_LIMIT)),
+        "tpm": int(overrides.get("tpm", OPENAI_TPM_LIMIT))
+    }
+
+
+@contextmanager
+def priority(name):
+    """Run OpenAI calls made inside the block (in this thread) at `name` priority."""
+    token = _priority.set(name)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority():
+    return _priority.get()
+
+
+def estimate_tokens(messages=None, text=None, completion_tokens=RATE_LIMIT_COMPLETION_TOKENS):
+    text = (text or "") + "".join(str(m.get("content") or "") for m in messages or [])
+    return estimate_text_tokens(text) + completion_tokens
+
+
+class RateLimiter:
+    def __init__(self, path=RATE_LIMIT_DB):
+        self.path = path
+        self._local = threading.local()
+        self._limits = {}
+        self._stats_lock = threading.Lock()
+        self._stats = {p: {"calls": 0, "waited": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0} for p in PRIORITIES}
+        self._stats["throttled"] = 0
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "key TEXT PRIMARY KEY, level REAL, updated REAL, blocked_until REAL DEFAULT 0)"
+            )
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def limits(self, deployment):
+        if deployment not in self._limits:
+            self._limits[deployment] = _limits_for(deployment)
+        return self._limits[deployment]
+
+    def _unlimited(self, deployment):
+        return all(limit <= 0 for limit in self.limits(deployment).values())
+
+    def _idle(self, deployment):
+        """No bucket to draw from and no block ever recorded: nothing to check."""
+        return self._unlimited(deployment) and not os.path.exists(self.path)
+
+    def _blocked_for(self, deployment):
+        """Seconds left on a Retry-After block, read without the write lock."""
+        row = self._conn().execute("SELECT blocked_until FROM buckets WHERE key = ?", (f"{deployment}:block",)).fetchone()
+        return max(0.0, row[0] - time.time()) if row else 0.0
+
+    # ---------- bucket transaction ----------
+    def _try_take(self, deployment, tokens, prio):
+        """Take from both buckets or neither; returns seconds to wait (0 = taken)."""
+        if self._unlimited(deployment):
+            return self._blocked_for(deployment)
+        limits = self.limits(deployment)
+        wanted = {"rpm": 1, "tpm": tokens}
+        reserve = 0.0 if prio == "interactive" else RATE_LIMIT_BATCH_RESERVE
+        now = time.time()
+
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT blocked_until FROM buckets WHERE key = ?", (f"{deployment}:block",)).fetchone()
+            if row and row[0] > now:
+                conn.execute("COMMIT")
+                return row[0] - now
+
+            levels, wait = {}, 0.0
+            for kind, limit in limits.items():
+                if limit <= 0:
+                    continue
+                rate = limit / 60.0
+                row = conn.execute("SELECT level, updated FROM buckets WHERE key = ?", (f"{deployment}:{kind}",)).fetchone()
+                level = limit if row is None else min(limit, row[0] + (now - row[1]) * rate)
+                # A request bigger than the whole bucket still goes through once it's full
+                amount = min(wanted[kind], limit * (1 - reserve))
+                levels[kind] = (level, amount)
+                short = amount + reserve * limit - level
+                if short > 0:
+                    wait = max(wait, short / rate)
+
+            if wait == 0:
+                for kind, (level, amount) in levels.items():
+                    conn.execute(
+                        "INSERT OR REPLACE INTO buckets (key, level, updated) VALUES (?, ?, ?)",
+                        (f"{deployment}:{kind}", level - amount, now)
+                    )
+            conn.execute("COMMIT")
+            return wait
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def acquire(self, deployment, tokens, prio=None):
+        """Block until the deployment's buckets allow this call; returns seconds waited."""
+        prio = prio or current_priority()
+        started = time.perf_counter()
+        while not self._idle(deployment):
+            try:
+                wait = self._try_take(deployment, tokens, prio)
+            except sqlite3.Error as e:
+                # Never let the limiter take the app down; fall back to unlimited
+                logging.warning(f"⚠️ Rate limiter unavailable: {e}")
+                wait = 0
+            if wait <= 0:
+                break
+            if time.perf_counter() - started + wait > RATE_LIMIT_MAX_WAIT:
+                logging.warning(f"⚠️ Rate limit wait for {deployment} exceeded {RATE_LIMIT_MAX_WAIT}s — sending anyway")
+                break
+            time.sleep(min(wait, 1.0))
+
+        waited = time.perf_counter() - started
+        self._record(prio, waited)
+        return waited
+
+    async def acquire_async(self, deployment, tokens, prio=None):
+        """acquire() for coroutines: the bucket transaction runs in a thread and waits don't block the loop."""
+        prio = prio or current_priority()
+        started = time.perf_counter()
+        while not self._idle(deployment):
+            try:
+                wait = await asyncio.to_thread(self._try_take, deployment, tokens, prio)
+            except sqlite3.Error as e:
+                logging.warning(f"⚠️ Rate limiter unavailable: {e}")
+                wait = 0
+            if wait <= 0:
+                break
+            if time.perf_counter() - started + wait > RATE_LIMIT_MAX_WAIT:
+                logging.warning(f"⚠️ Rate limit wait for {deployment} exceeded {RATE_LIMIT_MAX_WAIT}s — sending anyway")
+                break
+            await asyncio.sleep(min(wait, 1.0))
+
+        waited = time.perf_counter() - started
+        self._record(prio, waited)
+        return waited
+
+    def block(self, deployment, seconds):
+        """Stop every process from calling `deployment` for `seconds` (from Retry-After)."""
+        with self._stats_lock:
+            self._stats["throttled"] += 1
+        try:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT blocked_until FROM buckets WHERE key = ?", (f"{deployment}:block",)).fetchone()
+            until = max(time.time() + seconds, row[0] if row else 0)
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (key, level, updated, blocked_until) VALUES (?, 0, ?, ?)",
+                (f"{deployment}:block", time.time(), until)
+            )
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            logging.warning(f"⚠️ Could not record Retry-After for {deployment}: {e}")
+
+    def _record(self, prio, waited):
+        record_span("rate_limit_wait", waited)
+        with self._stats_lock:
+            stats = self._stats[prio]
+            stats["calls"] += 1
+            if waited > 0.001:
+                stats["waited"] += 1
+                stats["wait_seconds"] += waited
+                stats["max_wait_seconds"] = max(stats["max_wait_seconds"], waited)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = json.loads(json.dumps(self._stats))
+        for prio in PRIORITIES:
+            s = stats[prio]
+            s["avg_wait_seconds"] = round(s["wait_seconds"] / s["calls"], 4) if s["calls"] else 0.0
+            s["wait_seconds"] = round(s["wait_seconds"], 3)
+            s["max_wait_seconds"] = round(s["max_wait_seconds"], 3)
+        stats["limits"] = dict(self._limits)
+        return stats
+
+
+limiter = RateLimiter()
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def call_with_limit(deployment, tokens, fn, *args, **kwargs):
+    """Run an OpenAI SDK call under the limiter, re-queueing on 429.
+
+    The SDK's own retries run first; when it still gives up with a 429, the
+    Retry-After is shared with every process and the call waits its turn again.
+    """
+    delay = 1.0
+    for attempt in range(RATE_LIMIT_MAX_RETRIES + 1):
+        limiter.acquire(deployment, tokens)
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if getattr(e, "status_code", None) != 429 or attempt == RATE_LIMIT_MAX_RETRIES:
+                raise
+            wait = _retry_after(e) or delay
+            logging.warning(f"⚠️ {deployment} throttled (429) — all workers pause {wait:.1f}s")
+            limiter.block(deployment, wait)
+            delay = min(delay * 2, 30)
+
+
+async def acall_with_limit(deployment, tokens, fn, *args, **kwargs):
+    """call_with_limit for async SDK calls (`fn` returns an awaitable)."""
+    delay = 1.0
+    for attempt in range(RATE_LIMIT_MAX_RETRIES + 1):
+        await limiter.acquire_async(deployment, tokens)
+        try:
+            return await fn(*args, **kwargs)
+        except Exception as e:
+            if getattr(e, "status_code", None) != 429 or attempt == RATE_LIMIT_MAX_RETRIES:
+                raise
+            wait = _retry_after(e) or delay
+            logging.warning(f"⚠️ {deployment} throttled (429) — all workers pause {wait:.1f}s")
+            await asyncio.to_thread(limiter.block, deployment, wait)
+            delay = min(delay * 2, 30)
@@ -0,0 +1,394 @@
+import os
+import json
+import asyncio
+import fcntl
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from clients import lazy_import, http_session, async_http_client, post_with_retry, HTTP_TIMEOUT_SECONDS, RETRY_STATUSES
+
+# Retrieval backends for the chat path.
+#
+# Both push_chunks_to_search (write side) and query_azure_search (read side)
+# go through get_backend(), selected with RETRIEVAL_BACKEND:
+#
+#   azure  Azure Cognitive Search, hybrid keyword + vector query (default)
+#   local  float32 matrix on disk, memory-mapped and searched with NumPy
+#
+# A document is a dict with id, content, embedding, source and metadata
+# ("source:<name>;pages:<start>-<end>"), the same shape the Azure index stores.
+#
+# A source is one document's key (its fingerprint, or pdf_id), never the
+# uploaded filename, so two uploads named policy.pdf don't share chunks.
+# search(source=...) only returns that source's chunks on every backend, and
+# an upload replaces whatever was stored for the sources it contains.
+
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "azure")
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "1536"))
+LOCAL_VECTOR_DIR = os.getenv("LOCAL_VECTOR_DIR", "vector_store")
+
+AZURE_SEARCH_API_VERSION = "2023-07-01-Preview"
+
+# The service takes at most 1000 documents and 16 MB per index request
+AZURE_SEARCH_BATCH_DOCS = int(os.getenv("AZURE_SEARCH_BATCH_DOCS", "1000"))
+AZURE_SEARCH_BATCH_BYTES = int(os.getenv("AZURE_SEARCH_BATCH_BYTES", str(12 * 1024 * 1024)))
+AZURE_SEARCH_UPLOAD_CONCURRENCY = int(os.getenv("AZURE_SEARCH_UPLOAD_CONCURRENCY", "4"))
+AZURE_SEARCH_UPLOAD_RETRIES = int(os.getenv("AZURE_SEARCH_UPLOAD_RETRIES", "4"))
+# Per-document codes in a 207 that are worth retrying (version conflict, throttling, unavailable)
+AZURE_SEARCH_RETRYABLE_CODES = {409, 422, 429, 503}
+
+
+def _doc_status(succeeded, status_code, error, retryable=False):
+    return {"succeeded": bool(succeeded), "status_code": status_code, "error": error, "retryable": retryable}
+
+
+def _size_batches(keys, serialized):
+    """Split keys into batches under both the document-count and byte caps."""
+    batches, batch, size = [], [], 0
+    for key in keys:
+        doc_size = len(serialized[key]) + 1
+        if batch and (len(batch) >= AZURE_SEARCH_BATCH_DOCS or size + doc_size > AZURE_SEARCH_BATCH_BYTES):
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append(key)
+        size += doc_size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class RetrievalBackend:
+    def upload(self, documents, replace=True):
+        """Store documents, replacing earlier ones from the same sources.
+
+        One call carries every chunk of each source it contains. Pass
+        replace=False when none of the sources was ever stored, so there is
+        nothing earlier to look for. Returns {id: {"succeeded", "status_code", "error"}}.
+        """
+        raise NotImplementedError
+
+    def search(self, question, query_vector=None, top_k=5, source=None):
+        """Return the content of the `top_k` best chunks for the question."""
+        raise NotImplementedError
+
+    async def search_async(self, question, query_vector=None, top_k=5, source=None):
+        """search() for coroutines; backends without async I/O run it in a thread."""
+        return await asyncio.to_thread(self.search, question, query_vector, top_k, source)
+
+
+# ------------------ AZURE COGNITIVE SEARCH ------------------
+class AzureSearchBackend(RetrievalBackend):
+    def __init__(self):
+        endpoint = os.getenv("AZURE_SEARCH_ENDPOINT")
+        index = os.getenv("AZURE_SEARCH_INDEX") or os.getenv("AZURE_SEARCH_INDEX_NAME")
+        base = f"{endpoint}/indexes/{index}/docs"
+        self.index_url = f"{base}/index?api-version={AZURE_SEARCH_API_VERSION}"
+        self.search_url = f"{base}/search?api-version={AZURE_SEARCH_API_VERSION}"
+        self.headers = {
+            "Content-Type": "application/json",
+            "api-key": os.getenv("AZURE_SEARCH_API_KEY")
+        }
+
+    def upload(self, documents, replace=True):
+        """Upload in size-capped batches, sent concurrently; returns per-document status.
+
+        Documents the service rejects with a transient per-document code in a
+        207 response are retried, alone, with exponential backoff.
+        """
+        serialized = {
+            doc["id"]: json.dumps({"@search.action": "upload", **doc}, separators=(",", ":")).encode()
+            for doc in documents
+        }
+        status = {}
+        pending = list(serialized)
+        requests_sent = 0
+        delay = 1.0
+        for attempt in range(AZURE_SEARCH_UPLOAD_RETRIES + 1):
+            batches = _size_batches(pending, serialized)
+            requests_sent += len(batches)
+            with ThreadPoolExecutor(max_workers=max(1, min(AZURE_SEARCH_UPLOAD_CONCURRENCY, len(batches)))) as pool:
+                for result in pool.map(lambda keys: self._send_batch(keys, serialized), batches):
+                    status.update(result)
+
+            pending = [key for key in pending if not status[key]["succeeded"] and status[key].pop("retryable")]
+            if not pending or attempt == AZURE_SEARCH_UPLOAD_RETRIES:
+                break
+            logging.warning(f"⚠️ {len(pending)} search documents not accepted — retrying in {delay:.1f}s")
+            time.sleep(delay)
+            delay = min(delay * 2, 30)
+
+        for entry in status.values():
+            entry.pop("retryable", None)
+        failed = [key for key, entry in status.items() if not entry["succeeded"]]
+        if failed:
+            print(f"❌ {len(failed)}/{len(status)} chunks rejected by Azure Cognitive Search: "
+                  f"{status[failed[0]]['error']}")
+        else:
+            print(f"✅ {len(status)} chunks uploaded to Azure Cognitive Search in {requests_sent} requests.")
+            if replace:
+                self._delete_stale(documents)
+        return status
+
+    def _delete_stale(self, documents):
+        """Drop documents left over from an earlier, longer upload of the same sources.
+
+        Ids are stable per source and chunk, so re-indexing overwrites in
+        place; only chunks past the new last one remain to be removed. This
+        costs a paged search per source, so it only runs for re-uploads.
+        """
+        keep = {}
+        for doc in documents:
+            keep.setdefault(doc.get("source"), set()).add(doc["id"])
+        keep.pop(None, None)
+        for source, ids in keep.items():
+            try:
+                stale = [key for key in self._source_ids(source) if key not in ids]
+                if stale:
+                    delete = {"value": [{"@search.action": "delete", "id": key} for key in stale]}
+                    post_with_retry(self.index_url, self.headers, json.dumps(delete).encode()).raise_for_status()
+                    logging.info(f"🧹 Removed {len(stale)} stale chunks of {source}")
+            except Exception as e:
+                logging.warning(f"⚠️ Could not remove stale chunks of {source}: {e}")
+
+    def _send_batch(self, keys, serialized):
+        body = b'{"value":[' + b",".join(serialized[key] for key in keys) + b"]}"
+        try:
+            res = post_with_retry(self.index_url, self.headers, body)
+        except requests.RequestException as e:
+            return {key: _doc_status(False, None, str(e), retryable=True) for key in keys}
+
+        if res.status_code == 413 and len(keys) > 1:
+            # Over the service's payload limit despite the byte cap: halve and resend
+            half = len(keys) // 2
+            return {**self._send_batch(keys[:half], serialized), **self._send_batch(keys[half:], serialized)}
+        if res.status_code not in (200, 207):
+            retryable = res.status_code in RETRY_STATUSES
+            return {key: _doc_status(False, res.status_code, res.text[:300], retryable) for key in keys}
+
+        result = {}
+        for item in res.json().get("value", []):
+            code = item.get("statusCode")
+            result[item["key"]] = _doc_status(
+                item.get("status", False), code, item.get("errorMessage"), code in AZURE_SEARCH_RETRYABLE_CODES
+            )
+        for key in keys:
+            result.setdefault(key, _doc_status(False, res.status_code, "missing from index response", True))
+        return result
+
+    def _source_ids(self, source, page=1000):
+        """Ids of every document stored for `source`."""
+        ids, skip = [], 0
+        while True:
+            body = {"search": "*", "filter": _source_filter(source), "select": "id", "top": page, "skip": skip}
+            response = http_session().post(self.search_url, headers=self.headers, json=body, timeout=HTTP_TIMEOUT_SECONDS)
+            response.raise_for_status()
+            batch = [doc["id"] for doc in response.json().get("value", [])]
+            ids += batch
+            if len(batch) < page:
+                return ids
+            skip += page
+
+    def _search_body(self, question, query_vector, top_k, source=None):
+        body = {"search": question, "top": top_k}
+        if query_vector:
+            body["vectors"] = [{"value": query_vector, "fields": "embedding", "k": top_k}]
+        if source is not None:
+            body["filter"] = _source_filter(source)
+        return body
+
+    def search(self, question, query_vector=None, top_k=5, source=None):
+        body = self._search_body(question, query_vector, top_k, source)
+        try:
+            response = http_session().post(self.search_url, headers=self.headers, json=body, timeout=HTTP_TIMEOUT_SECONDS)
+            response.raise_for_status()
+            results = response.json()
+            return [doc["content"] for doc in results.get("value", [])]
+        except Exception as e:
+            print("❌ Azure Search Query Failed:", e)
+            return []
+
+    async def search_async(self, question, query_vector=None, top_k=5, source=None):
+        body = self._search_body(question, query_vector, top_k, source)
+        try:
+            response = await async_http_client().post(self.search_url, headers=self.headers, json=body)
+            response.raise_for_status()
+            results = response.json()
+            return [doc["content"] for doc in results.get("value", [])]
+        except Exception as e:
+            print("❌ Azure Search Query Failed:", e)
+            return []
+
+
+def _source_filter(source):
+    # OData string literals escape a quote by doubling it
+    return "source eq '" + str(source).replace("'", "''") + "'"
+
+
+# ------------------ LOCAL NUMPY INDEX ------------------
+class LocalVectorBackend(RetrievalBackend):
+    """Append-only vector store for single-tenant or offline deployments.
+
+    Files in `directory`:
+      embeddings.f32  row-major float32 matrix, rows L2-normalized at write
+      rows.jsonl      one {"id", "content", "source"} line per matrix row
+      sources.json    source -> list of [start, end) row ranges
+
+    Re-uploading a source appends its new rows and points sources.json at
+    them; the old rows stay in the files but are no longer searched.
+    Writers take an exclusive flock so several workers can share a store.
+    Readers memory-map the matrix and pick up new rows when the file grows.
+    """
+
+    def __init__(self, directory=LOCAL_VECTOR_DIR, dimensions=EMBEDDING_DIMENSIONS):
+        self.directory = directory
+        self.dimensions = dimensions
+        os.makedirs(directory, exist_ok=True)
+        self.matrix_path = os.path.join(directory, "embeddings.f32")
+        self.rows_path = os.path.join(directory, "rows.jsonl")
+        self.sources_path = os.path.join(directory, "sources.json")
+        self.lock_path = os.path.join(directory, ".lock")
+
+        self._lock = threading.Lock()
+        self._matrix = None
+        self._rows = []
+        self._sources = {}
+        self._loaded_rows = -1
+
+    def _row_count_on_disk(self):
+        if not os.path.exists(self.matrix_path):
+            return 0
+        return os.path.getsize(self.matrix_path) // (4 * self.dimensions)
+
+    def _refresh(self):
+        """Re-map the matrix and read new row metadata if the store grew."""
+        n = self._row_count_on_disk()
+        if n == self._loaded_rows:
+            return
+        np = lazy_import("numpy")
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_SH)
+            try:
+                n = self._row_count_on_disk()
+                self._matrix = (
+                    np.memmap(self.matrix_path, dtype=np.float32, mode="r", shape=(n, self.dimensions))
+                    if n else np.zeros((0, self.dimensions), dtype=np.float32)
+                )
+                rows = []
+                if n:
+                    with open(self.rows_path, encoding="utf-8") as f:
+                        rows = [json.loads(line) for line in f][:n]
+                self._rows = rows
+                self._sources = self._read_sources()
+                self._loaded_rows = n
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_sources(self):
+        if not os.path.exists(self.sources_path):
+            return {}
+        with open(self.sources_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def upload(self, documents, replace=True):
+        # Re-pointing sources.json replaces a source at no extra cost, so `replace` isn't needed
+        np = lazy_import("numpy")
+        vectors = np.asarray([doc["embedding"] for doc in documents], dtype=np.float32)
+        if vectors.ndim != 2 or vectors.shape[1] != self.dimensions:
+            logging.error(f"❌ Expected {self.dimensions}-dim embeddings, got {vectors.shape}")
+            error = f"expected {self.dimensions}-dim embedding"
+            return {doc["id"]: {"succeeded": False, "status_code": None, "error": error} for doc in documents}
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms == 0, 1, norms)
+
+        with self._lock, open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                start = self._row_count_on_disk()
+                with open(self.matrix_path, "ab") as f:
+                    f.write(vectors.tobytes())
+                with open(self.rows_path, "a", encoding="utf-8") as f:
+                    for doc in documents:
+                        row = {"id": doc["id"], "content": doc["content"], "source": _source_of(doc)}
+                        f.write(json.dumps(row) + "\n")
+
+                sources = self._read_sources()
+                # Replace, not extend: a re-upload must not leave the previous rows searchable
+                sources.update(_row_ranges(documents, start))
+                with open(self.sources_path, "w", encoding="utf-8") as f:
+                    json.dump(sources, f)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+        print(f"✅ Stored {len(documents)} chunks in local vector index ({self.directory})")
+        return {doc["id"]: {"succeeded": True, "status_code": None, "error": None} for doc in documents}
+
+    def search(self, question, query_vector=None, top_k=5, source=None):
+        if not query_vector:
+            return []
+        with self._lock:
+            self._refresh()
+            matrix, rows, sources = self._matrix, self._rows, self._sources
+
+        if source is not None:
+            ranges = sources.get(source, [])
+        else:
+            ranges = sorted(span for spans in sources.values() for span in spans)
+        if not ranges or not len(rows):
+            return []
+
+        np = lazy_import("numpy")
+        query = np.asarray(query_vector, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1
+
+        # One range (the usual case) is a slice of the memmap, so no copy is made
+        if len(ranges) == 1:
+            s, e = ranges[0]
+            index = np.arange(s, e)
+            candidates = matrix[s:e]
+        else:
+            index = np.concatenate([np.arange(s, e) for s, e in ranges])
+            candidates = matrix[index]
+        scores = candidates @ query
+
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [rows[index[i]]["content"] for i in top]
+
+
+def _source_of(doc):
+    if doc.get("source"):
+        return doc["source"]
+    # "source:<name>" or, from the chunker, "source:<name>;pages:<start>-<end>"
+    metadata = (doc.get("metadata") or "").split(";pages:")[0]
+    return metadata[len("source:"):] if metadata.startswith("source:") else metadata
+
+
+def _row_ranges(documents, start):
+    """Collapse consecutive documents with the same source into [start, end) ranges."""
+    ranges = {}
+    for offset, doc in enumerate(documents):
+        source, row = _source_of(doc), start + offset
+        spans = ranges.setdefault(source, [])
+        if spans and spans[-1][1] == row:
+            spans[-1][1] = row + 1
+        else:
+            spans.append([row, row + 1])
+    return ranges
+
+
+# ------------------ SELECTION ------------------
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = LocalVectorBackend() if RETRIEVAL_BACKEND == "local" else AzureSearchBackend()
+    return _backend
@@ -0,0 +1,353 @@
+import os
+import sys
+import logging
+import argparse
+from datetime import datetime, timedelta, time as dtime
+
+from dotenv import load_dotenv
+
+from Analytics import ANALYTICS_FIELDS, _analytics_query, _empty_analytics, was_extracted
+
+# Per-user daily analytics rollups.
+#
+# One document per (user_id, UTC day) in pdf_data.analytics_rollups:
+#
+#   count                      extraction records that day
+#   conf_sum.<f>/conf_count.<f> field confidence sums (name, contractAmount, issueDate)
+#   review.<f>                 records where the user replaced the AI value
+#   accuracy_sum/_count        ai_data.accuracy sums, for /analytics/trends
+#   min_accuracy               {pdf_id, pdfName, accuracy} of the most-corrected record
+#
+# extract_data and save keep rows current with apply_change(); the analytics
+# routes read O(days) rows. `python rollups.py rebuild` recomputes every row
+# from the raw records and `python rollups.py check` diffs the two.
+#
+# While a rebuild runs, a marker row tells apply_change to also journal the
+# rows it touches. Those increments may land in the collection the rebuild
+# is about to replace, so the rebuild recomputes every journaled day from
+# the raw records once the new rows are in place.
+
+META_ID = "__meta__"
+REBUILD_ID = "__rebuilding__"
+SPECIAL_IDS = [META_ID, REBUILD_ID]
+
+
+def _day(ts):
+    return datetime.combine(ts.date(), dtime.min)
+
+
+def _row_id(user_id, day):
+    return f"{user_id}:{day:%Y-%m-%d}"
+
+
+def contribution(rec):
+    """What one extraction record adds to its day's rollup row."""
+    ai_data = rec.get("ai_data") or {}
+    user_data = rec.get("user_updated_data") or {}
+    confidences = ai_data.get("field_confidences") or {}
+
+    inc = {"count": 1}
+    for field in ANALYTICS_FIELDS:
+        conf = confidences.get(field)
+        if conf is not None:
+            try:
+                inc[f"conf_sum.{field}"] = float(conf)
+                inc[f"conf_count.{field}"] = 1
+            except (TypeError, ValueError):
+                pass
+
+        ai_val, user_val = ai_data.get(field), user_data.get(field)
+        if ai_val and user_val and str(ai_val).strip() != str(user_val).strip():
+            inc[f"review.{field}"] = 1
+
+    if isinstance(ai_data.get("accuracy"), (int, float)) and not isinstance(ai_data.get("accuracy"), bool):
+        inc["accuracy_sum"] = float(ai_data["accuracy"])
+        inc["accuracy_count"] = 1
+
+    corrected = sum(
+        1 for f in ANALYTICS_FIELDS
+        if user_data.get(f) and str(user_data[f]).strip() != str(ai_data.get(f, "")).strip()
+    )
+    day = _day(rec["timestamp"])
+    return {
+        "_id": _row_id(rec.get("user_id"), day),
+        "user_id": rec.get("user_id"),
+        "day": day,
+        "inc": inc,
+        "min_candidate": {
+            "pdf_id": rec.get("pdf_id"),
+            "pdfName": rec.get("pdfName"),
+            "accuracy": round(((3 - corrected) / 3) * 100, 2)
+        }
+    }
+
+
+def _fold(rows, c):
+    """Add a contribution into an in-memory {row_id: row} map (rebuild/check)."""
+    row = rows.setdefault(c["_id"], {"_id": c["_id"], "user_id": c["user_id"], "day": c["day"], "min_accuracy": None})
+    for path, value in c["inc"].items():
+        target, key = row, path
+        if "." in path:
+            parent, key = path.split(".", 1)
+            target = row.setdefault(parent, {})
+        target[key] = target.get(key, 0) + value
+
+    candidate = c["min_candidate"]
+    if candidate["accuracy"] < 100 and (
+        row["min_accuracy"] is None or candidate["accuracy"] < row["min_accuracy"]["accuracy"]
+    ):
+        row["min_accuracy"] = candidate
+
+
+ROLLUP_SOURCE_FIELDS = {
+    "pdf_id": 1, "pdfName": 1, "user_id": 1, "timestamp": 1,
+    "ai_data.field_confidences": 1, "ai_data.accuracy": 1, "ai_data.extractionMethod": 1,
+    **{f"ai_data.{f}": 1 for f in ANALYTICS_FIELDS},
+    **{f"user_updated_data.{f}": 1 for f in ANALYTICS_FIELDS}
+}
+
+
+def compute_rows(pdf_collection, query=None):
+    rows = {}
+    for rec in pdf_collection.find(query or {}, ROLLUP_SOURCE_FIELDS):
+        if _counts(rec):
+            _fold(rows, contribution(rec))
+    return rows
+
+
+def _counts(rec):
+    return bool(rec and rec.get("timestamp") and was_extracted(rec))
+
+
+# ------------------ INCREMENTAL MAINTENANCE ------------------
+def _recompute_day(pdf_collection, rollup_collection, user_id, day):
+    rows = compute_rows(pdf_collection, {"user_id": user_id, "timestamp": {"$gte": day, "$lt": day + timedelta(days=1)}})
+    row_id = _row_id(user_id, day)
+    if row_id in rows:
+        rollup_collection.replace_one({"_id": row_id}, rows[row_id], upsert=True)
+    else:
+        rollup_collection.delete_one({"_id": row_id})
+
+
+def _add(rollup_collection, c, sign=1):
+    rollup_collection.update_one(
+        {"_id": c["_id"]},
+        {
+            "$inc": {k: sign * v for k, v in c["inc"].items()},
+            "$setOnInsert": {"user_id": c["user_id"], "day": c["day"], "min_accuracy": None}
+        },
+        upsert=True
+    )
+    candidate = c["min_candidate"]
+    if sign > 0 and candidate["accuracy"] < 100:
+        rollup_collection.update_one(
+            {"_id": c["_id"], "$or": [
+                {"min_accuracy": None},
+                {"min_accuracy.accuracy": {"$gt": candidate["accuracy"]}}
+            ]},
+            {"$set": {"min_accuracy": candidate}}
+        )
+    if sign < 0:
+        # A day whose last record moved away (e.g. /save restamping it) has no row, as in a rebuild
+        rollup_collection.delete_one({"_id": c["_id"], "count": {"$lte": 0}})
+
+
+def apply_change(pdf_collection, rollup_collection, old=None, new=None):
+    """Move a record's contribution from `old` state to `new` state.
+
+    Call after the raw write. Pass only `new` for inserts. If the old state
+    was its day's minimum-accuracy record, that day is recomputed from the
+    raw records, since a minimum can't be decremented.
+    """
+    try:
+        recomputed = set()
+        if _counts(old):
+            c = contribution(old)
+            row = rollup_collection.find_one({"_id": c["_id"]}, {"min_accuracy": 1})
+            if row and (row.get("min_accuracy") or {}).get("pdf_id") == old.get("pdf_id"):
+                _recompute_day(pdf_collection, rollup_collection, c["user_id"], c["day"])
+                recomputed.add(c["_id"])
+            else:
+                _add(rollup_collection, c, sign=-1)
+
+        touched = [contribution(old)] if _counts(old) else []
+        if _counts(new):
+            c = contribution(new)
+            touched.append(c)
+            if c["_id"] not in recomputed:
+                _add(rollup_collection, c)
+        _journal(rollup_collection, touched)
+    except Exception as e:
+        logging.warning(f"⚠️ Analytics rollup update failed (run `python rollups.py check`): {e}")
+
+
+def _journal_collection(rollup_collection):
+    return rollup_collection.database[f"{rollup_collection.name}_dirty"]
+
+
+def _journal(rollup_collection, contributions):
+    """Note the rows just changed if a rebuild is running; it recomputes them afterwards."""
+    if not contributions or rollup_collection.find_one({"_id": REBUILD_ID}, {"_id": 1}) is None:
+        return
+    journal = _journal_collection(rollup_collection)
+    for c in contributions:
+        journal.update_one(
+            {"_id": c["_id"]},
+            {"$set": {"user_id": c["user_id"], "day": c["day"], "touched_at": datetime.utcnow()}},
+            upsert=True
+        )
+
+
+_ready = False
+
+
+def rollups_ready(rollup_collection):
+    """Rollups are only trusted once a full rebuild has seeded them."""
+    global _ready
+    if not _ready:
+        _ready = rollup_collection.find_one({"_id": META_ID}) is not None
+    return _ready
+
+
+# ------------------ READ SIDE ------------------
+def analytics_from_rollups(rollup_collection, period="month", user_id=None):
+    """Same response as Analytics.calculate_analytics, from daily rows.
+
+    Periods are resolved to whole UTC days (the first day is included in full).
+    """
+    query = _analytics_query(period, user_id)
+    if "timestamp" in query:
+        query["day"] = {"$gte": _day(query.pop("timestamp")["$gte"])}
+    query["_id"] = {"$nin": SPECIAL_IDS}
+    query["count"] = {"$gt": 0}
+
+    total = 0
+    conf_sum, conf_count, reviews = {}, {}, {}
+    lowest = None
+    for row in rollup_collection.find(query):
+        total += row.get("count", 0)
+        for field in ANALYTICS_FIELDS:
+            conf_sum[field] = conf_sum.get(field, 0) + (row.get("conf_sum") or {}).get(field, 0)
+            conf_count[field] = conf_count.get(field, 0) + (row.get("conf_count") or {}).get(field, 0)
+            reviews[field] = reviews.get(field, 0) + (row.get("review") or {}).get(field, 0)
+        candidate = row.get("min_accuracy")
+        if candidate and (lowest is None or candidate["accuracy"] < lowest["accuracy"]):
+            lowest = candidate
+
+    if not total:
+        return _empty_analytics()
+
+    reviewed = {f: n for f, n in reviews.items() if n > 0}
+    return {
+        "total_pdfs": total,
+        "field_confidences": {
+            f: round(conf_sum[f] / conf_count[f], 2) for f in ANALYTICS_FIELDS if conf_count.get(f)
+        },
+        "top_review_fields": sorted(reviewed, key=reviewed.get, reverse=True)[:3],
+        "lowest_accuracy_pdf": (
+            {"pdfName": lowest["pdfName"], "accuracy": lowest["accuracy"]}
+            if lowest else {"pdfName": None, "accuracy": 100.0}
+        )
+    }
+
+
+def trends_from_rollups(rollup_collection, user_id, start_time):
+    rows = rollup_collection.find(
+        {"user_id": user_id, "day": {"$gte": _day(start_time)}, "count": {"$gt": 0}},
+        {"day": 1, "accuracy_sum": 1, "accuracy_count": 1}
+    ).sort("day", 1)
+
+    trend = []
+    for row in rows:
+        count = row.get("accuracy_count", 0)
+        trend.append({
+            "date": row["day"].strftime("%d-%m-%Y"),
+            "avg_accuracy": row.get("accuracy_sum", 0) / count if count else None
+        })
+    return trend
+
+
+# ------------------ REBUILD / CHECK ------------------
+def rebuild(pdf_collection, rollup_collection):
+    """Recompute every rollup row from the raw records and swap them in.
+
+    Changes applied while it runs are journaled (see _journal) and their
+    days recomputed after the swap, so none are lost with the old rows.
+    """
+    marker = {"_id": REBUILD_ID, "started_at": datetime.utcnow()}
+    rollup_collection.replace_one({"_id": REBUILD_ID}, marker, upsert=True)
+
+    rows = compute_rows(pdf_collection)
+    staging = rollup_collection.database[f"{rollup_collection.name}_rebuild"]
+    staging.drop()
+    if rows:
+        staging.insert_many(list(rows.values()))
+    # The marker moves with the swap, so writers keep journaling until the reconcile below
+    staging.insert_many([{"_id": META_ID, "built_at": datetime.utcnow(), "rows": len(rows)}, marker])
+    staging.create_index([("user_id", 1), ("day", 1)])
+    staging.rename(rollup_collection.name, dropTarget=True)
+
+    reconciled = _reconcile(pdf_collection, rollup_collection)
+    rollup_collection.delete_one({"_id": REBUILD_ID})
+    # Writers that saw the marker just before it was removed
+    reconciled += _reconcile(pdf_collection, rollup_collection)
+    if reconciled:
+        logging.info(f"🔁 Recomputed {reconciled} rollup rows changed during the rebuild")
+    return len(rows)
+
+
+def _reconcile(pdf_collection, rollup_collection):
+    """Recompute every journaled row from the raw records; returns how many."""
+    journal = _journal_collection(rollup_collection)
+    done = 0
+    for entry in list(journal.find()):
+        _recompute_day(pdf_collection, rollup_collection, entry["user_id"], entry["day"])
+        # A row touched again meanwhile keeps its (newer) entry for the next pass
+        journal.delete_one({"_id": entry["_id"], "touched_at": entry["touched_at"]})
+        done += 1
+    return done
+
+
+def _normalized(row):
+    row = {k: v for k, v in row.items() if k != "_id"}
+    for parent in ("conf_sum", "conf_count", "review"):
+        row[parent] = {k: round(v, 6) for k, v in (row.get(parent) or {}).items() if v}
+    for key in ("count", "accuracy_sum", "accuracy_count"):
+        row[key] = round(row.get(key, 0), 6)
+    if row.get("min_accuracy"):
+        row["min_accuracy"] = row["min_accuracy"]["accuracy"]
+    return row
+
+
+def check(pdf_collection, rollup_collection, user_id=None):
+    """Diff stored rollups against a fresh computation; returns mismatching row ids."""
+    query = {"user_id": user_id} if user_id else {}
+    expected = compute_rows(pdf_collection, query)
+    # Empty rows are mismatches too: a rebuild never writes a row for a day without records
+    stored = {row["_id"]: row for row in rollup_collection.find({**query, "_id": {"$nin": SPECIAL_IDS}})}
+
+    mismatched = []
+    for row_id in sorted(set(expected) | set(stored)):
+        want, have = expected.get(row_id), stored.get(row_id)
+        if want is None or have is None or _normalized(want) != _normalized(have):
+            mismatched.append(row_id)
+            print(f"❌ {row_id}\n   expected: {want and _normalized(want)}\n   stored:   {have and _normalized(have)}")
+    return mismatched
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Maintain the analytics rollup collection.")
+    parser.add_argument("command", choices=["rebuild", "check"])
+    parser.add_argument("--user", help="limit `check` to one user_id")
+    args = parser.parse_args()
+
+    from pymongo import MongoClient
+
+    db = MongoClient(os.getenv("MONGO_URI"))["pdf_data"]
+    if args.command == "rebuild":
+        print(f"✅ Rebuilt {rebuild(db['extracted_data'], db['analytics_rollups'])} rollup rows")
+    else:
+        bad = check(db["extracted_data"], db["analytics_rollups"], user_id=args.user)
+        print("✅ Rollups match the raw records" if not bad else f"❌ {len(bad)} rollup rows differ")
+        sys.exit(1 if bad else 0)
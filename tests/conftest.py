@@ -0,0 +1,26 @@
+import os
+import sys
+
+# app.py reads these at import time; clients connect lazily, so dummy
+# values are enough for tests that never reach Azure or Mongo
+os.environ.setdefault("AZURE_OPENAI_API_KEY", "test")
+os.environ.setdefault("AZURE_OPENAI_ENDPOINT", "https://test.openai.azure.com")
+os.environ.setdefault("AZURE_API_VERSION", "2024-02-01")
+os.environ.setdefault("MONGO_ENSURE_INDEXES", "false")
+os.environ.setdefault("EXTRACT_WORKERS_AUTOSTART", "false")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mongomock  # noqa: E402
+import pytest  # noqa: E402
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """A mongomock pdf_data database standing in for app's collections."""
+    import app
+
+    db = mongomock.MongoClient()["pdf_data"]
+    monkeypatch.setattr(app, "pdf_collection", db["extracted_data"])
+    monkeypatch.setattr(app, "rollup_collection", db["analytics_rollups"])
+    return db
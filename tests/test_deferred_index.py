@@ -0,0 +1,92 @@
+import time
+from types import SimpleNamespace as NS
+
+import pytest
+
+import app
+from chat_cache import AnswerCache
+
+PAGES = [{"page": 1, "text": "Policy schedule", "is_empty": False}]
+STATS = {"page_count": 1, "word_count": 2, "text": "Policy schedule"}
+
+
+@pytest.fixture
+def stages(monkeypatch):
+    monkeypatch.setattr(app, "upload_to_blob", lambda source, filename: None)
+    monkeypatch.setattr(app, "parse_pdf", lambda source: (PAGES, STATS))
+    monkeypatch.setattr(app, "ocr_if_needed", lambda source, pages, stats: stats)
+    monkeypatch.setattr(app, "extract_fields", lambda pages, text: {"policyNumber": "P1"})
+
+
+def wait_for_index(db, pdf_id, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        record = db["extracted_data"].find_one({"pdf_id": pdf_id})
+        if record["indexStatus"] != "pending":
+            return record
+        time.sleep(0.01)
+    pytest.fail("deferred index stage never reported back")
+
+
+def test_deferred_index_marks_the_record_done(db, stages, monkeypatch):
+    monkeypatch.setattr(app, "index_pages", lambda pages, source, **kwargs: {"c0": {"succeeded": True}})
+    app.run_extraction(b"%PDF", "a.pdf", "u1", "pdf-1", fingerprint="f1", defer_index=True)
+
+    record = wait_for_index(db, "pdf-1")
+    assert record["indexStatus"] == "done"
+    assert record["indexedAt"] is not None
+
+
+def test_deferred_index_failure_is_recorded(db, stages, monkeypatch):
+    def broken(pages, source, **kwargs):
+        raise RuntimeError("search unavailable")
+
+    monkeypatch.setattr(app, "index_pages", broken)
+    app.run_extraction(b"%PDF", "a.pdf", "u1", "pdf-2", fingerprint="f2", defer_index=True)
+
+    record = wait_for_index(db, "pdf-2")
+    assert record["indexStatus"] == "failed"
+    assert record["indexError"] == "search unavailable"
+
+
+def test_inline_index_is_done_at_save(db, stages, monkeypatch):
+    monkeypatch.setattr(app, "index_pages", lambda pages, source, **kwargs: {"c0": {"succeeded": False, "error": "throttled"}})
+    app.run_extraction(b"%PDF", "a.pdf", "u1", "pdf-3", fingerprint="f3", defer_index=False)
+
+    record = db["extracted_data"].find_one({"pdf_id": "pdf-3"})
+    assert record["indexStatus"] == "failed"
+    assert record["indexError"] == "1 of 1 chunks failed: throttled"
+
+
+def test_summary_only_answers_are_not_cached(db, monkeypatch):
+    db["extracted_data"].insert_one({
+        "pdf_id": "pdf-4", "ai_data": {}, "timestamp": "t0", "searchSource": "f4",
+        "indexStatus": "pending", "indexedAt": None
+    })
+    chunks = []
+    monkeypatch.setattr(app, "answer_cache", AnswerCache())
+    monkeypatch.setattr(app, "get_embeddings_cached", lambda texts: [[0.1, 0.2]])
+    monkeypatch.setattr(app, "query_azure_search", lambda question, source=None, query_vector=None: chunks)
+    monkeypatch.setattr(app, "create_chat_completion", lambda **kwargs: NS(
+        choices=[NS(message=NS(content="an answer"))]
+    ))
+    client = app.app.test_client()
+    ask = {"pdf_id": "pdf-4", "question": "What is the policy number?"}
+
+    assert client.post("/chat", json=ask).headers["X-Cache"] == "MISS"
+    assert client.post("/chat", json=ask).headers["X-Cache"] == "MISS"
+
+    # Once the chunks land the revision changes and answers are cached again
+    chunks.append("Policy No : 512345678")
+    db["extracted_data"].update_one({"pdf_id": "pdf-4"}, {"$set": app.index_fields({})})
+    assert client.post("/chat", json=ask).headers["X-Cache"] == "MISS"
+    assert client.post("/chat", json=ask).headers["X-Cache"] == "HIT"
+
+
+def test_only_a_source_indexed_before_is_swept_for_stale_chunks(db, stages, monkeypatch):
+    calls = []
+    monkeypatch.setattr(app, "index_pages", lambda pages, source, replace=True: calls.append(replace) or {})
+    app.run_extraction(b"%PDF", "a.pdf", "u1", "pdf-4", fingerprint="f4", defer_index=False)
+    app.run_extraction(b"%PDF", "b.pdf", "u1", "pdf-5", fingerprint="f4", defer_index=False)
+    app.run_extraction(b"%PDF", "c.pdf", "u1", "pdf-6", defer_index=False)
+    assert calls == [False, True, False]
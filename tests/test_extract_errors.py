@@ -0,0 +1,67 @@
+import io
+
+import pytest
+
+import app
+import asgi
+from jobs import QueueFull
+from large_files import MemoryLimitExceeded
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+@pytest.fixture
+def asgi_client():
+    from starlette.testclient import TestClient
+    return TestClient(asgi.app)
+
+
+def upload(size=64, **form):
+    return {"pdf": (io.BytesIO(b"%PDF-" + b"0" * size), "policy.pdf"), "user_id": "u1", "force": "true",
+            "async": "false", **form}
+
+
+def test_oversize_upload_is_413(client, monkeypatch):
+    monkeypatch.setitem(app.app.config, "MAX_CONTENT_LENGTH", 1024)
+    response = client.post("/extract", data=upload(size=4096), content_type="multipart/form-data")
+    assert response.status_code == 413
+    assert response.get_json() == {"error": "Upload too large"}
+
+
+def test_memory_limit_is_503(client, monkeypatch):
+    def over_limit(*args, **kwargs):
+        raise MemoryLimitExceeded("llm", 900 * 1024 * 1024, 512 * 1024 * 1024)
+
+    monkeypatch.setattr(app, "run_extraction", over_limit)
+    response = client.post("/extract", data=upload(), content_type="multipart/form-data")
+    assert response.status_code == 503
+    assert "Memory limit exceeded before llm" in response.get_json()["error"]
+
+
+def test_asgi_rejects_oversize_body_before_parsing_it(asgi_client, monkeypatch):
+    monkeypatch.setitem(app.app.config, "MAX_CONTENT_LENGTH", 1024)
+
+    async def parsed(self, *args, **kwargs):
+        raise AssertionError("form parsed")
+
+    monkeypatch.setattr("starlette.requests.Request.form", parsed)
+    response = asgi_client.post("/extract", files={"pdf": ("policy.pdf", b"%PDF-" + b"0" * 4096)},
+                                data={"user_id": "u1"})
+    assert response.status_code == 413
+    assert response.json() == {"error": "Upload too large"}
+
+
+def test_both_frontends_shed_a_full_queue_the_same_way(client, asgi_client, monkeypatch):
+    def full(*args, **kwargs):
+        raise QueueFull(retry_after=7)
+
+    monkeypatch.setattr(app.extract_jobs, "submit_upload", full)
+    flask = client.post("/extract", data=upload(**{"async": "true"}), content_type="multipart/form-data")
+    starlette = asgi_client.post("/extract", files={"pdf": ("policy.pdf", b"%PDF-0")},
+                                 data={"user_id": "u1", "force": "true", "async": "true"})
+    assert flask.status_code == starlette.status_code == 503
+    assert flask.headers["Retry-After"] == starlette.headers["Retry-After"] == "7"
+    assert flask.get_data() == starlette.content
@@ -0,0 +1,61 @@
+import pytest
+
+import app
+from field_rules import run_rules, rules_suffice, fill_missing
+
+LIC_SCHEDULE = """LIFE INSURANCE CORPORATION OF INDIA
+POLICY SCHEDULE
+Policy No : 512345678
+Name of the Life Assured : Ramesh Kumar Sharma
+Date of Commencement : 15/06/2024
+Date of Maturity : 15/06/2044
+Sum Assured : Rs. 5,00,000
+Instalment Premium : Rs. 12,450 yearly
+"""
+
+
+def pages_of(text):
+    return [{"text": text, "is_empty": False}]
+
+
+def test_lic_template_clears_every_required_field():
+    rules = run_rules(LIC_SCHEDULE)
+    assert rules["_template"] == "lic"
+    assert rules["policyNumber"] == {"value": "512345678", "confidence": 95}
+    assert rules_suffice(rules)
+
+
+def test_lic_schedule_skips_the_llm(monkeypatch):
+    def no_llm(*args, **kwargs):
+        pytest.fail("GPT was called for a schedule the rules cover")
+
+    monkeypatch.setattr(app, "request_extraction", no_llm)
+    monkeypatch.setattr(app, "run_map_reduce", no_llm)
+
+    ai_data = app.extract_fields(pages_of(LIC_SCHEDULE), LIC_SCHEDULE)
+    assert ai_data["extractionMethod"] == "rules"
+    assert ai_data["policyNumber"] == "512345678"
+    assert ai_data["providerName"] == "LIC"
+    assert ai_data["issueDate"] == "15-06-2024"
+
+
+def test_generic_rules_alone_still_call_the_llm(monkeypatch):
+    text = "Policy Number: ABC123456\nDate of Issue: 01/01/2024\n"
+    calls = []
+
+    def fake_extraction(text):
+        calls.append(text)
+        return {"policyNumber": {"value": "ABC123456", "confidence": 99}}, "{}"
+
+    monkeypatch.setattr(app, "request_extraction", fake_extraction)
+    ai_data = app.extract_fields(pages_of(text), text)
+    assert calls
+    assert ai_data["extractionMethod"] == "llm"
+
+
+def test_fill_missing_only_touches_premium_fields():
+    rules = run_rules(LIC_SCHEDULE)
+    parsed = fill_missing({"policyNumber": {"value": None, "confidence": 0}}, rules)
+    assert parsed["policyNumber"] == {"value": None, "confidence": 0}
+    assert parsed["premiumAmount"] == {"value": "Rs. 5,00,000", "confidence": 95}
+    assert parsed["deductibles"]["value"] == "Rs. 12,450 yearly"
@@ -0,0 +1,90 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+import gridfs
+import mongomock
+import mongomock.gridfs
+import pytest
+
+from jobs import MongoJobQueue
+
+mongomock.gridfs.enable_gridfs_integration()
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return
+        time.sleep(0.01)
+    pytest.fail("timed out")
+
+
+@pytest.fixture
+def jobs_db():
+    return mongomock.MongoClient()["pdf_data"]
+
+
+def make_queue(db, handler, tmp_path, **kwargs):
+    queue = MongoJobQueue(db["extract_jobs"], handler, job_dir=str(tmp_path / "jobs"), **kwargs)
+    queue.POLL_INTERVAL = 0.02
+    return queue
+
+
+def upload(tmp_path, name="upload.pdf"):
+    path = tmp_path / name
+    path.write_bytes(b"%PDF-1.4 test")
+    return str(path)
+
+
+def test_lapsed_lease_is_reclaimed_and_keeps_its_upload(jobs_db, tmp_path):
+    started, release = [], {1: threading.Event(), 2: threading.Event()}
+
+    def handler(payload, progress):
+        attempt = len(started) + 1
+        with open(payload["path"], "rb") as f:
+            assert f.read() == b"%PDF-1.4 test"
+        started.append(attempt)
+        release[attempt].wait(5)
+        return {"attempt": attempt}
+
+    queue = make_queue(jobs_db, handler, tmp_path, workers=2)
+    job_id = queue.submit_upload(upload(tmp_path), {"pdf_id": "p1"})
+    wait_until(lambda: started == [1])
+
+    # The first worker stops renewing (say it hung); its lease lapses and another worker claims the job
+    jobs = jobs_db["extract_jobs"]
+    jobs.update_one({"job_id": job_id}, {"$set": {"lease_until": datetime.utcnow() - timedelta(seconds=1)}})
+    wait_until(lambda: started == [1, 2])
+    assert jobs.find_one({"job_id": job_id})["attempts"] == 2
+
+    # The stale worker finishing neither overwrites the job nor deletes the upload the new claimant reads
+    release[1].set()
+    time.sleep(0.2)
+    job = queue.get(job_id)
+    assert job["status"] == "running"
+    file_id = jobs.find_one({"job_id": job_id})["payload"]["file_id"]
+    assert gridfs.GridFSBucket(jobs_db, bucket_name="extract_job_uploads").open_download_stream(file_id).read()
+
+    release[2].set()
+    wait_until(lambda: queue.get(job_id)["status"] == "done")
+    assert queue.get(job_id)["result"] == {"attempt": 2}
+    with pytest.raises(gridfs.errors.NoFile):
+        gridfs.GridFSBucket(jobs_db, bucket_name="extract_job_uploads").open_download_stream(file_id)
+
+
+def test_job_is_abandoned_after_max_attempts(jobs_db, tmp_path):
+    calls = []
+    queue = make_queue(jobs_db, lambda payload, progress: calls.append(payload), tmp_path,
+                       workers=1, max_attempts=2)
+    stored = queue._store_upload("j1", upload(tmp_path))
+    jobs_db["extract_jobs"].insert_one({
+        "job_id": "j1", "status": "running", "attempts": 2, "payload": stored,
+        "lease_id": "gone", "lease_until": datetime.utcnow() - timedelta(seconds=1), "created_at": datetime.utcnow()
+    })
+
+    queue.start()
+    wait_until(lambda: queue.get("j1")["status"] == "failed")
+    assert queue.get("j1")["error"] == "Worker lost 2 times"
+    assert calls == []
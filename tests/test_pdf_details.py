@@ -0,0 +1,41 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import app
+
+START = datetime(2026, 10, 1, 12, 0)
+
+
+@pytest.fixture
+def pdfs(db):
+    # Pairs share a timestamp so pages have to break ties on _id
+    db["extracted_data"].insert_many([
+        {"pdf_id": f"p{i}", "pdfName": f"{i}.pdf", "user_id": "u1", "timestamp": START + timedelta(hours=i // 2),
+         "pageCount": 1, "wordCount": 10, "ai_data": {"accuracy": 90}}
+        for i in range(7)
+    ] + [{"pdf_id": "other", "pdfName": "x.pdf", "user_id": "u2", "timestamp": START, "ai_data": {}}])
+    newest_first = db["extracted_data"].find({"user_id": "u1"}).sort(app.PDF_DETAILS_SORT)
+    return [pdf["pdfName"] for pdf in newest_first]
+
+
+def post(body):
+    return app.app.test_client().post("/analytics/pdf-details", json=body).get_json()
+
+
+def test_cursor_pages_cover_every_row_once(pdfs):
+    seen, cursor = [], None
+    while True:
+        page = post({"user_id": "u1", "limit": 3, **({"cursor": cursor} if cursor else {})})
+        seen += [pdf["pdfName"] for pdf in page["pdfs"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == pdfs
+
+
+def test_no_limit_returns_every_row(pdfs, monkeypatch):
+    monkeypatch.setattr(app, "PDF_DETAILS_PAGE_SIZE", 2)
+    page = post({"user_id": "u1"})
+    assert [pdf["pdfName"] for pdf in page["pdfs"]] == pdfs
+    assert page["next_cursor"] is None
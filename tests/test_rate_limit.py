@@ -0,0 +1,25 @@
+import time
+
+import app
+import rate_limit
+from metrics import STAGE_SECONDS
+
+
+def stage_seconds(name):
+    series = STAGE_SECONDS._series.get((name,))
+    return series[-2] if series else 0.0
+
+
+def test_limiter_wait_is_not_counted_as_openai_latency(monkeypatch, tmp_path):
+    limiter = rate_limit.RateLimiter(str(tmp_path / "rate_limit.sqlite"))
+    waits = iter([0.2, 0])
+    monkeypatch.setattr(limiter, "_idle", lambda deployment: False)
+    monkeypatch.setattr(limiter, "_try_take", lambda *args: next(waits))
+    monkeypatch.setattr(rate_limit, "limiter", limiter)
+    monkeypatch.setattr(app.client_azure.chat.completions, "create", lambda **kwargs: time.sleep(0.05) or "ok")
+
+    waited, called = stage_seconds("rate_limit_wait"), stage_seconds("openai")
+    assert app.create_chat_completion(messages=[{"role": "user", "content": "hi"}]) == "ok"
+
+    assert stage_seconds("rate_limit_wait") - waited >= 0.2
+    assert 0.05 <= stage_seconds("openai") - called < 0.2
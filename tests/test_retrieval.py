@@ -0,0 +1,50 @@
+from retrieval import LocalVectorBackend
+
+DIMS = 4
+
+
+def doc(source, n, vector):
+    return {"id": f"{source}-{n}", "content": f"{source} chunk {n}", "source": source, "embedding": vector}
+
+
+def test_local_search_stays_inside_the_source(tmp_path):
+    backend = LocalVectorBackend(str(tmp_path), dimensions=DIMS)
+    backend.upload([doc("a", 0, [1, 0, 0, 0]), doc("a", 1, [0, 1, 0, 0])])
+    backend.upload([doc("b", 0, [1, 0, 0, 0])])
+
+    assert backend.search("q", [1, 0, 0, 0], top_k=5, source="a") == ["a chunk 0", "a chunk 1"]
+    assert backend.search("q", [1, 0, 0, 0], top_k=5, source="b") == ["b chunk 0"]
+    assert backend.search("q", [1, 0, 0, 0], top_k=5, source="missing") == []
+    assert sorted(backend.search("q", [1, 0, 0, 0], top_k=5)) == ["a chunk 0", "a chunk 1", "b chunk 0"]
+
+
+def test_reupload_replaces_the_source_for_every_reader(tmp_path):
+    writer = LocalVectorBackend(str(tmp_path), dimensions=DIMS)
+    reader = LocalVectorBackend(str(tmp_path), dimensions=DIMS)
+    writer.upload([doc("a", 0, [1, 0, 0, 0]), doc("a", 1, [0, 1, 0, 0]), doc("b", 0, [0, 0, 1, 0])])
+    assert len(reader.search("q", [1, 0, 0, 0], top_k=5, source="a")) == 2
+
+    # A shorter re-upload of "a" (another worker's write) hides the old rows
+    writer.upload([{**doc("a", 0, [0, 0, 0, 1]), "content": "a v2"}])
+    assert reader.search("q", [0, 0, 0, 1], top_k=5, source="a") == ["a v2"]
+    assert reader.search("q", [0, 0, 1, 0], top_k=5, source="b") == ["b chunk 0"]
+
+
+def test_azure_upload_skips_the_stale_sweep_for_new_sources(monkeypatch):
+    import retrieval
+
+    class Response:
+        status_code = 200
+
+        def json(self):
+            return {"value": [{"key": "a-0", "status": True, "statusCode": 201}]}
+
+    monkeypatch.setattr(retrieval, "post_with_retry", lambda url, headers, body: Response())
+    backend = retrieval.AzureSearchBackend()
+    swept = []
+    monkeypatch.setattr(backend, "_source_ids", lambda source: swept.append(source) or [])
+
+    backend.upload([doc("a", 0, [1, 0, 0, 0])], replace=False)
+    assert swept == []
+    backend.upload([doc("a", 0, [1, 0, 0, 0])])
+    assert swept == ["a"]
@@ -0,0 +1,62 @@
+from datetime import datetime
+
+import pytest
+
+import app
+import rollups
+
+OLD_DAY = datetime(2026, 10, 15, 9, 30)
+
+
+def record(pdf_id, ts, accuracy=90.0, **extra):
+    return {
+        "pdf_id": pdf_id, "pdfName": f"{pdf_id}.pdf", "user_id": "u1", "timestamp": ts,
+        "ai_data": {"accuracy": accuracy, "field_confidences": {"name": 90, "issueDate": 80}, "name": "A"},
+        **extra
+    }
+
+
+@pytest.fixture
+def seeded(db):
+    for rec in (record("a", OLD_DAY), record("b", OLD_DAY.replace(day=16), accuracy=70.0)):
+        db["extracted_data"].insert_one(rec)
+        rollups.apply_change(db["extracted_data"], db["analytics_rollups"], new=rec)
+    db["analytics_rollups"].insert_one({"_id": rollups.META_ID})
+    return db
+
+
+def trend(ready, monkeypatch):
+    monkeypatch.setattr(app, "rollups_ready", lambda collection: ready)
+    response = app.app.test_client().post("/analytics/trends", json={"user_id": "u1", "filter": "all"})
+    return response.get_json()["trend"]
+
+
+def test_increments_and_decrements_match_a_rebuild(seeded):
+    pdfs, rows = seeded["extracted_data"], seeded["analytics_rollups"]
+    old = pdfs.find_one({"pdf_id": "a"})
+    new = {**old, "user_updated_data": {"name": "B"}}
+    pdfs.replace_one({"pdf_id": "a"}, new)
+    rollups.apply_change(pdfs, rows, old=old, new=new)
+
+    row = rows.find_one({"_id": "u1:2026-10-15"})
+    assert row["count"] == 1
+    assert row["review"]["name"] == 1
+    assert rollups.check(pdfs, rows) == []
+
+
+def test_save_moving_a_record_to_today_drops_the_empty_day(seeded, monkeypatch):
+    response = app.app.test_client().post("/save", json={
+        "user_id": "u1", "pdf_id": "a", "user_updated_data": {"name": "B"}
+    })
+    assert response.status_code == 200
+
+    rows = seeded["analytics_rollups"]
+    assert rows.find_one({"_id": "u1:2026-10-15"}) is None
+    assert rollups.check(seeded["extracted_data"], rows) == []
+    assert trend(True, monkeypatch) == trend(False, monkeypatch)
+
+
+def test_check_reports_empty_rows(seeded):
+    seeded["analytics_rollups"].insert_one({"_id": "u1:2026-10-01", "user_id": "u1", "day": datetime(2026, 10, 1),
+                                            "count": 0})
+    assert rollups.check(seeded["extracted_data"], seeded["analytics_rollups"]) == ["u1:2026-10-01"]
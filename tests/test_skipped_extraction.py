@@ -0,0 +1,38 @@
+from datetime import datetime
+
+import app
+import rollups
+from Analytics import analytics_pipeline, calculate_analytics_scan, EXTRACTED_QUERY, SKIPPED_EXTRACTION
+
+
+def bulk_record(pdf_id, ai_data, version=None):
+    # The shape bulk_ingest._save writes
+    return {"pdf_id": pdf_id, "pdfName": f"{pdf_id}.pdf", "user_id": "u1", "timestamp": datetime.utcnow(),
+            "fingerprint": "f1", "extractionVersion": version, "searchSource": "f1", "ai_data": ai_data}
+
+
+def test_no_extract_records_are_not_reused(db):
+    db["extracted_data"].insert_one(
+        bulk_record("skipped", {"extractionMethod": SKIPPED_EXTRACTION}, version=app.EXTRACTION_VERSION)
+    )
+    assert app.reuse_prior_extraction("f1", "again.pdf", "u2", "new") is None
+
+    db["extracted_data"].insert_one(bulk_record("done", {"extractionMethod": "llm", "name": "A"},
+                                                version=app.EXTRACTION_VERSION))
+    assert app.reuse_prior_extraction("f1", "again.pdf", "u2", "new") == {"extractionMethod": "llm", "name": "A"}
+
+
+def test_no_extract_records_stay_out_of_analytics(db):
+    pdfs, rows = db["extracted_data"], db["analytics_rollups"]
+    skipped = bulk_record("skipped", {"extractionMethod": SKIPPED_EXTRACTION})
+    extracted = bulk_record("done", {"extractionMethod": "llm", "accuracy": 90.0,
+                                     "field_confidences": {"name": 80}, "name": "A"})
+    for rec in (skipped, extracted):
+        pdfs.insert_one(rec)
+        rollups.apply_change(pdfs, rows, new=rec)
+
+    assert sum(row["count"] for row in rows.find()) == 1
+    assert rollups.check(pdfs, rows) == []
+    assert calculate_analytics_scan(pdfs, "all", "u1")["total_pdfs"] == 1
+    # mongomock can't run the aggregation ($convert); its $match must exclude them the same way
+    assert analytics_pipeline({"user_id": "u1"})[0] == {"$match": {"user_id": "u1", **EXTRACTED_QUERY}}
@@ -0,0 +1,14 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ("numpy", "pymongo", "bson", "fitz", "openai", "azure.storage.blob")
+
+
+def test_app_import_leaves_heavy_modules_for_first_use():
+    # A fresh interpreter, since this one has already imported them for other tests
+    code = f"import sys, app; print(sorted(m for m in {HEAVY!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=os.environ.copy(),
+                            capture_output=True, text=True, check=True)
+    assert result.stdout.strip().splitlines()[-1] == "[]"